@@ -0,0 +1,174 @@
+# synthetic inputs for the offline benchmark (see benchmark.py)
+# - DWD station zips in the KL format: ";"-separated, MESS_DATUM as YYYYMMDD(HH), -999 sentinels, QN_* quality flags,
+#   a "produkt_*" data member and "Metadaten_*" members, laid out like the directories on opendata.dwd.de
+# - a Kaggle-format charts zip ("Database to calculate popularity.csv" with an unnamed index column)
+# - a local FTP stand-in that serves the DWD tree (pyftpdlib in a separate process, so it doesn't compete for the GIL)
+# - small charts, audio features and weather tables in a database, for the tests of the analysis code
+
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import zipfile
+
+from charts_ingest import MEMBER_NAME as CHARTS_MEMBER_NAME
+from data_access import AUDIO_FEATURES
+from db_schema import SCHEMA, append_rows
+from rollups import ensure_rollup, value_columns
+
+
+FIRST_DAY = pd.Timestamp("2016-06-01")
+LAST_DAY = pd.Timestamp("2021-06-30")
+SENTINEL_SHARE: float = 0.02  # share of values replaced by -999
+COUNTRIES: list[str] = ["Germany", "Austria", "Switzerland", "France", "Global"]
+
+
+def write_station_zip(directory: str, data_src: dict, stations_id: int, rng: np.random.Generator,
+                      first_day: pd.Timestamp = FIRST_DAY, last_day: pd.Timestamp = LAST_DAY) -> str:
+    """Writes the zip of one station of a DWD data source (observations from first_day to last_day) and returns its
+    path."""
+    # daily sources have one row per day, subdaily sources one row per observation term (06, 12, 18 UTC)
+    daily: bool = "/daily/" in data_src["path"]
+    if daily:
+        timestamps = pd.date_range(first_day, last_day, freq="D")
+        mess_datum = timestamps.strftime("%Y%m%d")
+    else:
+        days = pd.date_range(first_day, last_day, freq="D")
+        timestamps = (days.values[:, None] + np.array([6, 12, 18], dtype="timedelta64[h]")).ravel()
+        mess_datum = pd.DatetimeIndex(timestamps).strftime("%Y%m%d%H")
+    n: int = len(mess_datum)
+
+    df = pd.DataFrame({"STATIONS_ID": stations_id, "MESS_DATUM": mess_datum,
+                       data_src["quality_column"]: rng.choice([1, 3, 5, 10], n)})
+    for col in data_src["columns"][2:]:
+        if data_src["dtypes"][col].startswith("Int"):
+            values = rng.integers(0, 9, n)
+        else:
+            values = np.round(rng.normal(10, 5, n), 1)
+        values[rng.random(n) < SENTINEL_SHARE] = -999
+        df[col] = values
+    df["eor"] = "eor"
+
+    start, end = first_day.strftime("%Y%m%d"), last_day.strftime("%Y%m%d")
+    path: str = os.path.join(directory, f"{data_src['name']}_{stations_id:05d}_{start}_{end}_hist.zip")
+    # a station has the same location in every data source
+    location = np.random.default_rng(stations_id)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(f"produkt_{data_src['name']}_{start}_{end}_{stations_id:05d}.txt", df.to_csv(sep=";", index=False))
+        zip_ref.writestr(f"Metadaten_Geographie_{stations_id:05d}.txt",
+                         "Stations_id;Stationshoehe;Geogr.Breite;Geogr.Laenge;von_datum;bis_datum;Stationsname\n"
+                         f"{stations_id};{location.integers(0, 2000)};{location.uniform(47, 55):.4f};"
+                         f"{location.uniform(6, 15):.4f};{start};{end};Station {stations_id}\n")
+    return path
+
+
+def make_dwd_tree(root: str, data_sources: list, stations: int, seed: int = 0) -> int:
+    """Writes `stations` station zips per data source below `root`, mirroring the server paths.
+
+    Returns the total number of bytes written.
+    """
+    rng = np.random.default_rng(seed)
+    total: int = 0
+    for data_src in data_sources:
+        directory: str = os.path.join(root, data_src["path"])
+        os.makedirs(directory, exist_ok=True)
+        for stations_id in range(1, stations + 1):
+            total += os.path.getsize(write_station_zip(directory, data_src, stations_id, rng))
+        # a file outside of the observation period, which the downloader has to filter out
+        with open(os.path.join(directory, f"{data_src['name']}_99999_19500101_19601231_hist.zip"), "wb") as f:
+            f.write(b"not in timeframe")
+    return total
+
+
+def make_charts_zip(path: str, days: int, tracks: int, seed: int = 0) -> int:
+    """Writes a Kaggle-format charts zip with 200 positions per day and country. Returns the number of rows."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2017-01-01", periods=days, freq="D").strftime("%d/%m/%Y")
+    n: int = days * len(COUNTRIES) * 200
+    track_ids = np.array([f"{i:022d}" for i in range(tracks)])
+    chosen = rng.integers(0, tracks, n)
+    df = pd.DataFrame({
+        "country": np.repeat(COUNTRIES, days * 200),
+        "date": np.tile(np.repeat(dates, 200), len(COUNTRIES)),
+        "position": np.tile(np.arange(1, 201), days * len(COUNTRIES)),
+        "uri": np.char.add("https://open.spotify.com/track/", track_ids[chosen]),
+        "title": np.char.add("Title ", chosen.astype(str)),
+        "artist": np.char.add("Artist ", (chosen % 500).astype(str)),
+    })
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(CHARTS_MEMBER_NAME, df.to_csv())
+    return n
+
+
+def write_analysis_tables(engine, data_sources: list, days: int = 20, tracks: int = 12, seed: int = 0):
+    """Writes charts with 10 positions per day, audio features of all but the last two tracks and two stations of
+    weather (except on the last three days) with their daily rollups."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=days, freq="D")
+    track_ids = np.array([f"{i:022d}" for i in range(tracks)])
+    charts = pd.DataFrame({"date": np.repeat(dates, 10), "position": np.tile(np.arange(1, 11), days),
+                           "track_id": track_ids[rng.integers(0, tracks, days * 10)]})
+    charts.loc[5, "track_id"] = None
+    audio = pd.DataFrame({col: rng.integers(0, 12, tracks - 2) if SCHEMA["audio_features"].columns[col] == "INTEGER"
+                          else rng.random(tracks - 2) for col in AUDIO_FEATURES})
+    audio.insert(0, "track_id", track_ids[:-2])
+
+    with engine.begin() as connection:
+        append_rows(connection, "spotify_data", charts)
+        append_rows(connection, "audio_features", audio)
+        for data_src in data_sources:
+            value_cols: list[str] = value_columns(list(SCHEMA[data_src["name"]].columns))
+            timestamps = (dates.values[:-3, None] + np.array([6, 18], dtype="timedelta64[h]")).ravel()
+            rows = pd.DataFrame({"stations_id": np.repeat([1, 2], len(timestamps)),
+                                 "mess_datum": np.tile(timestamps, 2)})
+            for col in value_cols:
+                values = np.round(rng.normal(10, 5, len(rows)), 1)
+                values[rng.random(len(rows)) < 0.1] = -999
+                rows[col] = values
+            append_rows(connection, data_src["name"], rows)
+            ensure_rollup(connection, data_src["name"], value_cols)
+
+
+def _serve_ftp(root: str, ports, mlsd: bool):
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+    import logging
+
+    # pyftpdlib logs every session unless its logger already has a handler
+    logging.getLogger("pyftpdlib").addHandler(logging.NullHandler())
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    handler = FTPHandler
+    if not mlsd:
+        # like servers that only know NLST, SIZE and MDTM
+        proto_cmds: dict = {cmd: spec for cmd, spec in FTPHandler.proto_cmds.items() if cmd not in ("MLSD", "MLST")}
+        handler = type("NoMLSDHandler", (FTPHandler,), {"proto_cmds": proto_cmds})
+    handler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    ports.put(server.socket.getsockname()[1])
+    server.serve_forever()
+
+
+class FTPStandIn:
+    """Serves a directory via anonymous FTP on a free local port while used as a context manager.
+
+    With `mlsd=False` the server doesn't support MLSD.
+    """
+
+    def __init__(self, root: str, mlsd: bool = True):
+        self.root = root
+        self.mlsd = mlsd
+        self.port: int = None
+        self._process = None
+
+    def __enter__(self):
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve_ftp, args=(self.root, ports, self.mlsd), daemon=True)
+        self._process.start()
+        self.port = ports.get(timeout=10)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,192 @@
+# offline benchmark of every stage of pull-data.py, using synthetic inputs (see bench_fixtures.py)
+# - DWD data is served by a local FTP stand-in, audio features by a fake Spotify endpoint (see fake_spotify.py)
+# - each stage is timed separately and its throughput (rows/s, MB/s) and peak memory (RSS) are recorded
+# - the results can be compared against an earlier run to catch regressions
+#
+# usage:
+#   python benchmark.py [--scale 1.0] [--workers N] [--output bench.json] [--baseline bench.json] [--tolerance 0.25]
+#
+# NOTE: peak memory is the resident set size of this process, worker processes ("--workers") are not included.
+
+import importlib.util
+import json
+import os
+import shutil
+import sqlalchemy as sa
+import sys
+import tempfile
+import time
+
+from functools import partial
+from rich import print
+from rich.table import Table
+
+from bench_fixtures import FTPStandIn, make_charts_zip, make_dwd_tree
+from charts_ingest import ZIP_NAME as CHARTS_ZIP_NAME
+from dwd_config import data_sources
+from fake_spotify import FakeSpotifyServer
+from logger import PeakMemory, log
+from snapshot import write_snapshot
+from spotify_fetcher import make_client
+
+
+DATA_DIR: str = os.path.dirname(os.path.abspath(__file__))
+
+# inputs at scale 1.0
+STATIONS: int = 20  # per DWD data source
+CHART_DAYS: int = 365
+CHART_TRACKS: int = 5000
+
+
+def get_arg(flag: str, default):
+    return type(default)(sys.argv[sys.argv.index(flag) + 1]) if flag in sys.argv else default
+
+
+def load_pipeline(argv: list):
+    """Imports pull-data.py (not importable by name because of the dash) with the given command line arguments."""
+    sys.argv = ["pull-data.py", *argv]
+    spec = importlib.util.spec_from_file_location("pull_data", os.path.join(DATA_DIR, "pull-data.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_rows(engine, table: str) -> int:
+    with engine.connect() as connection:
+        if not sa.inspect(connection).has_table(table):
+            return 0
+        return connection.execute(sa.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def run_stage(results: list, name: str, fn, rows=None, size=None):
+    """Runs one stage and records its wall time, peak memory and throughput.
+
+    `rows` and `size` are callables that return the rows / bytes the stage produced.
+    """
+    log(f"Running stage {name}", "status")
+    with PeakMemory(interval=0.01) as rss:
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+    result = {"stage": name, "seconds": round(seconds, 3), "peak_rss_mb": round(rss.peak / 2**20, 1)}
+    if rows is not None:
+        result["rows"] = rows()
+        result["rows_per_s"] = round(result["rows"] / seconds, 1) if seconds else None
+    if size is not None:
+        result["bytes"] = size()
+        result["mb_per_s"] = round(result["bytes"] / 2**20 / seconds, 2) if seconds else None
+    results.append(result)
+
+
+def run_benchmark(workdir: str, scale: float, workers: int) -> dict:
+    """Generates the inputs in `workdir` and benchmarks all stages against them."""
+    ftp_root: str = os.path.join(workdir, "ftp")
+    pipeline_dir: str = os.path.join(workdir, "data")  # pull-data.py writes to ./raw and ../data.sqlite
+    os.makedirs(pipeline_dir)
+
+    stations: int = max(1, round(STATIONS * scale))
+    log(f"Generating synthetic inputs ({stations} stations per source, {round(CHART_DAYS * scale)} chart days)")
+    make_dwd_tree(ftp_root, data_sources, stations)
+    charts_dir: str = os.path.join(pipeline_dir, "raw", "spotify_data")
+    os.makedirs(charts_dir)
+    make_charts_zip(os.path.join(charts_dir, CHARTS_ZIP_NAME), max(1, round(CHART_DAYS * scale)),
+                    max(100, round(CHART_TRACKS * scale)))
+    with open(os.path.join(pipeline_dir, "spotify_credentials.txt"), "w") as f:
+        f.write("benchmark\nbenchmark\n")
+
+    results: list = []
+    cwd: str = os.getcwd()
+    os.chdir(pipeline_dir)
+    try:
+        pipeline = load_pipeline(["--workers", str(workers)])
+        engine = pipeline.engine
+        spotify: str = "spotify_data"
+
+        with FTPStandIn(ftp_root) as ftp, FakeSpotifyServer() as api:
+            pipeline.FTP_URI, pipeline.FTP_PORT = "127.0.0.1", ftp.port
+
+            def fake_client(auth_manager):
+                sp = make_client(auth="benchmark")
+                sp.prefix = api.prefix
+                return sp
+            pipeline.make_client = fake_client
+            # keep the snapshot of the repository (data/snapshot) untouched
+            pipeline.write_snapshot = partial(write_snapshot, snapshot_dir=os.path.join(workdir, "snapshot"))
+
+            for data_src in data_sources:
+                raw_dir: str = os.path.join(pipeline.RAW_DIR, data_src["name"])
+                run_stage(results, f"download {data_src['name']}",
+                          lambda: pipeline.download_weather_data(data_src["name"], data_src["path"]),
+                          size=lambda: dir_size(raw_dir))
+            for data_src in data_sources:
+                run_stage(results, f"extract {data_src['name']}", lambda: pipeline.extract_weather_sources([data_src]),
+                          rows=lambda: count_rows(engine, data_src["name"]),
+                          size=lambda: dir_size(os.path.join(pipeline.RAW_DIR, data_src["name"])))
+            run_stage(results, f"extract {spotify}", lambda: pipeline.extract_spotify_data_to_db(spotify),
+                      rows=lambda: count_rows(engine, spotify), size=lambda: dir_size(charts_dir))
+            run_stage(results, "spotify metadata", lambda: pipeline.get_spotify_metadata(spotify),
+                      rows=lambda: count_rows(engine, "audio_features"))
+            run_stage(results, "analyze", lambda: pipeline.analyze(engine))
+            run_stage(results, "snapshot", lambda: pipeline.export_snapshot(
+                [spotify, "audio_features"] + [data_src["name"] for data_src in data_sources]))
+    finally:
+        os.chdir(cwd)
+
+    return {"scale": scale, "workers": workers, "stages": results}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns the stages that got slower than the baseline by more than `tolerance` (e.g. 0.25 = 25%)."""
+    previous: dict = {stage["stage"]: stage for stage in baseline["stages"]}
+    regressions: list[str] = []
+    for stage in report["stages"]:
+        before = previous.get(stage["stage"])
+        if before is not None and stage["seconds"] > before["seconds"] * (1 + tolerance) and stage["seconds"] > 0.1:
+            regressions.append(f"{stage['stage']}: {before['seconds']}s -> {stage['seconds']}s")
+    return regressions
+
+
+def print_report(report: dict):
+    table = Table(title=f"pipeline benchmark (scale {report['scale']}, {report['workers']} workers)")
+    for column in ["stage", "seconds", "rows", "rows_per_s", "bytes", "mb_per_s", "peak_rss_mb"]:
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    for stage in report["stages"]:
+        table.add_row(*[str(stage.get(column.header, "")) for column in table.columns])
+    print(table)
+
+
+def main():
+    scale: float = get_arg("--scale", 1.0)
+    workers: int = get_arg("--workers", 1)
+    output: str = get_arg("--output", "")
+    baseline: str = get_arg("--baseline", "")
+    tolerance: float = get_arg("--tolerance", 0.25)
+
+    workdir: str = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    try:
+        report: dict = run_benchmark(workdir, scale, workers)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        log(f"Wrote benchmark results to {output}", "success")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(report, json.load(f), tolerance)
+        if regressions:
+            for regression in regressions:
+                log(f"Regression in {regression}", "error")
+            sys.exit(1)
+        log(f"No stage is more than {tolerance:.0%} slower than {baseline}", "success")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# binned statistics of every audio feature over every weather variable (see plot_lines in project/report_source.ipynb)
+# - works on the integer-coded training set (see training_set.py): the weather values are binned once per day and
+#   the bin of a chart entry is a lookup by its day code, no DataFrame is merged or grouped
+# - for each weather variable one np.bincount per statistic covers all audio features at once
+#   (index = bin * number of audio features + feature), counts and means are weighted by the sample weights
+# - the bins are the equal-width bins of pd.cut, i.e. (left, right] with the lowest edge extended by 0.1% of the range,
+#   over the values of the chart entries like the notebook's pd.cut(merged_df[weather], n_bins): the edges only depend
+#   on the lowest and highest value, so they are taken from the days that have at least one sample
+#
+# usage:
+#   stats = binned_stats(training_set, n_bins=20, ranges={"windstaerke": (None, 4.5)})
+#   stats[(stats["weather"] == "lufttemperatur") & (stats["feature"] == "valence")].plot(x="center", y="mean")
+
+import numpy as np
+import pandas as pd
+
+from training_set import TrainingSet
+
+
+STATS_COLUMNS: list[str] = ["weather", "feature", "bin", "left", "right", "center", "count", "mean", "var"]
+
+
+def bin_edges(values: np.ndarray, n_bins: int) -> np.ndarray:
+    """Returns the `n_bins` + 1 edges of equal-width bins over the values, like pd.cut(values, n_bins)."""
+    low, high = float(values.min()), float(values.max())
+    if low == high:
+        # pd.cut widens a constant range by 0.1% on both sides
+        margin: float = 0.001 * abs(low) if low != 0 else 0.001
+        return np.linspace(low - margin, high + margin, n_bins + 1)
+    edges = np.linspace(low, high, n_bins + 1)
+    edges[0] -= (high - low) * 0.001
+    return edges
+
+
+def binned_stats(data: TrainingSet, n_bins: int = 20, ranges: dict = None) -> pd.DataFrame:
+    """Returns the weighted count, mean and variance of every audio feature per bin of every weather variable.
+
+    `ranges` maps a weather variable to a value range (low, high], e.g. {"niederschlagshoehe_mm": (0, 7.5)}, either
+    end may be None. Only the days inside the range are binned. The result has one row per (weather variable,
+    audio feature, bin), see STATS_COLUMNS; empty bins have a count of 0 and no mean.
+    """
+    ranges = ranges or {}
+    n_weather: int = data.days.shape[1]
+    weather_names: list[str] = data.feature_names[:n_weather]
+    audio_names: list[str] = data.feature_names[n_weather:]
+    n_audio: int = len(audio_names)
+    weights: np.ndarray = data.weights.astype("float64")
+    # Centered on the overall means, so E[x²] - E[x]² keeps its precision for large features (duration_ms)
+    tracks: np.ndarray = data.tracks.astype("float64")
+    offset: np.ndarray = np.average(tracks[data.track_codes], axis=0, weights=weights) if len(data) else 0.0
+    audio: np.ndarray = (tracks - offset)[data.track_codes]
+    weighted: np.ndarray = weights[:, None] * audio
+    weighted_squares: np.ndarray = weighted * audio
+
+    # Days without chart entries (e.g. in the other part of a split) must not widen the bins
+    sampled = np.zeros(len(data.days), dtype=bool)
+    sampled[data.day_codes] = True
+
+    frames: list[pd.DataFrame] = []
+    for j, weather in enumerate(weather_names):
+        day_values: np.ndarray = data.days[:, j].astype("float64")
+        low, high = ranges.get(weather, (None, None))
+        in_range = ~np.isnan(day_values) & sampled
+        if low is not None:
+            in_range &= day_values > low
+        if high is not None:
+            in_range &= day_values <= high
+        if not in_range.any():
+            continue
+
+        edges: np.ndarray = bin_edges(day_values[in_range], n_bins)
+        day_bins = np.clip(np.searchsorted(edges, day_values, side="left") - 1, 0, n_bins - 1)
+        # Days outside of the range go to an extra bin that is dropped, so no array has to be filtered
+        day_bins[~in_range] = n_bins
+        bins = day_bins[data.day_codes]
+
+        # One bincount per statistic over all audio features
+        index = (bins[:, None] * n_audio + np.arange(n_audio)).ravel()
+        size: int = (n_bins + 1) * n_audio
+        count = np.bincount(bins, weights=weights, minlength=n_bins + 1)[:n_bins]
+        total = np.bincount(index, weights=weighted.ravel(), minlength=size)[:n_bins * n_audio].reshape(n_bins, n_audio)
+        squares = np.bincount(index, weights=weighted_squares.ravel(), minlength=size)[:n_bins * n_audio]
+        squares = squares.reshape(n_bins, n_audio)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count[:, None]
+            var = np.maximum(squares / count[:, None] - mean * mean, 0.0)
+        mean += offset
+
+        frames.append(pd.DataFrame({
+            "weather": weather,
+            "feature": np.tile(audio_names, n_bins),
+            "bin": np.repeat(np.arange(n_bins), n_audio),
+            "left": np.repeat(edges[:-1], n_audio),
+            "right": np.repeat(edges[1:], n_audio),
+            "center": np.repeat((edges[:-1] + edges[1:]) / 2, n_audio),
+            "count": np.repeat(count, n_audio),
+            "mean": mean.ravel(),
+            "var": var.ravel(),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,94 @@
+# streaming reader for the Kaggle "Spotify daily charts" data set
+# - the multi-GB CSV is read straight from the zip in chunks, only the needed columns are parsed
+# - rows are filtered by country while reading, so only the selected rows are ever held in memory
+# - the result uses compact dtypes (categoricals for title/artist, int16 for position)
+# - iter_country_charts() streams the rows of many countries in one pass over the CSV, e.g. into the country_charts
+#   table (one partition per country, see db_schema.py) and the distinct track ids of all of them into chart_tracks
+# - rows with an invalid position or track id (e.g. the placeholders "N\A" and "#") are rejected by CHART_CONSTRAINTS
+#   (see constraints.py)
+
+import pandas as pd
+import zipfile
+
+from typing import Iterator
+
+from constraints import RangeConstraint, RegexConstraint, check_constraints
+
+
+ZIP_NAME: str = "spotify-huge-database-daily-charts-over-3-years.zip"
+MEMBER_NAME: str = "Database to calculate popularity.csv"
+CHUNK_ROWS: int = 250_000
+
+# columns of the CSV that are used by the pipeline, everything else is skipped by the parser
+CSV_COLUMNS: list[str] = ["country", "date", "position", "uri", "title", "artist"]
+
+# charts of several countries, clustered by country, the distinct track ids of these charts and the countries of the
+# CSV (with whether their charts are stored)
+COUNTRY_CHARTS_TABLE: str = "country_charts"
+CHART_TRACKS_TABLE: str = "chart_tracks"
+CHART_COUNTRIES_TABLE: str = "chart_countries"
+
+# constraints of the cleaned chart rows, Spotify track ids are 22 base62 characters
+CHART_CONSTRAINTS: list = [
+    RangeConstraint("position", 1, 200, nullable=False),
+    RegexConstraint("track_id", r"[0-9A-Za-z]{22}", nullable=False),
+]
+
+
+def iter_chart_chunks(zip_path: str, chunksize: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yields the needed columns of the charts CSV in chunks."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        with zip_ref.open(name=MEMBER_NAME, mode="r") as tmpfile:
+            reader = pd.read_csv(tmpfile, usecols=CSV_COLUMNS, dtype={"country": "category", "uri": str, "title": str,
+                                 "artist": str}, chunksize=chunksize)
+            for chunk in reader:
+                yield chunk
+
+
+def clean_chart_rows(df: pd.DataFrame, keep_country: bool = False) -> pd.DataFrame:
+    """Converts raw chart rows into the spotify_data layout, without the country column unless `keep_country` is set."""
+    df = df.drop(columns=[] if keep_country else ["country"])
+    # Convert the "date" column to pd.datetime
+    df["date"] = pd.to_datetime(df["date"], format="%d/%m/%Y")
+    # Change the "position" column to a small integer (charts have 200 positions)
+    df["position"] = df["position"].astype("int16")
+    # convert uri to track id, e.g. "https://open.spotify.com/track/<id>" -> "<id>"
+    df["uri"] = df["uri"].str.strip().str.rsplit("/", n=1).str[-1]
+    df = df.rename(columns={"uri": "track_id"})
+    # title/artist repeat on every chart day
+    df["title"] = df["title"].astype("category")
+    df["artist"] = df["artist"].astype("category")
+    return df
+
+
+def load_country_charts(zip_path: str, country: str, chunksize: int = CHUNK_ROWS, rejects: list = None) -> pd.DataFrame:
+    """Returns the cleaned and valid chart rows of one country, reading the CSV in a single streaming pass.
+
+    The rejected rows are appended to `rejects`, if given.
+    """
+    selected = [chunk[chunk["country"] == country] for chunk in iter_chart_chunks(zip_path, chunksize)]
+    df = pd.concat(selected, ignore_index=True) if selected else pd.DataFrame(columns=CSV_COLUMNS)
+    df, rejected = check_constraints(clean_chart_rows(df), CHART_CONSTRAINTS)
+    if rejects is not None and not rejected.empty:
+        rejects.append(rejected)
+    return df.reset_index(drop=True)
+
+
+def iter_country_charts(zip_path: str, countries: list = None, chunksize: int = CHUNK_ROWS, rejects: list = None,
+                        seen: set = None) -> Iterator[pd.DataFrame]:
+    """Yields the cleaned and valid chart rows of the given countries (default: all) with their country in chunks,
+    reading the CSV in a single streaming pass.
+
+    The rejected rows are appended to `rejects` and all countries of the CSV are added to `seen`, if given.
+    """
+    for chunk in iter_chart_chunks(zip_path, chunksize):
+        if seen is not None:
+            seen.update(chunk["country"].unique())
+        if countries is not None:
+            chunk = chunk[chunk["country"].isin(countries)]
+        if chunk.empty:
+            continue
+        chunk, rejected = check_constraints(clean_chart_rows(chunk, keep_country=True), CHART_CONSTRAINTS)
+        if rejects is not None and not rejected.empty:
+            rejects.append(rejected)
+        yield chunk
@@ -0,0 +1,119 @@
+# declarative row constraints of the ingest stages, like the constraints of the Jayvee pipelines in exercises/
+# - RangeConstraint, AllowlistConstraint and RegexConstraint each check one column of a whole chunk at once, there is
+#   no per-row Python; missing values pass unless the constraint is not nullable (sentinels are stored as NULL, see
+#   dwd_config.py)
+# - check_constraints() splits a chunk into its valid rows and its rejected rows, every rejected row gets the name of
+#   the first constraint it fails as its reason
+# - rejected rows are stored in the rejects table as JSON records, keyed by table and record, so re-ingesting a file
+#   doesn't add them twice, and are counted per constraint in the run report
+#
+# usage:
+#   from constraints import RangeConstraint, RegexConstraint, check_constraints, reject_counts, write_rejects
+#   constraints = [RangeConstraint("position", 1, 200, nullable=False), RegexConstraint("track_id", r"[0-9A-Za-z]{22}")]
+#   valid, rejected = check_constraints(df, constraints)
+#   write_rejects(connection, "spotify_data", rejected, file_name)
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from db_schema import append_rows
+
+
+REJECTS_TABLE: str = "rejects"
+REASON_COLUMN: str = "reason"
+
+
+def _with_missing(values: pd.Series, ok: np.ndarray, nullable: bool) -> np.ndarray:
+    return np.where(values.isna().to_numpy(), nullable, ok)
+
+
+@dataclass
+class RangeConstraint:
+    column: str
+    lower: float = None  # inclusive, None for no lower bound
+    upper: float = None  # inclusive, None for no upper bound
+    nullable: bool = True
+    name: str = None
+
+    def __post_init__(self):
+        self.name = self.name or f"{self.column}_range"
+
+    def check(self, values: pd.Series) -> np.ndarray:
+        """Returns a boolean array that is True for the values within the bounds."""
+        numbers = values.to_numpy(dtype="float64", na_value=np.nan)
+        ok = np.ones(len(numbers), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if self.lower is not None:
+                ok &= numbers >= self.lower
+            if self.upper is not None:
+                ok &= numbers <= self.upper
+        return _with_missing(values, ok, self.nullable)
+
+
+@dataclass
+class AllowlistConstraint:
+    column: str
+    allowlist: list
+    nullable: bool = True
+    name: str = None
+
+    def __post_init__(self):
+        self.name = self.name or f"{self.column}_allowlist"
+
+    def check(self, values: pd.Series) -> np.ndarray:
+        """Returns a boolean array that is True for the values in the allowlist."""
+        return _with_missing(values, values.isin(self.allowlist).to_numpy(dtype=bool), self.nullable)
+
+
+@dataclass
+class RegexConstraint:
+    column: str
+    regex: str  # has to match the whole value
+    nullable: bool = True
+    name: str = None
+
+    def __post_init__(self):
+        self.name = self.name or f"{self.column}_regex"
+
+    def check(self, values: pd.Series) -> np.ndarray:
+        """Returns a boolean array that is True for the values that match the regex."""
+        ok = values.astype("string").str.fullmatch(self.regex).fillna(False).to_numpy(dtype=bool)
+        return _with_missing(values, ok, self.nullable)
+
+
+def check_constraints(df: pd.DataFrame, constraints: list) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits df into the rows that satisfy all constraints and the rejected rows with their reason.
+
+    Constraints on columns that df doesn't have are skipped. If no row is rejected, df itself is returned.
+    """
+    constraints = [constraint for constraint in constraints if constraint.column in df.columns]
+    if not constraints or df.empty:
+        return df, df.iloc[:0].assign(**{REASON_COLUMN: pd.Series(dtype=object)})
+    # One row of results per constraint, a row of df is valid if its column is all True
+    results = np.vstack([constraint.check(df[constraint.column]) for constraint in constraints])
+    ok = results.all(axis=0)
+    if ok.all():
+        return df, df.iloc[:0].assign(**{REASON_COLUMN: pd.Series(dtype=object)})
+    names = np.array([constraint.name for constraint in constraints], dtype=object)
+    rejected = df[~ok].assign(**{REASON_COLUMN: names[results[:, ~ok].argmin(axis=0)]})
+    return df[ok], rejected
+
+
+def reject_counts(rejected: pd.DataFrame) -> dict[str, int]:
+    """Returns the number of rejected rows per constraint as run report counters ("rejected_<constraint>")."""
+    return {f"rejected_{reason}": int(count) for reason, count in rejected[REASON_COLUMN].value_counts().items()}
+
+
+def write_rejects(connection, table: str, rejected: pd.DataFrame, file_name: str = None):
+    """Stores the rejected rows of a table (see check_constraints) in the rejects table."""
+    if rejected.empty:
+        return
+    records: str = rejected.drop(columns=REASON_COLUMN).to_json(orient="records", lines=True, date_format="iso")
+    append_rows(connection, REJECTS_TABLE, pd.DataFrame({
+        "table_name": table,
+        "record": records.splitlines(),
+        "reason": rejected[REASON_COLUMN].to_numpy(),
+        "file_name": file_name,
+    }))
@@ -0,0 +1,138 @@
+# current weather in Germany for the song recommender (see project/report_source.ipynb), from the DWD "recent/" data
+# - the station files of the "recent/" directories are cached on disk (data/raw/recent/<source>), only files whose size
+#   or modification time on the server changed are downloaded again (see ftp_pool.py)
+# - only the newest days of each file are converted, parsed files are memoized by size and modification time
+# - the daily aggregates (mean over all stations) are kept in memory for `ttl` seconds, so repeated
+#   recommendations cost no transfers at all and a refresh costs one directory listing per source plus changed files
+#
+# usage (e.g. from project/report_source.ipynb):
+#   import sys; sys.path.append("../data")
+#   from current_weather import CurrentWeather
+#   weather = CurrentWeather()
+#   most_recent_date, weather_today_df = weather.latest(["lufttemperatur", "windstaerke"])
+
+import os
+import pandas as pd
+import time
+import warnings
+
+from dwd_config import data_sources
+from ftp_pool import DownloadResult, FTPSessionPool, download_files, list_remote_files
+from rollups import value_columns
+from weather_ingest import read_station_zip
+
+
+RECENT_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw", "recent")
+FTP_URI: str = "opendata.dwd.de"
+TTL: float = 3600.0  # seconds, the DWD updates the recent data a few times a day at most
+DAYS: int = 7  # newest days that are parsed (the recent data usually lags behind by a day or two)
+
+
+def recent_path(data_src: dict) -> str:
+    """Returns the directory of the recent data of a DWD data source (the pipeline ingests the historical data)."""
+    return data_src["path"].replace("/historical/", "/recent/")
+
+
+class CurrentWeather:
+    """Daily weather aggregates over all stations from the recent DWD data, cached on disk and in memory."""
+
+    def __init__(self, sources: list = data_sources, cache_dir: str = RECENT_DIR, ttl: float = TTL, days: int = DAYS,
+                 host: str = FTP_URI, port: int = 21, sessions: int = 4):
+        self.sources = sources
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.days = days
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.last_sync: dict[str, DownloadResult] = {}  # per source, e.g. to check how much was transferred
+        self._parsed: dict = {}  # (path, size, mtime) -> rows of the newest days
+        self._daily: pd.DataFrame = None
+        self._expires: float = 0.0
+
+    def sync(self) -> dict[str, list[str]]:
+        """Brings the cached files of all sources up to date and returns their local paths per source.
+
+        If the server can't be reached, the files cached by an earlier call are used.
+        """
+        pool = FTPSessionPool(self.host, size=self.sessions, timeout=20, port=self.port)
+        try:
+            for data_src in self.sources:
+                directory: str = recent_path(data_src).rstrip("/")
+                target_dir: str = os.path.join(self.cache_dir, data_src["name"])
+                try:
+                    remote_files = {name: remote for name, remote in list_remote_files(pool, directory).items()
+                                    if name.endswith(".zip")}
+                    self.last_sync[data_src["name"]] = download_files(pool, directory, list(remote_files.values()),
+                                                                      target_dir)
+                except:
+                    # a plain warning, the notebook shouldn't depend on the pipeline's logger (and rich)
+                    warnings.warn(f"Could not update the recent {data_src['name']}, using the cached files")
+                    continue
+                # Stations that were removed from the server
+                for file in os.listdir(target_dir):
+                    if file.endswith(".zip") and file not in remote_files:
+                        os.remove(os.path.join(target_dir, file))
+        finally:
+            pool.close()
+
+        paths: dict = {}
+        for data_src in self.sources:
+            target_dir: str = os.path.join(self.cache_dir, data_src["name"])
+            files: list[str] = sorted(os.listdir(target_dir)) if os.path.isdir(target_dir) else []
+            paths[data_src["name"]] = [os.path.join(target_dir, file) for file in files if file.endswith(".zip")]
+        return paths
+
+    def _newest_rows(self, zip_path: str, data_src: dict, start_date: pd.Timestamp,
+                     end_date: pd.Timestamp) -> pd.DataFrame:
+        stat = os.stat(zip_path)
+        key: tuple = (zip_path, stat.st_size, stat.st_mtime, start_date)
+        if key not in self._parsed:
+            chunks = list(read_station_zip(zip_path, data_src, start_date, end_date))
+            self._parsed[key] = pd.concat(chunks, ignore_index=True) if chunks else None
+        return self._parsed[key]
+
+    def daily(self) -> pd.DataFrame:
+        """Returns the mean of every variable over all stations per day, for the newest days (indexed by date).
+
+        The result is served from memory until it is older than `ttl` seconds.
+        """
+        now: float = time.monotonic()
+        if self._daily is not None and now < self._expires:
+            return self._daily
+
+        paths: dict = self.sync()
+        end_date: pd.Timestamp = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+        start_date: pd.Timestamp = end_date - pd.Timedelta(days=self.days + 1)
+        # Drop memoized files that were replaced or are too old
+        current: set = {path for files in paths.values() for path in files}
+        self._parsed = {key: df for key, df in self._parsed.items() if key[0] in current and key[3] == start_date}
+
+        aggregates: list[pd.DataFrame] = []
+        for data_src in self.sources:
+            frames = [self._newest_rows(path, data_src, start_date, end_date) for path in paths[data_src["name"]]]
+            frames = [df for df in frames if df is not None]
+            if not frames:
+                continue
+            df = pd.concat(frames, ignore_index=True)
+            value_cols: list[str] = value_columns(data_src["new_columns"])
+            aggregates.append(df[value_cols].astype("float64").groupby(df["mess_datum"].dt.normalize()).mean())
+        daily = pd.concat(aggregates, axis=1) if aggregates else pd.DataFrame()
+        daily.index.name = "date"
+        self._daily = daily.sort_index()
+        self._expires = now + self.ttl
+        return self._daily
+
+    def latest(self, columns: list = None) -> tuple:
+        """Returns the newest day for which all `columns` (default: all variables) are available and their aggregates
+        as a one row DataFrame.
+        """
+        daily = self.daily()
+        if columns is not None:
+            daily = daily.reindex(columns=columns)
+        # Sometimes only part of the data of a day is available, so the newest complete day is used
+        complete = daily.dropna()
+        if complete.empty:
+            raise LookupError("no complete day in the recent DWD data")
+        latest_date = complete.index.max()
+        return latest_date.date(), complete.loc[[latest_date]].reset_index(drop=True)
@@ -0,0 +1,170 @@
+# data access layer for the analyses and the chart-position model (see project/report_source.ipynb, training_set.py)
+# - every date and every track id gets a dense integer code, the daily weather (from the rollups, mean over all
+#   stations) and the audio features are float32 arrays indexed by these codes, the charts are arrays of codes
+# - joins are array lookups, e.g. the weather of every chart entry is weather[chart_dates]
+# - the coded data and its wide view (charts joined with weather and audio features) are cached per database and only
+#   rebuilt when one of the tables they are read from has a new version (see db_schema.bump_version)
+# - the tables are read from the memory-mapped snapshot (see snapshot.py) if it was written at the current versions of
+#   all of them, otherwise from SQLite
+#
+# usage:
+#   from data_access import load_coded_data
+#   data = load_coded_data("sqlite:///../data.sqlite")
+#   merged_df = data.wide()
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from dataclasses import dataclass, field
+
+from db_schema import table_versions
+from rollups import rollup_table
+from snapshot import SNAPSHOT_DIR, load_table, snapshot_versions
+from track_cache import AUDIO_FEATURES_TABLE
+
+
+CHARTS_TABLE: str = "spotify_data"
+
+# weather variables per data source and audio features, in the order of the columns of the wide view
+WEATHER_FEATURES: dict[str, list[str]] = {
+    "cloud_data": ["bedeckungsgrad"],
+    "rain_data": ["niederschlagshoehe_mm", "schneehoehe_cm", "neuschneehoehe_cm"],
+    "temperature_data": ["lufttemperatur", "rel_feuchte"],
+    "wind_data": ["windstaerke"],
+}
+AUDIO_FEATURES: list[str] = ["acousticness", "danceability", "duration_ms", "energy", "instrumentalness", "key",
+                             "liveness", "loudness", "mode", "speechiness", "tempo", "valence"]
+
+# tables the coded data is read from
+SOURCE_TABLES: list[str] = [CHARTS_TABLE, AUDIO_FEATURES_TABLE] + [rollup_table(source) for source in WEATHER_FEATURES]
+
+
+@dataclass
+class CodedData:
+    dates: np.ndarray  # datetime64[D], date code -> date (sorted)
+    track_ids: np.ndarray  # track code -> track id (sorted)
+    weather: np.ndarray  # float32 (dates, weather variables), NaN where a day has no data
+    audio: np.ndarray  # float32 (tracks, audio features), NaN for tracks without audio features
+    chart_dates: np.ndarray  # int32, date code per chart entry
+    chart_tracks: np.ndarray  # int32, track code per chart entry
+    positions: np.ndarray  # int16, chart position per chart entry
+    versions: dict = field(default_factory=dict)  # versions of SOURCE_TABLES the data was read at
+    _wide: pd.DataFrame = field(default=None, repr=False)
+
+    @property
+    def weather_names(self) -> list[str]:
+        return [col for columns in WEATHER_FEATURES.values() for col in columns]
+
+    def wide(self) -> pd.DataFrame:
+        """Returns every chart entry with the weather of its day and the audio features of its track.
+
+        The view is built once and shared, copy it before modifying it in place.
+        """
+        if self._wide is None:
+            charts = pd.DataFrame({
+                "date": self.dates[self.chart_dates],
+                "position": self.positions,
+                "track_id": pd.Categorical.from_codes(self.chart_tracks, self.track_ids),
+            })
+            weather = pd.DataFrame(self.weather[self.chart_dates], columns=self.weather_names)
+            audio = pd.DataFrame(self.audio[self.chart_tracks], columns=AUDIO_FEATURES)
+            self._wide = pd.concat([charts, weather, audio], axis=1)
+        return self._wide
+
+
+# coded data per database URI, see load_coded_data()
+_cache: dict[str, CodedData] = {}
+
+
+def load_coded_data(db_uri: str, snapshot_dir: str = SNAPSHOT_DIR) -> CodedData:
+    """Returns the integer-coded charts, weather and audio features of a database.
+
+    The data is read again only if one of SOURCE_TABLES changed since the last call. Tables that were written
+    without a version (by an older pipeline) can't be checked, so their data is always read again (from SQLite).
+    """
+    engine = sa.create_engine(db_uri)
+    try:
+        with engine.connect() as connection:
+            versions: dict = table_versions(connection, SOURCE_TABLES)
+            cached: CodedData = _cache.get(db_uri)
+            if cached is not None and cached.versions == versions and None not in versions.values():
+                return cached
+            if None not in versions.values() and snapshot_versions(SOURCE_TABLES, snapshot_dir) == versions:
+                data = _read_coded_snapshot(snapshot_dir, versions)
+            else:
+                data = _read_coded_data(connection, versions)
+    finally:
+        engine.dispose()
+    _cache[db_uri] = data
+    return data
+
+
+def _read_table(connection, table: str, query: str, columns: list) -> pd.DataFrame:
+    if not sa.inspect(connection).has_table(table):
+        return pd.DataFrame(columns=columns)
+    return pd.read_sql_query(sa.text(query), connection)
+
+
+def _read_coded_data(connection, versions: dict) -> CodedData:
+    daily: list[pd.DataFrame] = []
+    for source, columns in WEATHER_FEATURES.items():
+        table: str = rollup_table(source)
+        selects: str = ", ".join(f"{col}_mean AS {col}" for col in columns)
+        daily.append(_read_table(connection, table, f"SELECT substr(date, 1, 10) AS date, {selects} FROM {table}",
+                                 ["date"] + columns))
+    charts = _read_table(connection, CHARTS_TABLE,
+                         f"SELECT substr(date, 1, 10) AS date, position, track_id FROM {CHARTS_TABLE}",
+                         ["date", "position", "track_id"])
+    audio = _read_table(connection, AUDIO_FEATURES_TABLE,
+                        f"SELECT track_id, {', '.join(AUDIO_FEATURES)} FROM {AUDIO_FEATURES_TABLE}",
+                        ["track_id"] + AUDIO_FEATURES)
+    return _code_data(daily, charts, audio, versions)
+
+
+def _read_coded_snapshot(snapshot_dir: str, versions: dict) -> CodedData:
+    daily: list[pd.DataFrame] = []
+    for source, columns in WEATHER_FEATURES.items():
+        df = load_table(rollup_table(source), ["date"] + [f"{col}_mean" for col in columns], snapshot_dir)
+        daily.append(df.rename(columns={f"{col}_mean": col for col in columns}))
+    charts = load_table(CHARTS_TABLE, ["date", "position", "track_id"], snapshot_dir)
+    audio = load_table(AUDIO_FEATURES_TABLE, ["track_id"] + AUDIO_FEATURES, snapshot_dir)
+    return _code_data(daily, charts, audio, versions)
+
+
+def _dense_codes(columns: list) -> tuple:
+    # Codes into the sorted union of the values of several columns, text of the snapshot comes as pd.Categorical
+    # whose categories are mapped instead of every value
+    parts: list = [column if isinstance(column, pd.Categorical) else pd.Categorical(column) for column in columns]
+    values = np.unique(np.concatenate([part.categories.to_numpy() for part in parts]))
+    codes = [np.searchsorted(values, part.categories.to_numpy())[part.codes] for part in parts]
+    return codes, values
+
+
+def _code_data(daily: list, charts: pd.DataFrame, audio: pd.DataFrame, versions: dict) -> CodedData:
+    charts = charts.dropna(subset=["track_id"])
+
+    # Dense codes over all dates and track ids, dates as datetime64[D] (from SQLite they are "YYYY-MM-DD" text)
+    date_codes, date_values = _dense_codes([df["date"].to_numpy(dtype="datetime64[D]") for df in [charts] + daily])
+    track_codes, track_values = _dense_codes([charts["track_id"].array, audio["track_id"].array])
+
+    weather = np.full((len(date_values), sum(len(columns) for columns in WEATHER_FEATURES.values())), np.nan,
+                      dtype="float32")
+    col = 0
+    for df, codes, columns in zip(daily, date_codes[1:], WEATHER_FEATURES.values()):
+        weather[codes, col:col + len(columns)] = df[columns].to_numpy(dtype="float32")
+        col += len(columns)
+
+    features = np.full((len(track_values), len(AUDIO_FEATURES)), np.nan, dtype="float32")
+    features[track_codes[1]] = audio[AUDIO_FEATURES].to_numpy(dtype="float32")
+
+    return CodedData(
+        dates=np.asarray(date_values, dtype="datetime64[D]"),
+        track_ids=np.asarray(track_values, dtype=object),
+        weather=weather,
+        audio=features,
+        chart_dates=date_codes[0].astype("int32"),
+        chart_tracks=track_codes[0].astype("int32"),
+        positions=charts["position"].to_numpy(dtype="int16"),
+        versions=versions,
+    )
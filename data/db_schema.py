@@ -0,0 +1,227 @@
+# explicit schema of data.sqlite (instead of letting DataFrame.to_sql guess the column types)
+# - integer/real column types, timestamps as ISO-8601 text ("YYYY-MM-DD HH:MM:SS" / "YYYY-MM-DD"), whose sort order is
+#   the chronological order, so range filters can use the indexes and SQLAlchemy/pandas still read them as datetimes
+# - the tables are WITHOUT ROWID tables clustered by their (composite) primary key, e.g. (stations_id, mess_datum)
+#   for the DWD tables and (date, position) for the charts, so a chart-by-date lookup reads one contiguous range
+# - secondary indexes for date range filters on the DWD tables and for track lookups on the charts
+# - rows with an existing primary key replace the old row (the raw data contains a few duplicates)
+# - every write records a new version of the table in table_versions, in the same transaction, so readers can cache
+#   data derived from a table until it changes (see data_access.py)
+# - append_rows checks the schema of a table once per connection (again only after a schema change) and records one
+#   version per table and transaction, so writing many small batches doesn't repeat the PRAGMA/CREATE statements
+
+import pandas as pd
+import sqlalchemy as sa
+import uuid
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class TableSchema:
+    columns: dict  # column name -> SQLite type (including constraints)
+    primary_key: tuple
+    indexes: dict = field(default_factory=dict)  # index name suffix -> indexed columns
+
+
+def _weather_table(value_types: dict) -> TableSchema:
+    return TableSchema(
+        columns={"stations_id": "INTEGER NOT NULL", "mess_datum": "TIMESTAMP NOT NULL", **value_types},
+        primary_key=("stations_id", "mess_datum"),
+        indexes={"mess_datum": ("mess_datum",)},
+    )
+
+
+SCHEMA: dict[str, TableSchema] = {
+    "rain_data": _weather_table({"niederschlagshoehe_mm": "REAL", "niederschlagsform": "INTEGER",
+                                 "schneehoehe_cm": "INTEGER", "neuschneehoehe_cm": "INTEGER"}),
+    "cloud_data": _weather_table({"bedeckungsgrad": "INTEGER", "wolkendichte": "INTEGER"}),
+    "temperature_data": _weather_table({"lufttemperatur": "REAL", "rel_feuchte": "REAL"}),
+    "wind_data": _weather_table({"windrichtung": "INTEGER", "windstaerke": "INTEGER"}),
+    "spotify_data": TableSchema(
+        columns={"date": "DATE NOT NULL", "position": "INTEGER NOT NULL", "track_id": "TEXT", "title": "TEXT",
+                 "artist": "TEXT"},
+        primary_key=("date", "position"),
+        # covering index: all chart entries of a track without touching the table
+        indexes={"track_id": ("track_id", "date", "position")},
+    ),
+    # charts of several countries, the primary key keeps the rows of a country together (see charts_ingest.py)
+    "country_charts": TableSchema(
+        columns={"country": "TEXT NOT NULL", "date": "DATE NOT NULL", "position": "INTEGER NOT NULL", "track_id": "TEXT",
+                 "title": "TEXT", "artist": "TEXT"},
+        primary_key=("country", "date", "position"),
+        indexes={"track_id": ("track_id",)},
+    ),
+    "chart_tracks": TableSchema(columns={"track_id": "TEXT NOT NULL"}, primary_key=("track_id",)),
+    "chart_countries": TableSchema(columns={"country": "TEXT NOT NULL", "stored": "INTEGER NOT NULL"},
+                                   primary_key=("country",)),
+    "audio_features": TableSchema(
+        columns={"acousticness": "REAL", "danceability": "REAL", "duration_ms": "INTEGER", "energy": "REAL",
+                 "instrumentalness": "REAL", "key": "INTEGER", "liveness": "REAL", "loudness": "REAL",
+                 "mode": "INTEGER", "speechiness": "REAL", "tempo": "REAL", "track_id": "TEXT NOT NULL",
+                 "valence": "REAL"},
+        primary_key=("track_id",),
+    ),
+    "stations": TableSchema(
+        columns={"stations_id": "INTEGER NOT NULL", "name": "TEXT", "latitude": "REAL NOT NULL",
+                 "longitude": "REAL NOT NULL", "elevation": "REAL", "active_from": "DATE", "active_to": "DATE"},
+        primary_key=("stations_id",),
+        # bounding box queries
+        indexes={"location": ("latitude", "longitude")},
+    ),
+    # rows that failed a constraint of the ingest (see constraints.py), as JSON records
+    "rejects": TableSchema(
+        columns={"table_name": "TEXT NOT NULL", "record": "TEXT NOT NULL", "reason": "TEXT NOT NULL", "file_name": "TEXT"},
+        primary_key=("table_name", "record"),
+    ),
+}
+
+VERSIONS_TABLE: str = "table_versions"
+
+# tables of a complete database (checked by test-pipeline.py and before a rebuilt database replaces the old one)
+EXPECTED_TABLES: list[str] = [
+    "cloud_data",
+    "rain_data",
+    "temperature_data",
+    "wind_data",
+    "cloud_data_daily",
+    "rain_data_daily",
+    "temperature_data_daily",
+    "wind_data_daily",
+    "audio_features",
+    "spotify_data",
+    "ingest_manifest",
+    "track_cache",
+    "stations",
+]
+# additional tables of a database built with "--countries" (see charts_ingest.py)
+COUNTRY_CHART_TABLES: list[str] = ["country_charts", "chart_tracks"]
+
+# formats of the text stored for the date types
+DATE_FORMATS: dict[str, str] = {"TIMESTAMP": "%Y-%m-%d %H:%M:%S", "DATE": "%Y-%m-%d"}
+
+
+def create_table_sql(table: str, name: str = None) -> str:
+    """Returns the CREATE TABLE statement of a table in SCHEMA (optionally under a different name)."""
+    schema: TableSchema = SCHEMA[table]
+    columns: str = ", ".join(f"{col} {col_type}" for col, col_type in schema.columns.items())
+    return (f"CREATE TABLE IF NOT EXISTS {name or table} ({columns}, PRIMARY KEY ({', '.join(schema.primary_key)})) "
+            "WITHOUT ROWID")
+
+
+def ensure_schema(connection, table: str):
+    """Creates a table in SCHEMA with its indexes. Tables that were created implicitly by to_sql are migrated."""
+    schema: TableSchema = SCHEMA[table]
+    existing = connection.execute(sa.text(f"PRAGMA table_info({table})")).fetchall()
+    if existing and not any(row[5] for row in existing):
+        _migrate(connection, table, [row[1] for row in existing])
+    else:
+        connection.execute(sa.text(create_table_sql(table)))
+
+    for suffix, columns in schema.indexes.items():
+        connection.execute(sa.text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{suffix} ON {table} ({', '.join(columns)})"))
+
+
+def _schema_version(connection) -> int:
+    # SQLite increments the schema version with every CREATE, DROP and ALTER (of any connection)
+    return connection.exec_driver_sql("PRAGMA schema_version").scalar()
+
+
+def _create_versions_table(connection, table: str):
+    connection.execute(sa.text(f"CREATE TABLE IF NOT EXISTS {table} (name TEXT PRIMARY KEY, version TEXT NOT NULL)"))
+
+
+def _ensure_schema_once(connection, table: str, ensure=ensure_schema):
+    # connection.info belongs to the DBAPI connection, so the checked tables survive checkouts from the pool
+    checked_version, checked = connection.info.get("ensured_tables", (None, set()))
+    version: int = _schema_version(connection)
+    if version == checked_version and table in checked:
+        return
+    ensure(connection, table)
+    checked = (checked if version == checked_version else set()) | {table}
+    connection.info["ensured_tables"] = (_schema_version(connection), checked)
+
+
+@sa.event.listens_for(sa.engine.Engine, "rollback")
+def _forget_ensured_tables(connection):
+    # a rollback may undo a CREATE, and the schema version with it
+    connection.info.pop("ensured_tables", None)
+
+
+def _migrate(connection, table: str, existing_columns: list):
+    # Copy the rows into a new table with the explicit schema, normalizing the stored timestamps on the way
+    schema: TableSchema = SCHEMA[table]
+    columns: list[str] = [col for col in schema.columns if col in existing_columns]
+    values: list[str] = []
+    for col in columns:
+        col_type: str = schema.columns[col].split()[0]
+        if col_type == "TIMESTAMP":
+            values.append(f"substr({col}, 1, 19)")
+        elif col_type == "DATE":
+            values.append(f"substr({col}, 1, 10)")
+        else:
+            values.append(col)
+    connection.execute(sa.text(create_table_sql(table, f"{table}_migrated")))
+    connection.execute(sa.text(f"INSERT OR REPLACE INTO {table}_migrated ({', '.join(columns)}) "
+                               f"SELECT {', '.join(values)} FROM {table}"))
+    connection.execute(sa.text(f"DROP TABLE {table}"))
+    connection.execute(sa.text(f"ALTER TABLE {table}_migrated RENAME TO {table}"))
+
+
+def append_rows(connection, table: str, df: pd.DataFrame):
+    """Appends the rows of df to a table in SCHEMA, replacing rows with the same primary key."""
+    bump_version(connection, table)
+    if table not in SCHEMA:
+        df.to_sql(table, connection, if_exists="append", index=False)
+        return
+    _ensure_schema_once(connection, table)
+    if df.empty:
+        # sqlite3's executemany can't bind an empty parameter list, the (empty) table exists nonetheless
+        return
+
+    schema: TableSchema = SCHEMA[table]
+    df = df[[col for col in schema.columns if col in df.columns]]
+    for col in df.columns:
+        col_type: str = schema.columns[col].split()[0]
+        if col_type in DATE_FORMATS and pd.api.types.is_datetime64_any_dtype(df[col]):
+            df = df.assign(**{col: df[col].dt.strftime(DATE_FORMATS[col_type])})
+        elif pd.api.types.is_extension_array_dtype(df[col]):
+            # e.g. nullable integers, sqlite3 can't bind pd.NA
+            df = df.assign(**{col: df[col].astype(object).where(df[col].notna(), None)})
+    placeholders: str = ", ".join("?" for _ in df.columns)
+    # exec_driver_sql hands the tuples straight to sqlite3's executemany
+    connection.exec_driver_sql(f"INSERT OR REPLACE INTO {table} ({', '.join(df.columns)}) VALUES ({placeholders})",
+                               list(df.itertuples(index=False, name=None)))
+
+
+def bump_version(connection, table: str):
+    """Records a new version of a table. Call it in the transaction that changes the table (once is enough)."""
+    transaction = connection.get_transaction()
+    if transaction is not None:
+        bumped = connection.info.get("bumped_versions")
+        if bumped is None or bumped[0] is not transaction:
+            bumped = connection.info["bumped_versions"] = (transaction, set())
+        if table in bumped[1]:
+            return
+        bumped[1].add(table)
+    _ensure_schema_once(connection, VERSIONS_TABLE, _create_versions_table)
+    # Random versions, so a table that is dropped and written again never gets a version it had before
+    connection.execute(sa.text(f"INSERT OR REPLACE INTO {VERSIONS_TABLE} (name, version) VALUES (:name, :version)"),
+                       {"name": table, "version": uuid.uuid4().hex})
+
+
+def table_versions(connection, tables: list) -> dict:
+    """Returns the current version of each table, None for tables that don't exist or were written without a version."""
+    versions: dict = {table: None for table in tables}
+    if not sa.inspect(connection).has_table(VERSIONS_TABLE):
+        return versions
+    existing: set = set(sa.inspect(connection).get_table_names())
+    rows = connection.execute(sa.text(f"SELECT name, version FROM {VERSIONS_TABLE}")).fetchall()
+    versions.update({name: version for name, version in rows if name in versions and name in existing})
+    return versions
+
+
+def analyze(engine):
+    """Updates the statistics of the query planner after loading."""
+    with engine.begin() as connection:
+        connection.execute(sa.text("ANALYZE"))
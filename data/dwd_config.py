@@ -1,27 +1,61 @@
+# parsing rules of the DWD station files (see weather_ingest.py):
+# - "date_format": format of the integer MESS_DATUM column (daily products YYYYMMDD, subdaily products YYYYMMDDHH)
+# - "dtypes": dtype of each measured variable, integer columns are nullable ("Int16") so that missing values become NULL,
+#   at least 16 bit are needed to parse the sentinel (-999 does not fit into 8 bit)
+# - "quality_column": quality level of the row (QN, see the documentation below), rows below MIN_QUALITY are rejected
+# - "ranges": plausible (inclusive) bounds of the measured variables by their new column names, rows with a value
+#   outside of them are rejected (see constraints.py and weather_ingest.weather_constraints)
+# - values in SENTINELS mark missing values and are stored as NULL
+
+# DWD quality levels: 1 only formal control, 3 routine control, 5 historic subjective procedures, 7 second control
+# (not yet corrected), 8 quality control outside of routine, 9 not all parameters corrected, 10 all corrections finished
+MIN_QUALITY: int = 1
+SENTINELS: list[int] = [-999]
+
 data_sources = [
     {
         "name": "rain_data",
         "path": "climate_environment/CDC/observations_germany/climate/daily/more_precip/historical/",
         "columns": ["STATIONS_ID", "MESS_DATUM", "  RS", " RSF", "SH_TAG", "NSH_TAG"],  # NOTE: the spaces in the column names are intentional
         "new_columns": ["stations_id", "mess_datum", "niederschlagshoehe_mm", "niederschlagsform", "schneehoehe_cm", "neuschneehoehe_cm"],
+        "date_format": "%Y%m%d",
+        "dtypes": {"  RS": "float64", " RSF": "Int16", "SH_TAG": "Int16", "NSH_TAG": "Int16"},
+        "quality_column": "QN_6",
+        # RSF is a code from 0 to 9, snow depths are in cm (the German record is below 10 m)
+        "ranges": {"niederschlagshoehe_mm": (0, 500), "niederschlagsform": (0, 9), "schneehoehe_cm": (0, 1000),
+                   "neuschneehoehe_cm": (0, 500)},
     },
     {
         "name": "cloud_data",
         "path": "climate_environment/CDC/observations_germany/climate/subdaily/cloudiness/historical/",
         "columns": ["STATIONS_ID", "MESS_DATUM", "N_TER", "CD_TER"],
         "new_columns": ["stations_id", "mess_datum", "bedeckungsgrad", "wolkendichte"],
+        "date_format": "%Y%m%d%H",
+        "dtypes": {"N_TER": "Int16", "CD_TER": "Int16"},
+        "quality_column": "QN_4",
+        # cloud cover in eighths
+        "ranges": {"bedeckungsgrad": (0, 8)},
     },
     {
         "name": "temperature_data",
         "path": "climate_environment/CDC/observations_germany/climate/subdaily/air_temperature/historical/",
         "columns": ["STATIONS_ID", "MESS_DATUM", "TT_TER", "RF_TER"],
         "new_columns": ["stations_id", "mess_datum", "lufttemperatur", "rel_feuchte"],
+        "date_format": "%Y%m%d%H",
+        "dtypes": {"TT_TER": "float64", "RF_TER": "float64"},
+        "quality_column": "QN_4",
+        "ranges": {"lufttemperatur": (-60, 50), "rel_feuchte": (0, 100)},
     },
     {
         "name": "wind_data",
         "path": "climate_environment/CDC/observations_germany/climate/subdaily/wind/historical/",
         "columns": ["STATIONS_ID", "MESS_DATUM", "DK_TER", "FK_TER"],
         "new_columns": ["stations_id", "mess_datum", "windrichtung", "windstaerke"],
+        "date_format": "%Y%m%d%H",
+        "dtypes": {"DK_TER": "Int16", "FK_TER": "Int16"},
+        "quality_column": "QN_4",
+        # wind force in Beaufort
+        "ranges": {"windrichtung": (0, 360), "windstaerke": (0, 12)},
     }
 ]
 
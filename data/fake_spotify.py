@@ -0,0 +1,97 @@
+# local stand-in for the Spotify Web API audio features endpoint, for tests and benchmarks
+# - GET /v1/audio-features/?ids=<id>,<id>,... returns deterministic fake features
+# - at most `limit` requests are answered per `window` seconds, the rest gets 429 with a Retry-After header
+# - `fail_status` makes every request fail with the given status code (e.g. 401 or 500)
+
+import hashlib
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_features(track_id: str) -> dict:
+    """Returns deterministic audio features for a track id."""
+    seed: int = int(hashlib.sha256(track_id.encode()).hexdigest()[:8], 16)
+    unit = [((seed >> shift) & 0xFF) / 255 for shift in range(0, 32, 4)]
+    return {
+        "acousticness": unit[0], "danceability": unit[1], "energy": unit[2], "instrumentalness": unit[3],
+        "liveness": unit[4], "speechiness": unit[5], "valence": unit[6], "key": seed % 12, "mode": seed % 2,
+        "loudness": -60 * unit[7], "tempo": 60 + 140 * unit[1], "duration_ms": 120_000 + seed % 180_000,
+        "time_signature": 4, "type": "audio_features", "id": track_id, "uri": f"spotify:track:{track_id}",
+        "track_href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "analysis_url": f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+    }
+
+
+class FakeSpotifyServer:
+    """Serves the fake API on a free local port while used as a context manager."""
+
+    def __init__(self, limit: int = None, window: float = 1.0, retry_after: int = 1, fail_status: int = None,
+                 unknown_ids: set = frozenset()):
+        self.limit = limit
+        self.window = window
+        self.retry_after = retry_after
+        self.fail_status = fail_status
+        self.unknown_ids = unknown_ids
+        self.requests: int = 0
+        self.rate_limited: int = 0
+        self._window_start: float = time.monotonic()
+        self._window_requests: int = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.prefix: str = f"http://127.0.0.1:{self._server.server_port}/v1/"
+
+    def _admit(self) -> bool:
+        with self._lock:
+            if self.limit is None:
+                return True
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start, self._window_requests = now, 0
+            self._window_requests += 1
+            if self._window_requests > self.limit:
+                self.rate_limited += 1
+                return False
+            return True
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.fail_status is not None:
+                    return self._reply(server.fail_status, {"error": {"status": server.fail_status, "message": "fake"}})
+                if not server._admit():
+                    return self._reply(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                       {"Retry-After": str(server.retry_after)})
+                ids = parse_qs(urlparse(self.path).query).get("ids", [""])[0].split(",")
+                features = [None if track_id in server.unknown_ids else fake_features(track_id) for track_id in ids]
+                self._reply(200, {"audio_features": features})
+
+            def _reply(self, status: int, body: dict, headers: dict = {}):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass  # keep test output clean
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
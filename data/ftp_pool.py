@@ -0,0 +1,214 @@
+# pool of concurrent FTP sessions for pulling many files from a single server (e.g. opendata.dwd.de)
+# - partial downloads are kept as "<file>.part" and resumed with REST on the next attempt / run
+# - files whose size and modification time (from MLSD, or SIZE/MDTM as fallback) match the local copy are skipped
+
+import datetime
+import ftplib
+import os
+import queue
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+PART_SUFFIX: str = ".part"
+
+# errors that are worth retrying with a fresh session (connection drops, timeouts, 4xx replies)
+TRANSIENT_ERRORS = (OSError, EOFError, ftplib.error_temp, ftplib.error_reply, ftplib.error_proto)
+
+
+@dataclass
+class RemoteFile:
+    name: str
+    size: int
+    mtime: float  # seconds since epoch (UTC)
+
+
+@dataclass
+class DownloadResult:
+    downloaded: list
+    skipped: list
+    failed: list
+    bytes_downloaded: int = 0
+    retries: int = 0
+
+
+class FTPSessionPool:
+    """Keeps up to `size` logged-in FTP sessions that worker threads can borrow."""
+
+    def __init__(self, host: str, size: int = 4, timeout: int = 20, port: int = 21):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        # sessions are created lazily, None marks a free slot without an open connection
+        self._idle: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _connect(self) -> ftplib.FTP:
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login()
+        return ftp
+
+    @contextmanager
+    def session(self):
+        """Borrows a session from the pool. Sessions that raised an error are discarded instead of returned."""
+        ftp = self._idle.get()
+        broken = False
+        try:
+            if ftp is None:
+                ftp = self._connect()
+            yield ftp
+        except:
+            broken = True
+            raise
+        finally:
+            if broken and ftp is not None:
+                _close_quietly(ftp)
+                ftp = None
+            self._idle.put(ftp)
+
+    def close(self):
+        """Closes all idle sessions."""
+        for _ in range(self.size):
+            ftp = self._idle.get()
+            if ftp is not None:
+                _close_quietly(ftp)
+        for _ in range(self.size):
+            self._idle.put(None)
+
+
+def _close_quietly(ftp: ftplib.FTP):
+    try:
+        ftp.quit()
+    except:
+        ftp.close()
+
+
+def _parse_ftp_time(value: str) -> float:
+    # MLSD / MDTM timestamps look like "20230612083512" or "20230612083512.123" and are always UTC
+    parsed = datetime.datetime.strptime(value[:14], "%Y%m%d%H%M%S")
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def list_remote_files(pool: FTPSessionPool, directory: str) -> dict:
+    """Lists all regular files in `directory` with their size and modification time."""
+    with pool.session() as ftp:
+        try:
+            entries = ftp.mlsd(directory, facts=["type", "size", "modify"])
+            return {
+                name: RemoteFile(name, int(facts["size"]), _parse_ftp_time(facts["modify"]))
+                for name, facts in entries
+                if facts.get("type") == "file"
+            }
+        except ftplib.error_perm:
+            pass  # server does not support MLSD, fall back to NLST + SIZE + MDTM
+
+        ftp.cwd(directory)
+        names: list[str] = ftp.nlst()
+        ftp.voidcmd("TYPE I")  # SIZE is only reliable in binary mode (and NLST switched to ASCII)
+        files = {}
+        for name in names:
+            try:
+                size = ftp.size(name)
+                mtime = _parse_ftp_time(ftp.voidcmd("MDTM " + name).split()[-1])
+            except ftplib.error_perm:
+                continue  # not a regular file (e.g. a sub directory)
+            files[name] = RemoteFile(name, size, mtime)
+        ftp.cwd("/")
+        return files
+
+
+def is_up_to_date(local_path: str, remote: RemoteFile) -> bool:
+    """Checks whether the local copy has the same size and modification time as the remote file."""
+    try:
+        stat = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    return stat.st_size == remote.size and int(stat.st_mtime) == int(remote.mtime)
+
+
+def _download_file(pool: FTPSessionPool, directory: str, remote: RemoteFile, target_dir: str) -> int:
+    local_path: str = os.path.join(target_dir, remote.name)
+    part_path: str = local_path + PART_SUFFIX
+
+    # Only resume a partial file if it belongs to the same version of the remote file
+    offset: int = 0
+    if os.path.exists(part_path):
+        stat = os.stat(part_path)
+        if int(stat.st_mtime) == int(remote.mtime) and stat.st_size <= remote.size:
+            offset = stat.st_size
+    received: int = 0
+
+    with pool.session() as ftp:
+        try:
+            with open(part_path, "ab" if offset else "wb") as f:
+                def callback(chunk):
+                    nonlocal received
+                    f.write(chunk)
+                    received += len(chunk)
+                if offset < remote.size:
+                    ftp.retrbinary(f"RETR {directory.rstrip('/')}/{remote.name}", callback, rest=offset or None)
+        finally:
+            # Tag the partial file with the remote version so that the next attempt can resume it
+            if os.path.exists(part_path):
+                os.utime(part_path, (remote.mtime, remote.mtime))
+
+    if os.path.getsize(part_path) != remote.size:
+        raise EOFError(f"incomplete transfer of {remote.name}")
+    os.replace(part_path, local_path)
+    os.utime(local_path, (remote.mtime, remote.mtime))
+    return received
+
+
+def download_files(pool: FTPSessionPool, directory: str, files: list, target_dir: str,
+                   attempts: int = 5, on_done=None) -> DownloadResult:
+    """Downloads `files` (RemoteFile entries) from `directory` into `target_dir` using all sessions of the pool.
+
+    A failing file is retried up to `attempts` times and never aborts the other transfers.
+    `on_done` is called once per finished (downloaded, skipped or failed) file, e.g. to advance a progress bar.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    result = DownloadResult(downloaded=[], skipped=[], failed=[])
+
+    pending = []
+    for remote in files:
+        if is_up_to_date(os.path.join(target_dir, remote.name), remote):
+            result.skipped.append(remote.name)
+            if on_done is not None:
+                on_done(remote.name)
+        else:
+            pending.append(remote)
+
+    def worker(remote: RemoteFile):
+        retries: int = 0
+        for attempt in range(attempts):
+            try:
+                return _download_file(pool, directory, remote, target_dir), retries
+            except TRANSIENT_ERRORS:
+                if attempt == attempts - 1:
+                    raise
+                retries += 1
+                time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.5))  # backoff with jitter
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {executor.submit(worker, remote): remote for remote in pending}
+        for future in as_completed(futures):
+            remote = futures[future]
+            try:
+                received, retries = future.result()
+                result.downloaded.append(remote.name)
+                result.bytes_downloaded += received
+                result.retries += retries
+            except:
+                result.failed.append(remote.name)
+                result.retries += attempts - 1
+            if on_done is not None:
+                on_done(remote.name)
+
+    return result
@@ -0,0 +1,134 @@
+# ingestion manifest: records every raw file that was ingested into data.sqlite, per data source
+# - a file is (re-)ingested only if it is new or its checksum changed
+# - rows of replaced files (same station, new or changed file) are deleted before the new file is ingested
+# - manifest entries are written in the same transaction as the last rows of their file, so an interrupted run
+#   leaves no entry behind and the file is picked up again on the next run
+
+import datetime
+import hashlib
+import os
+import re
+import sqlalchemy as sa
+
+from dataclasses import dataclass
+
+from db_schema import bump_version
+
+
+MANIFEST_TABLE: str = "ingest_manifest"
+
+
+@dataclass
+class ManifestEntry:
+    source: str
+    file_name: str
+    stations_id: int
+    file_size: int
+    file_mtime: float
+    checksum: str
+    row_count: int = 0
+
+
+def create_manifest(connection):
+    """Creates the manifest table if it does not exist yet."""
+    connection.execute(sa.text(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            source TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            stations_id INTEGER,
+            file_size INTEGER NOT NULL,
+            file_mtime REAL NOT NULL,
+            checksum TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            ingested_at TEXT NOT NULL,
+            PRIMARY KEY (source, file_name)
+        )"""))
+
+
+def file_checksum(path: str) -> str:
+    """Returns the SHA-256 checksum of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def station_id_from_file_name(file_name: str) -> int:
+    """Extracts the station id from a DWD file name, e.g. tageswerte_RR_00044_19510101_20221231_hist.zip -> 44."""
+    match = re.search(r"_(\d{5})_\d{8}_\d{8}", file_name)
+    return int(match.group(1)) if match else None
+
+
+def plan_ingest(engine, source: str, zip_paths: list, prepare=None, on_delete=None,
+                excluded: list = None) -> list[ManifestEntry]:
+    """Returns manifest entries for all files that are new or changed and prepares the database for them.
+
+    Rows of stations whose file is about to be (re-)ingested are deleted, together with their old manifest entries.
+    This also cleans up rows of files that were only partially ingested by an interrupted run. The rows and manifest
+    entries of the stations of the `excluded` files (e.g. outside of the selected region) are deleted as well.
+    `prepare(connection)` is called at the start of the transaction. If rows were deleted,
+    `on_delete(connection, first, last)` is called afterwards with the mess_datum range of the deleted rows.
+    """
+    with engine.begin() as connection:
+        create_manifest(connection)
+        if prepare is not None:
+            prepare(connection)
+        has_table: bool = sa.inspect(connection).has_table(source)
+
+        known: dict = {}
+        if has_table:
+            rows = connection.execute(sa.text(f"SELECT file_name, file_size, file_mtime, checksum FROM {MANIFEST_TABLE} "
+                                              "WHERE source = :source"), {"source": source}).fetchall()
+            known = {row[0]: row for row in rows}
+        else:
+            # The table was dropped, so nothing recorded for this source is in the database anymore
+            connection.execute(sa.text(f"DELETE FROM {MANIFEST_TABLE} WHERE source = :source"), {"source": source})
+
+        pending: list[ManifestEntry] = []
+        for zip_path in zip_paths:
+            file_name: str = os.path.basename(zip_path)
+            stat = os.stat(zip_path)
+            entry = known.get(file_name)
+            # Size and modification time are checked first, so unchanged files do not have to be hashed
+            if entry is not None and entry[1] == stat.st_size and entry[2] == stat.st_mtime:
+                continue
+            checksum: str = file_checksum(zip_path)
+            if entry is not None and entry[3] == checksum:
+                connection.execute(sa.text(f"UPDATE {MANIFEST_TABLE} SET file_size = :size, file_mtime = :mtime "
+                                           "WHERE source = :source AND file_name = :file_name"),
+                                   {"size": stat.st_size, "mtime": stat.st_mtime, "source": source, "file_name": file_name})
+                continue
+            pending.append(ManifestEntry(source, file_name, station_id_from_file_name(file_name), stat.st_size,
+                                         stat.st_mtime, checksum))
+
+        removed: list[tuple] = [(entry.file_name, entry.stations_id) for entry in pending]
+        removed += [(os.path.basename(path), station_id_from_file_name(os.path.basename(path))) for path in excluded or []]
+        deleted_ranges: list[tuple] = []
+        for file_name, stations_id in removed:
+            connection.execute(sa.text(f"DELETE FROM {MANIFEST_TABLE} WHERE source = :source AND "
+                                       "(file_name = :file_name OR stations_id = :stations_id)"),
+                               {"source": source, "file_name": file_name, "stations_id": stations_id})
+            if has_table and stations_id is not None:
+                params: dict = {"stations_id": stations_id}
+                first, last = connection.execute(sa.text(f"SELECT MIN(mess_datum), MAX(mess_datum) FROM {source} "
+                                                         "WHERE stations_id = :stations_id"), params).fetchone()
+                if first is not None:
+                    deleted_ranges.append((first, last))
+                    connection.execute(sa.text(f"DELETE FROM {source} WHERE stations_id = :stations_id"), params)
+                    bump_version(connection, source)
+
+        if deleted_ranges and on_delete is not None:
+            on_delete(connection, min(first for first, _ in deleted_ranges), max(last for _, last in deleted_ranges))
+
+    return pending
+
+
+def record_ingest(connection, entry: ManifestEntry):
+    """Records a fully ingested file in the manifest."""
+    create_manifest(connection)
+    statement = sa.text(f"""
+        INSERT OR REPLACE INTO {MANIFEST_TABLE}
+            (source, file_name, stations_id, file_size, file_mtime, checksum, row_count, ingested_at)
+        VALUES (:source, :file_name, :stations_id, :file_size, :file_mtime, :checksum, :row_count, :ingested_at)""")
+    connection.execute(statement, {**entry.__dict__, "ingested_at": datetime.datetime.now().isoformat(timespec="seconds")})
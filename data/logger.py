@@ -1,8 +1,25 @@
 # very simple logger function for consistent logs
 # based on https://github.com/Gallopsled/pwntools/blob/ab60471266de1858dea13b43f3e65c2b90d5530e/pwnlib/log.py
+# - stage() measures a pipeline stage (wall time, rows in/out, bytes, retries, peak memory) and appends it as one
+#   JSON line to the run report, see start_run()
+# - an "error" or "failure" log message inside a stage marks the stage as failed
+# - a single stage can be run under cProfile, its stats are written to "profile_<stage>.prof"
+# - track() / progress_task() draw progress bars, stages that run concurrently share one live display
 
+import cProfile
 import datetime
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
 from rich import print
+from rich.progress import Progress
 
 msgtype_prefixes: dict = {
     "info":     ["bold",          "*"],  # noqa: E241
@@ -28,4 +45,201 @@ def log(message: str, msg_type: str = "info", timestamp=False, ret_str=False):
     if ret_str:
         return formatted_message
     else:
+        active: list = _active_stages()
+        if msg_type in ("error", "failure") and active:
+            active[-1].fail(message)
         print(formatted_message)
+
+
+class PeakMemory:
+    """Samples the resident set size of this process in a background thread and keeps the maximum (in bytes)."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak: int = 0
+        self._stop = threading.Event()
+        self._page_size: int = os.sysconf("SC_PAGE_SIZE")
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # not on Linux: the lifetime maximum is the best we can get
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+@dataclass
+class StageMetrics:
+    stage: str
+    started_at: str = ""
+    seconds: float = 0.0
+    status: str = "ok"  # "ok" or "failed"
+    rows_in: int = 0
+    rows_out: int = 0
+    bytes: int = 0  # bytes downloaded or read
+    retries: int = 0
+    peak_rss_mb: float = 0.0  # of this process only, worker processes are not included
+    errors: list = field(default_factory=list)
+    counts: dict = field(default_factory=dict)  # stage specific counters, e.g. skipped files
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, **counters: int):
+        """Adds to the counters, e.g. add(rows_out=len(df), retries=1). Safe to call from worker threads."""
+        with self._lock:
+            for name, value in counters.items():
+                if name in ("rows_in", "rows_out", "bytes", "retries"):
+                    setattr(self, name, getattr(self, name) + value)
+                else:
+                    self.counts[name] = self.counts.get(name, 0) + value
+
+    def fail(self, message: str):
+        self.status = "failed"
+        self.errors.append(message)
+
+
+# state of the current run, see start_run()
+_run: dict = {"id": None, "started_at": None, "start": None, "report_path": None, "profile": None, "stages": []}
+_report_lock = threading.Lock()
+_local = threading.local()  # stages are nested per thread, concurrent stages run in different threads
+
+
+def _active_stages() -> list[StageMetrics]:
+    if not hasattr(_local, "stages"):
+        _local.stages = []
+    return _local.stages
+
+
+def start_run(report_path: str = None, profile: str = None) -> str:
+    """Starts a new run. Finished stages are appended to `report_path` (JSON lines), if given.
+
+    `profile` is the name of the stage to run under cProfile. Returns the id of the run.
+    """
+    _run.update(id=uuid.uuid4().hex[:12], started_at=datetime.datetime.now().isoformat(timespec="seconds"),
+                start=time.perf_counter(), report_path=report_path, profile=profile, stages=[])
+    return _run["id"]
+
+
+def finish_run() -> dict:
+    """Appends the summary of the run to the run report and returns it."""
+    stages: list[StageMetrics] = _run["stages"]
+    summary: dict = {
+        "type": "run", "run_id": _run["id"], "started_at": _run["started_at"],
+        "seconds": round(time.perf_counter() - _run["start"], 3) if _run["start"] is not None else 0.0,
+        "status": "failed" if any(metrics.status != "ok" for metrics in stages) else "ok",
+        "stages": len(stages),
+        "failed_stages": [metrics.stage for metrics in stages if metrics.status != "ok"],
+    }
+    _write_report(summary)
+    return summary
+
+
+def _write_report(record: dict):
+    if _run["report_path"] is None:
+        return
+    try:
+        with _report_lock, open(_run["report_path"], "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError:
+        log(f"Could not write run report {_run['report_path']}", "warning")
+
+
+@contextmanager
+def stage(name: str):
+    """Measures the enclosed pipeline stage and yields its StageMetrics for the counters."""
+    metrics = StageMetrics(stage=name, started_at=datetime.datetime.now().isoformat(timespec="seconds"))
+    profiler = cProfile.Profile() if name == _run["profile"] else None
+    _active_stages().append(metrics)
+    start = time.perf_counter()
+    memory: PeakMemory = None  # stays None if the sampling can't start
+    try:
+        with PeakMemory() as memory:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield metrics
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    except BaseException as error:
+        metrics.fail(repr(error))
+        raise
+    finally:
+        metrics.seconds = round(time.perf_counter() - start, 3)
+        metrics.peak_rss_mb = round(memory.peak / 2**20, 1) if memory is not None else 0.0
+        _active_stages().remove(metrics)
+        _run["stages"].append(metrics)
+        _write_report({"type": "stage", "run_id": _run["id"], **asdict(metrics)})
+        if profiler is not None:
+            _dump_profile(profiler, name)
+
+
+def stage_status(name: str) -> str:
+    """Returns the status ("ok" or "failed") of the last finished stage with this name in this run, or None."""
+    for metrics in reversed(_run["stages"]):
+        if metrics.stage == name:
+            return metrics.status
+    return None
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str):
+    path: str = f"profile_{name}.prof"
+    profiler.dump_stats(path)
+    log(f"Wrote profile of stage {name} to {path} (open with snakeviz or python -m pstats), top functions:")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+
+# live display shared by concurrent stages, see shared_progress()
+_progress: dict = {"display": None}
+
+
+@contextmanager
+def shared_progress():
+    """Shows the progress bars of all stages in one live display (rich only allows one at a time)."""
+    with Progress(transient=True) as display:
+        _progress["display"] = display
+        try:
+            yield display
+        finally:
+            _progress["display"] = None
+
+
+@contextmanager
+def progress_task(description: str, total: int):
+    """Adds a progress bar and yields a function that advances it."""
+    display: Progress = _progress["display"]
+    if display is None:
+        with Progress(transient=True) as own:
+            task = own.add_task(description, total=total)
+            yield lambda advance=1: own.advance(task, advance)
+        return
+    task = display.add_task(description, total=total)
+    try:
+        yield lambda advance=1: display.advance(task, advance)
+    finally:
+        display.remove_task(task)
+
+
+def track(sequence, description: str, total: int = None, transient: bool = True):
+    """Iterates over `sequence` with a progress bar, like rich.progress.track but safe to use in concurrent stages."""
+    with progress_task(description, len(sequence) if total is None else total) as advance:
+        for item in sequence:
+            yield item
+            advance()
@@ -34,7 +34,22 @@
 
 # NOTE: If you suspect any issues with the local data, you can try running this script with the "--clean" flag. This will
 #       clean it by deleting and re-downloading all data files and re-building the SQLite db.
-
+# NOTE: Use "--workers N" to decode the DWD station archives in N processes. The database is still written by this
+#       process only, the result is identical to the sequential run.
+# NOTE: The stages run as a dependency graph (see build_stage_graph): independent downloads overlap, database writes
+#       run one at a time. If a stage fails, the next run only repeats the failed stages and the ones that depend on them.
+# NOTE: Use "--radius LAT,LON,KM", "--bbox SOUTH,WEST,NORTH,EAST" or "--cities KM" to only ingest the weather stations
+#       of a region (see stations.py). The station locations are stored in the "stations" table.
+# NOTE: Every run appends the metrics of each stage (wall time, rows, bytes, retries, peak memory) to run_report.jsonl.
+#       Use "--profile <stage>" (e.g. "--profile extract.cloud_data") to write a cProfile of that stage.
+# NOTE: Use "--rebuild" to build a new database from the raw files in a staging file (data.sqlite.staging) with bulk
+#       load settings. data.sqlite stays readable during the rebuild and is replaced atomically once it is complete.
+# NOTE: Use "--countries all" or "--countries Austria,Switzerland" to also store the charts of other countries in the
+#       "country_charts" table. The charts CSV is read once for all countries, the audio features of every distinct
+#       track of these charts (the "chart_tracks" table) are fetched once. "spotify_data" keeps the German charts.
+
+import functools
+import multiprocessing
 import os
 import pandas as pd
 import re
@@ -42,25 +57,60 @@ import shutil
 import spotipy
 import sqlalchemy as sa
 import sys
-import time
-import zipfile
 
-from ftplib import FTP
-from kaggle.api.kaggle_api_extended import KaggleApi
+from concurrent.futures import Future, ProcessPoolExecutor
 from rich import print
-from rich.progress import track
 
+from charts_ingest import (CHART_COUNTRIES_TABLE, CHART_TRACKS_TABLE, COUNTRY_CHARTS_TABLE, ZIP_NAME as CHARTS_ZIP_NAME,
+                           iter_country_charts, load_country_charts)
+from constraints import reject_counts, write_rejects
+from db_schema import COUNTRY_CHART_TABLES, EXPECTED_TABLES, analyze, append_rows, bump_version, ensure_schema
 from dwd_config import data_sources
-from logger import log
+from ftp_pool import FTPSessionPool, download_files, list_remote_files
+from ingest_manifest import ManifestEntry, plan_ingest, record_ingest
+from logger import finish_run, log, progress_task, shared_progress, stage, start_run, track
+from rollups import ensure_rollup, merge_batch, refresh_days, rollup_table, value_columns
+from snapshot import write_snapshot
+from spotify_fetcher import fetch_audio_features, make_client
+from stage_graph import Node, StageMarkers, run_graph
+from staging import copy_tables, create_staging_engine, staging_path, swap_in, validate_staging
+from stations import parse_region, select_station_zips
+from track_cache import create_track_cache, store_batch, uncached_track_ids
+from weather_ingest import BatchWriter, decode_station_zip, stream_station_zip, submit_ordered
 
 
 # globals
 RAW_DIR: str = "raw"
-DB_CONNECTION_URI = "sqlite:///../data.sqlite"
+DB_PATH: str = "../data.sqlite"
+DB_CONNECTION_URI = f"sqlite:///{DB_PATH}"
 FTP_URI: str = "opendata.dwd.de"
+FTP_PORT: int = 21
+FTP_SESSIONS: int = 8  # number of concurrent FTP sessions per data source
 
-engine = sa.create_engine(DB_CONNECTION_URI)
+# stages that don't hold the write lock (e.g. the Spotify metadata) wait for it instead of failing
+engine = sa.create_engine(DB_CONNECTION_URI, connect_args={"timeout": 120})
 is_test = "--test" in sys.argv
+# number of processes that decode station zips, e.g. "--workers 8" (the default of 1 decodes in this process)
+workers: int = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+
+# run report with one JSON line per stage and run (see logger.py), "--profile <stage>" profiles a single stage
+REPORT_PATH: str = "run_report.jsonl"
+# stages that succeeded in a run that did not complete, see stage_graph.py
+MARKERS_PATH: str = "stage_markers.json"
+# number of stages of each kind that run at the same time (a single SQLite writer, two DWD sources of FTP_SESSIONS each)
+STAGE_LIMITS: dict[str, int] = {"db": 1, "ftp": 2}
+profile_stage: str = sys.argv[sys.argv.index("--profile") + 1] if "--profile" in sys.argv else None
+
+# "--rebuild" builds a new database in a staging file and only replaces data.sqlite once it is complete (see staging.py)
+rebuild: bool = "--rebuild" in sys.argv
+markers_path: str = "stage_markers_rebuild.json" if rebuild else MARKERS_PATH
+
+# "--countries all" or e.g. "--countries Austria,Switzerland" also stores the charts of other countries, in the same pass
+# over the charts CSV, and fetches the audio features of all of their tracks (default: only the German charts)
+chart_countries: list[str] = sys.argv[sys.argv.index("--countries") + 1].split(",") if "--countries" in sys.argv else None
+
+# stations to ingest, e.g. "--radius 52.52,13.40,50", "--bbox S,W,N,E" or "--cities 30" (default: all of Germany)
+region = parse_region(sys.argv)
 
 # observation period of the spotify data set
 start_date = pd.to_datetime('2017-01-25')
@@ -68,6 +118,12 @@ end_date = pd.to_datetime('2020-11-30')
 
 
 def main():
+    start_run(REPORT_PATH, profile=profile_stage)
+
+    # Write into a staging database, the current database stays in place until the rebuild is complete
+    if rebuild:
+        start_rebuild()
+
     # Clean data if "--clean" flag is present
     if "--clean" in sys.argv:
         clean_data()
@@ -81,305 +137,521 @@ def main():
 
     log("Pipeline started", timestamp=True)
 
-    # Download and extract spotify data
-    spotify: str = "spotify_data"
-    if sa.inspect(engine).has_table(spotify):
-        log(f"Found {spotify} table")
+    # Run the stages as soon as their inputs are ready, stages that succeeded in an incomplete earlier run are skipped
+    markers = StageMarkers(markers_path)
+    if markers.done:
+        log(f"Resuming the previous run, skipping {len(markers.done)} stages that succeeded: {', '.join(sorted(markers.done))}")
+    with shared_progress():
+        results: dict = run_graph(build_stage_graph("spotify_data"), STAGE_LIMITS, markers)
+    blocked: list[str] = [name for name, result in results.items() if result == "blocked"]
+    if blocked:
+        log(f"Skipped stages whose inputs failed: {', '.join(blocked)}", "warning")
+
+    if rebuild:
+        swap_rebuilt_database(results)
+
+    summary: dict = finish_run()
+    if summary["failed_stages"]:
+        log(f"Pipeline completed with failed stages: {', '.join(summary['failed_stages'])}", "warning", timestamp=True)
     else:
-        if (os.path.exists(os.path.join(RAW_DIR, spotify))):
+        log("Pipeline completed", timestamp=True)
+    log(f"Wrote run report {summary['run_id']} to {REPORT_PATH}")
+
+
+def build_stage_graph(spotify: str) -> list[Node]:
+    """Returns the stages of the pipeline and their dependencies (see the overview above).
+
+    The branches of the four DWD sources and the Spotify branch are independent of each other. Downloads and API calls
+    overlap, while the stages that write to the database run one at a time (SQLite has a single writer).
+    """
+    def download_charts():
+        if sa.inspect(engine).has_table(spotify):
+            log(f"Found {spotify} table")
+        elif os.path.exists(os.path.join(RAW_DIR, spotify)):
             log(f"Found raw {spotify} files")
         else:
             download_spotify_data(spotify)
-        extract_spotify_data_to_db(spotify)
-        get_spotify_metadata(spotify)
 
-    # Download and extract weather data
+    def extract_charts():
+        if not sa.inspect(engine).has_table(spotify) or missing_chart_countries():
+            extract_spotify_data_to_db(spotify)
+
+    def update_statistics():
+        # Update the query planner statistics for the new rows
+        with stage("analyze"):
+            analyze(engine)
+
+    nodes: list[Node] = [
+        Node(f"download.{spotify}", download_charts, kind="http"),
+        Node(f"extract.{spotify}", extract_charts, deps=[f"download.{spotify}"], kind="db"),
+        # Only tracks that are not in the track cache yet are fetched, each batch is stored in a short transaction
+        Node(f"metadata.{spotify}", functools.partial(get_spotify_metadata, spotify), deps=[f"extract.{spotify}"],
+             kind="http"),
+    ]
     for data_src in data_sources:
-        if sa.inspect(engine).has_table(data_src["name"]):
-            log(f"Found {data_src['name']} table")
-        else:
-            if (os.path.exists(os.path.join(RAW_DIR, data_src['name']))):
-                log(f"Found raw {data_src['name']} files")
-            else:
-                download_weather_data(data_src['name'], data_src['path'])
-            extract_weather_data_to_db(data_src['name'], data_src['columns'], data_src['new_columns'])
-
-    log("Pipeline completed", timestamp=True)
+        # Only missing, outdated or partially downloaded files are fetched, only new or changed files are ingested
+        nodes.append(Node(f"download.{data_src['name']}",
+                          functools.partial(download_weather_data, data_src['name'], data_src['path']), kind="ftp"))
+        nodes.append(Node(f"extract.{data_src['name']}", functools.partial(extract_weather_sources, [data_src]),
+                          deps=[f"download.{data_src['name']}"], kind="db"))
+
+    tables: list[str] = [spotify, "audio_features", "stations"] + [data_src['name'] for data_src in data_sources]
+    if chart_countries is not None:
+        tables += COUNTRY_CHART_TABLES
+    nodes.append(Node("analyze", update_statistics, deps=[f"metadata.{spotify}"] + [
+        f"extract.{data_src['name']}" for data_src in data_sources], kind="db"))
+    # Write the columnar snapshot that the analysis loads from
+    nodes.append(Node("snapshot", functools.partial(export_snapshot, tables), deps=["analyze"], kind="db"))
+    return nodes
+
+
+def missing_chart_countries() -> bool:
+    """Returns whether countries selected with "--countries" have no charts in the database yet."""
+    if chart_countries is None:
+        return False
+    if not sa.inspect(engine).has_table(CHART_COUNTRIES_TABLE):
+        return True
+    with engine.connect() as connection:
+        stored: dict = dict(connection.execute(sa.text(f"SELECT country, stored FROM {CHART_COUNTRIES_TABLE}")).fetchall())
+    if chart_countries == ["all"]:
+        return not all(stored.values())
+    return any(not stored.get(country) for country in chart_countries)
+
+
+def expected_tables() -> list[str]:
+    """Returns the tables of a complete database for the options of this run."""
+    return EXPECTED_TABLES + (COUNTRY_CHART_TABLES if chart_countries is not None else [])
+
+
+def start_rebuild():
+    """Points the pipeline to a new staging database, or to the staging database of an interrupted rebuild."""
+    global engine
+    with stage("rebuild"):
+        resume: bool = bool(StageMarkers(markers_path).done) and os.path.exists(staging_path(DB_PATH))
+        if not resume:
+            StageMarkers(markers_path).clear()
+        engine = create_staging_engine(DB_PATH, resume=resume, connect_args={"timeout": 120})
+        if resume:
+            log(f"Resuming the rebuild in {staging_path(DB_PATH)}")
+            return
+
+        # The audio features come from the Spotify API and can't be rebuilt from the raw files
+        try:
+            with engine.begin() as connection:
+                ensure_schema(connection, "audio_features")
+                create_track_cache(connection)
+            copy_tables(engine, DB_PATH, ["audio_features", "track_cache"])
+        except:
+            log(f"Could not copy the audio features from {DB_PATH}", "error")
+            return
+        log(f"Rebuilding the database in {staging_path(DB_PATH)}")
+
+
+def swap_rebuilt_database(results: dict):
+    """Replaces the database with the rebuilt one if every stage succeeded and all expected tables exist."""
+    global engine
+    with stage("swap"):
+        if any(result not in ("ok", "done") for result in results.values()):
+            log(f"Kept the current database, the next run with --rebuild resumes the rebuild in {staging_path(DB_PATH)}",
+                "warning")
+            return
+        problems: list[str] = validate_staging(engine, expected_tables())
+        if problems:
+            log(f"Kept the current database, the rebuilt database is incomplete: {'; '.join(problems)}", "error")
+            return
+        try:
+            swap_in(engine, DB_PATH)
+        except:
+            log(f"Could not replace {DB_PATH} with {staging_path(DB_PATH)}", "error")
+            return
+        engine = sa.create_engine(DB_CONNECTION_URI, connect_args={"timeout": 120})
+        log(f"Replaced {DB_PATH} with the rebuilt database", "success")
 
 
 def clean_data():
     """Cleans the raw data directory and SQLite database."""
+    with stage("clean"):
+        # Remove all subdirectories in the raw data directory
+        try:
+            desc = log("Removing raw data files ", "status", ret_str=True)
+            progress_dirs = track(os.listdir(RAW_DIR), description=desc, transient=True)
+            for sub_dir in progress_dirs:
+                sub_dir_path = os.path.join(RAW_DIR, sub_dir)
+                shutil.rmtree(sub_dir_path)
+        except:
+            log("Failed to remove raw data files", "error")
+            return
 
-    # Remove all subdirectories in the raw data directory
-    try:
-        desc = log("Removing raw data files ", "status", ret_str=True)
-        progress_dirs = track(os.listdir(RAW_DIR), description=desc, transient=True)
-        for sub_dir in progress_dirs:
-            sub_dir_path = os.path.join(RAW_DIR, sub_dir)
-            shutil.rmtree(sub_dir_path)
-    except:
-        log("Failed to remove raw data files", "error")
-        return
+        # Delete all tables in the SQLite db
+        try:
+            with engine.begin() as connection:
+                tables = connection.execute(sa.text("SELECT name FROM sqlite_master WHERE type='table';")).fetchall()
+                desc = log("Dropping all tables in db ", "status", ret_str=True)
+                progress_tables = track(tables, description=desc, transient=True)
+                for table in progress_tables:
+                    connection.execute(sa.text(f"DROP TABLE {table[0]}"))
+        except:
+            log("Failed to drop tables in db", "error")
+            return
 
-    # Delete all tables in the SQLite db
-    try:
-        with engine.begin() as connection:
-            tables = connection.execute(sa.text("SELECT name FROM sqlite_master WHERE type='table';")).fetchall()
-            desc = log("Dropping all tables in db ", "status", ret_str=True)
-            progress_tables = track(tables, description=desc, transient=True)
-            for table in progress_tables:
-                connection.execute(sa.text(f"DROP TABLE {table[0]}"))
-    except:
-        log("Failed to drop tables in db", "error")
-        return
+        # Stages of an incomplete earlier run have to run again
+        StageMarkers(markers_path).clear()
+
+        log("Cleaned raw data directory and SQLite database", "success")
+
+
+def export_snapshot(tables: list):
+    """Writes a columnar snapshot of the given tables and their daily rollups (see snapshot.py)."""
+    with stage("snapshot") as metrics:
+        tables = tables + [rollup_table(table) for table in tables if table in [src['name'] for src in data_sources]]
+        try:
+            desc = log("Writing columnar snapshot ", "status", ret_str=True)
+            for table in track(tables, description=desc, transient=True):
+                write_snapshot(engine, [table])
+                metrics.add(tables=1)
+        except:
+            log("Failed to write columnar snapshot", "error")
+            return
 
-    log("Cleaned raw data directory and SQLite database", "success")
+        log("Wrote columnar snapshot", "success")
 
 
 def download_weather_data(data_src_name: str, path: str):
     """Downloads DWD (German Weather Service) data from the FTP server."""
+    with stage(f"download.{data_src_name}") as metrics:
+        # Open a pool of FTP sessions and list the target directory
+        pool = FTPSessionPool(FTP_URI, size=FTP_SESSIONS, timeout=20, port=FTP_PORT)  # 20 second timeout
+        directory_path, file_name = os.path.split(path)
 
-    # Connect to FTP server and navigate to the target directory
-    try:
-        ftp = FTP(FTP_URI, timeout=20)  # 20 second timeout
-        ftp.login()
-    except:
-        log("Failed to connect to FTP server", "error")
-        return
-
-    directory_path, file_name = os.path.split(path)
+        try:
+            remote_files = list_remote_files(pool, directory_path)
+        except:
+            log("Failed to connect to FTP server", "error")
+            pool.close()
+            return
 
-    try:
-        ftp.cwd(directory_path)
+        try:
+            # Get a list of all files
+            files: list[str] = None
+            if file_name is None or file_name == "":
+                files = sorted(remote_files)
+            else:
+                files = [file_name]
+
+            # Filter for right timeframe (2017-2020)
+            filtered_files: list[str] = []
+            for file in files:
+                match = re.search(r"(\d{8})_(\d{8})", file)
+                if match:
+                    file_start_date, file_end_date = match.group(1), match.group(2)
+                    if file_start_date <= "20170125" and file_end_date >= "20201130":
+                        filtered_files.append(file)
+
+            if is_test:
+                filtered_files = filtered_files[:3]
+
+            # Download each file that is missing or outdated, resuming partial downloads
+            raw_data_directory: str = os.path.join(RAW_DIR, data_src_name)
+            desc = log(f"Downloading {data_src_name} from server ", "status", ret_str=True)
+            with progress_task(desc, total=len(filtered_files)) as advance:
+                result = download_files(pool, directory_path, [remote_files[file] for file in filtered_files],
+                                        raw_data_directory, on_done=lambda _: advance())
+        except:
+            log(f"Failed to download {data_src_name} from server", "error")
+            return
+        finally:
+            pool.close()
+
+        metrics.add(bytes=result.bytes_downloaded, retries=result.retries, files_downloaded=len(result.downloaded),
+                    files_skipped=len(result.skipped), files_failed=len(result.failed))
+        if result.failed:
+            log(f"Failed to download {len(result.failed)} {data_src_name} files, re-run to resume them", "error")
+            return
+
+        log(f"Downloaded {data_src_name} ({len(result.downloaded)} new, {len(result.skipped)} up to date)", "success")
+
+
+def extract_weather_sources(sources: list):
+    """Extracts the new or changed files of the given DWD data sources, one source after the other.
+
+    The station zips are decoded in a process pool if "--workers N" is set.
+    """
+    for data_src in sources:
+        extract_weather_data_to_db(data_src)
+
+
+def plan_weather_ingest(data_src: dict) -> list[ManifestEntry]:
+    """Returns the manifest entries of the downloaded files of a DWD data source that are new or changed."""
+    zip_paths: list[str] = list_station_zips(data_src['name'])
+    # Only the stations inside the selected region are ingested, the locations are stored in any case
+    zip_paths, excluded = select_station_zips(engine, data_src['name'], zip_paths, region)
+    if excluded:
+        log(f"Skipping {len(excluded)} {data_src['name']} stations outside of the selected region")
+    # The daily rollup is created (or rebuilt) and days that lose rows are recomputed in the same transaction
+    value_cols: list[str] = value_columns(data_src['new_columns'])
+    entries: list[ManifestEntry] = plan_ingest(
+        engine, data_src['name'], zip_paths,
+        prepare=lambda connection: ensure_rollup(connection, data_src['name'], value_cols),
+        on_delete=lambda connection, first, last: refresh_days(connection, data_src['name'], value_cols, first, last),
+        excluded=excluded)
+    if entries:
+        log(f"Found {len(entries)} new or changed {data_src['name']} files ({len(zip_paths) - len(entries)} up to date)")
+    else:
+        log(f"Found {data_src['name']} table, all {len(zip_paths)} files are up to date")
+    return entries
 
-        # Get a list of all files
-        files: list[str] = None
-        if file_name is None or file_name == "":
-            files = ftp.nlst()
-        else:
-            files = [file_name]
 
-        # Filter for right timeframe (2017-2020)
-        filtered_files: list[str] = []
-        for file in files:
-            match = re.search(r"(\d{8})_(\d{8})", file)
-            if match:
-                file_start_date, file_end_date = match.group(1), match.group(2)
-                if file_start_date <= "20170125" and file_end_date >= "20201130":
-                    filtered_files.append(file)
+def list_station_zips(data_src_name: str) -> list[str]:
+    """Returns the paths of all downloaded zip files of a DWD data source."""
+    directory: str = os.path.join(RAW_DIR, data_src_name)
+    return [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith(".zip")]
 
-        if is_test:
-            filtered_files = filtered_files[:3]
-
-        # Create target directory
-        raw_data_directory: str = os.path.join(RAW_DIR, data_src_name)
-        os.makedirs(raw_data_directory, exist_ok=True)
-
-        # Download each file
-        desc = log(f"Downloading {data_src_name} from server ", "status", ret_str=True)
-        progress = track(filtered_files, description=desc, transient=True)
-        for file in progress:
-            local_filename: str = os.path.join(raw_data_directory, file)
-            with open(local_filename, "wb") as f:
-                def callback(chunk):
-                    f.write(chunk)
-                ftp.retrbinary("RETR " + file, callback)
-    except:
-        log(f"Failed to download {data_src_name} from server", "error")
-        return
 
-    log(f"Downloaded {data_src_name}", "success")
+def extract_weather_data_to_db(data_src: dict):
+    """Extracts DWD (German Weather Service) data to the database.
 
+    `data_src` is the configuration of the source (see dwd_config.py). Only the files that are not in the ingestion
+    manifest yet (or changed since) are ingested, see plan_ingest. With "--workers N" the zips are decoded in a process
+    pool and their chunks are written in order, otherwise they are decoded in this process. The rejected rows of a file
+    are stored in the rejects table together with its last rows.
+    """
+    data_src_name: str = data_src['name']
+    with stage(f"extract.{data_src_name}") as metrics:
+        # Planning is part of the stage, so a failure marks the stage as failed and it runs again next time
+        try:
+            entries: list[ManifestEntry] = plan_weather_ingest(data_src)
+        except:
+            log(f"Failed to find the new {data_src_name} files", "error")
+            return
+        if not entries:
+            return
 
-def extract_weather_data_to_db(data_src_name: str, cols: str, new_cols: str):
-    """Extracts DWD (German Weather Service) data to the database."""
-    try:
         directory: str = os.path.join(RAW_DIR, data_src_name)
-        # Get a list of all zip files in the directory
-        zip_files = [file for file in os.listdir(directory) if file.endswith(".zip")]
-        # Iterate over the zips with a progress bar
-        desc = log(f"Extracting {data_src_name} into database ", "status", ret_str=True)
-        for zip_file in track(zip_files, description=desc, transient=True):
-            zip_path: str = os.path.join(directory, zip_file)
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                # Get a list of member files contained in the zip file (excluding metadata files)
-                member_files = [member for member in zip_ref.namelist() if not member.startswith("Metadaten_")]
-                for member in member_files:
-                    # Read each member file into a pandas DataFrame
-                    with zip_ref.open(name=member, mode="r") as tmpfile:
-                        df = pd.read_csv(tmpfile, sep=";")
-                        # Remove unnecessary columns from the DataFrame
-                        df = df.filter(items=cols)
-                        # Rename columns to a more readable format
-                        df = df.rename(columns=dict(zip(cols, new_cols)))
-                        # Convert mess_datum column to datetime format
-                        try:
-                            df["mess_datum"] = pd.to_datetime(df["mess_datum"], format="%Y%m%d%H")
-                        except:
-                            df["mess_datum"] = pd.to_datetime(df["mess_datum"], format="%Y%m%d")
-                        # Filter dates between 2017.01.25 and 2020.11.30 (inclusive)
-                        df = df[(df['mess_datum'] >= start_date) & (df['mess_datum'] <= end_date)]
-                        # Store the data into the SQLiteDB
-                        df.to_sql(data_src_name, engine, if_exists="append", index=False)
-    except:
-        log(f"Failed to extract {data_src_name} into database", "error")
-        return
+        metrics.add(bytes=sum(entry.file_size for entry in entries), files=len(entries))
+        executor: ProcessPoolExecutor = None
+        if workers > 1:
+            # Spawned, not forked: the stages run in threads that may hold FTP, SQLAlchemy or logging locks
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            decoded = submit_ordered(executor, decode_station_zip,
+                                     [(os.path.join(directory, entry.file_name), data_src, start_date, end_date)
+                                      for entry in entries], window=2 * workers)
+        else:
+            decoded = (stream_station_zip(os.path.join(directory, entry.file_name), data_src, start_date, end_date)
+                       for entry in entries)
+        try:
+            desc = log(f"Extracting {data_src_name} into database ", "status", ret_str=True)
+            # Stream the zips chunk by chunk into large batched transactions, with a progress bar
+            value_cols: list[str] = value_columns(data_src['new_columns'])
+
+            def on_batch(connection, batch):
+                # Each batch is also merged into the daily rollup, in the same transaction
+                merge_batch(connection, data_src_name, value_cols, batch)
+
+            with BatchWriter(engine, data_src_name, on_batch=on_batch) as writer:
+                for entry, station in track(zip(entries, decoded), total=len(entries), description=desc, transient=True):
+                    if isinstance(station, Future):
+                        station = station.result()
+                    chunks, rejects = station
+                    for chunk in chunks:
+                        entry.row_count += len(chunk)
+                        metrics.add(rows_in=len(chunk))
+                        writer.write(chunk)
+                    if rejects:
+                        rejected = pd.concat(rejects, ignore_index=True)
+                        metrics.add(**reject_counts(rejected))
+                        writer.defer(lambda connection, rejected=rejected, entry=entry:
+                                     write_rejects(connection, data_src_name, rejected, entry.file_name))
+                    # The file is recorded in the manifest together with its last rows
+                    writer.defer(lambda connection, entry=entry: record_ingest(connection, entry))
+            metrics.add(rows_out=writer.rows_written)
+        except:
+            log(f"Failed to extract {data_src_name} into database", "error")
+            return
+        finally:
+            if executor is not None:
+                # Zips that were not decoded yet are dropped
+                executor.shutdown(cancel_futures=True)
 
-    log(f"Extracted {data_src_name}", "success")
+        log(f"Extracted {data_src_name}", "success")
 
 
 def download_spotify_data(spotify: str):
     """Downloads Spotify data from Kaggle."""
+    with stage(f"download.{spotify}") as metrics:
+        # Working with the kaggle API requires an API Token, see:
+        # https://www.kaggle.com/docs/api
+        # https://github.com/Kaggle/kaggle-api
 
-    # Working with the kaggle API requires an API Token, see:
-    # https://www.kaggle.com/docs/api
-    # https://github.com/Kaggle/kaggle-api
+        spotify_uri: str = "pepepython/spotify-huge-database-daily-charts-over-3-years"
 
-    spotify_uri: str = "pepepython/spotify-huge-database-daily-charts-over-3-years"
+        # Authenticate with the Kaggle API (importing the kaggle package already authenticates, so it is imported here)
+        try:
+            from kaggle.api.kaggle_api_extended import KaggleApi
+            api = KaggleApi()
+            api.authenticate()
+        except:
+            log("Could not authenticate with Kaggle API", "error")
+            return
 
-    # Authenticate with the Kaggle API
-    try:
-        api = KaggleApi()
-        api.authenticate()
-    except:
-        log("Could not authenticate with Kaggle API", "error")
-        return
+        print(log(f"Downloading {spotify} from server", "status", ret_str=True), end="\r")
 
-    print(log(f"Downloading {spotify} from server", "status", ret_str=True), end="\r")
+        # Download the dataset
+        try:
+            api.dataset_download_files(spotify_uri, path=os.path.join(RAW_DIR, spotify))
+        except:
+            log(f"Could not download {spotify}" + " " * 5, "error")
+            return
 
-    # Download the dataset
-    try:
-        api.dataset_download_files(spotify_uri, path=os.path.join(RAW_DIR, spotify))
-    except:
-        log(f"Could not download {spotify}" + " " * 5, "error")
+        metrics.add(bytes=sum(os.path.getsize(entry.path) for entry in os.scandir(os.path.join(RAW_DIR, spotify))))
+        log(f"Downloaded {spotify}" + " " * 15, "success")
         return
 
-    log(f"Downloaded {spotify}" + " " * 15, "success")
-    return
-
 
 def extract_spotify_data_to_db(spotify: str):
     """Extracts Spotify data from the downloaded ZIP file and stores it in the database."""
+    with stage(f"extract.{spotify}") as metrics:
+        data_src_path: str = os.path.join(RAW_DIR, spotify, CHARTS_ZIP_NAME)
+
+        print(log(f"Extracting {spotify} into database", "status", ret_str=True), end="\r")
+
+        try:
+            # Stream the CSV and only keep rows where country is Germany
+            metrics.add(bytes=os.path.getsize(data_src_path))
+            rejects: list = []
+            if chart_countries is None:
+                df = load_country_charts(data_src_path, "Germany", rejects=rejects)
+            else:
+                df = extract_country_charts(data_src_path, rejects)
+            # Store the data into the SQLiteDB, replacing the previous table
+            with engine.begin() as connection:
+                connection.execute(sa.text(f"DROP TABLE IF EXISTS {spotify}"))
+                append_rows(connection, spotify, df)
+                for rejected in rejects:
+                    write_rejects(connection, spotify if chart_countries is None else COUNTRY_CHARTS_TABLE, rejected,
+                                  CHARTS_ZIP_NAME)
+                    metrics.add(**reject_counts(rejected))
+            metrics.add(rows_out=len(df))
+        except:
+            log((f"Could not extract {spotify}" + " " * 7), "error")
+            return
+
+        log((f"Extracted {spotify}" + " " * 15), "success")
 
-    ZIP_NAME: str = "spotify-huge-database-daily-charts-over-3-years.zip"
-    MEMBER_NAME: str = "Database to calculate popularity.csv"
-    data_src_path: str = os.path.join(RAW_DIR, spotify, ZIP_NAME)
-
-    print(log(f"Extracting {spotify} into database", "status", ret_str=True), end="\r")
-
-    try:
-        zip_ref = zipfile.ZipFile(data_src_path, "r")
-        tmpfile = zip_ref.open(name=MEMBER_NAME, mode="r")
-        df = pd.read_csv(tmpfile)
-
-        # Filter to only include rows where country is Germany
-        df = df[df["country"] == "Germany"]
-        # Drop the unnecessary columns
-        df.drop(["Unnamed: 0", "country"], axis=1, inplace=True)
-        # Convert the "date" column to pd.datetime
-        df["date"] = pd.to_datetime(df["date"], format="%d/%m/%Y")
-        # Change the "position" column to integer
-        df["position"] = df["position"].astype(int)
-        # convert uri to track id
-        df["uri"] = df["uri"].str.strip()
-        df["uri"] = df["uri"].apply(lambda uri: uri.split("/")[-1])
-        df.rename(columns={"uri": "track_id"}, inplace=True)
-        # Store the data into the SQLiteDB
-        df.to_sql(spotify, engine, if_exists="replace", index=False)
-    except:
-        log((f"Could not extract {spotify}" + " " * 7), "error")
-
-    log((f"Extracted {spotify}" + " " * 15), "success")
+
+def extract_country_charts(data_src_path: str, rejects: list) -> pd.DataFrame:
+    """Stores the charts of the countries selected with "--countries" in the country_charts table, replacing their
+    earlier charts, in a single pass over the CSV.
+
+    The distinct track ids of these charts replace the chart_tracks table, the countries of the CSV are recorded in
+    chart_countries. Returns the German charts.
+    """
+    countries: list[str] = None if chart_countries == ["all"] else sorted(set(chart_countries) | {"Germany"})
+    with engine.begin() as connection:
+        ensure_schema(connection, COUNTRY_CHARTS_TABLE)
+        if countries is None:
+            connection.execute(sa.text(f"DELETE FROM {COUNTRY_CHARTS_TABLE}"))
+        else:
+            placeholders: str = ", ".join(f":country{i}" for i in range(len(countries)))
+            connection.execute(sa.text(f"DELETE FROM {COUNTRY_CHARTS_TABLE} WHERE country IN ({placeholders})"),
+                               {f"country{i}": country for i, country in enumerate(countries)})
+        bump_version(connection, COUNTRY_CHARTS_TABLE)
+
+    german: list[pd.DataFrame] = []
+    track_ids: set[str] = set()
+    seen: set[str] = set()
+    # Stream the CSV once, each chunk holds rows of many countries
+    with BatchWriter(engine, COUNTRY_CHARTS_TABLE) as writer:
+        for chunk in iter_country_charts(data_src_path, countries, rejects=rejects, seen=seen):
+            writer.write(chunk)
+            german.append(chunk.loc[chunk["country"] == "Germany"].drop(columns="country"))
+            track_ids.update(chunk["track_id"].unique())
+
+    with engine.begin() as connection:
+        connection.execute(sa.text(f"DROP TABLE IF EXISTS {CHART_TRACKS_TABLE}"))
+        append_rows(connection, CHART_TRACKS_TABLE, pd.DataFrame({"track_id": sorted(track_ids)}))
+        # Countries stored by earlier runs keep their charts
+        stored: set = set()
+        if sa.inspect(connection).has_table(CHART_COUNTRIES_TABLE):
+            stored = {row[0] for row in connection.execute(
+                sa.text(f"SELECT country FROM {CHART_COUNTRIES_TABLE} WHERE stored = 1"))}
+        stored |= seen if countries is None else set(countries)
+        append_rows(connection, CHART_COUNTRIES_TABLE,
+                    pd.DataFrame({"country": sorted(seen), "stored": [int(country in stored) for country in sorted(seen)]}))
+    log(f"Stored the charts of {'all countries' if countries is None else ', '.join(countries)} "
+        f"({writer.rows_written} rows, {len(track_ids)} distinct tracks)")
+    return pd.concat(german, ignore_index=True) if german else pd.DataFrame(columns=["date", "position", "track_id"])
 
 
 def get_spotify_metadata(spotify: str):
     """Gets the metadata for each track through the Spotify API."""
+    with stage(f"metadata.{spotify}") as metrics:
+        print(log(f"Getting {spotify} track metadata", "status", ret_str=True), end="\r")
 
-    print(log(f"Getting {spotify} track metadata", "status", ret_str=True), end="\r")
-
-    # get a list of all tracks in the database
-    tracks = None
-    try:
-        connection = engine.connect()
-        if is_test:
-            tracks = connection.execute(sa.text(f"SELECT DISTINCT track_id FROM {spotify} LIMIT 10;")).fetchall()
-        else:
-            tracks = connection.execute(sa.text(f"SELECT DISTINCT track_id FROM {spotify};")).fetchall()
-        assert tracks is not None
-    except:
-        log(f"Could not get {spotify} from database", "error")
-        return None
+        # get a list of all tracks in the database that were not fetched by an earlier (possibly interrupted) run
+        tracks = None
+        try:
+            with engine.begin() as connection:
+                create_track_cache(connection)
+                # With "--countries" the distinct tracks of all selected countries are fetched, each one once
+                tracks = uncached_track_ids(connection, spotify if chart_countries is None else CHART_TRACKS_TABLE,
+                                            limit=10 if is_test else None)
+            assert tracks is not None
+        except:
+            log(f"Could not get {spotify} from database", "error")
+            return None
 
-    tracks = [track_row[0].strip() for track_row in tracks]
-    try:
-        tracks.remove("N\\A")
-        tracks.remove("#")
-    except:
-        pass  # ignore
+        if not tracks:
+            log(f"Found {spotify} track metadata for all tracks")
+            return None
 
-    tracks_100 = [tracks[i:i + 100] for i in range(0, len(tracks), 100)]
+        tracks_100 = [tracks[i:i + 100] for i in range(0, len(tracks), 100)]
+        metrics.add(rows_in=len(tracks))
 
-    sp, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET = None, None, None
+        sp, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET = None, None, None
 
-    if is_test:
-        # Read the Spotify credentials from environment variables
+        if is_test:
+            # Read the Spotify credentials from environment variables
+            try:
+                SPOTIFY_CLIENT_ID = os.environ["SPOTIFY_CLIENT_ID"]
+                assert SPOTIFY_CLIENT_ID is not None
+                SPOTIFY_CLIENT_SECRET = os.environ["SPOTIFY_CLIENT_SECRET"]
+                assert SPOTIFY_CLIENT_SECRET is not None
+            except:
+                log("Could not read Spotify credentials from environment variables", "error")
+                return None
+        else:
+            # Read the Spotify credentials from a file
+            try:
+                lines = open("./spotify_credentials.txt", "r").readlines()
+                SPOTIFY_CLIENT_ID = lines[0].strip()
+                SPOTIFY_CLIENT_SECRET = lines[1].strip()
+            except:
+                log("Could not read Spotify credentials file", "error")
+                return None
+
+        # Authenticate with the Spotify API
         try:
-            SPOTIFY_CLIENT_ID = os.environ["SPOTIFY_CLIENT_ID"]
-            assert SPOTIFY_CLIENT_ID is not None
-            SPOTIFY_CLIENT_SECRET = os.environ["SPOTIFY_CLIENT_SECRET"]
-            assert SPOTIFY_CLIENT_SECRET is not None
+            auth_manager = spotipy.oauth2.SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID,
+                                                                   client_secret=SPOTIFY_CLIENT_SECRET)
+            sp = make_client(auth_manager)
         except:
-            log("Could not read Spotify credentials from environment variables", "error")
+            log("Could not authenticate with Spotify API", "error")
             return None
-    else:
-        # Read the Spotify credentials from a file
+
+        # Get the metadata for each track, several batches at a time under a shared rate limit
+        # Each batch is stored as soon as it arrives, so an interrupted run resumes with the missing tracks
         try:
-            lines = open("./spotify_credentials.txt", "r").readlines()
-            SPOTIFY_CLIENT_ID = lines[0].strip()
-            SPOTIFY_CLIENT_SECRET = lines[1].strip()
+            desc = log(f"Getting {spotify} track metadata from server ", "status", ret_str=True)
+            results = fetch_audio_features(sp, tracks_100, on_retry=lambda: metrics.add(retries=1))
+            for batch, new_features in track(results, total=len(tracks_100), description=desc, transient=True):
+                with engine.begin() as connection:
+                    store_batch(connection, batch, new_features)
+                metrics.add(rows_out=sum(1 for entry in new_features if entry), batches=1)
         except:
-            log("Could not read Spotify credentials file", "error")
+            log(f"Could not get {spotify} track metadata from server, re-run to resume", "error")
             return None
 
-    # Authenticate with the Spotify API
-    try:
-        auth_manager = spotipy.oauth2.SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
-        sp = spotipy.Spotify(client_credentials_manager=auth_manager)
-    except:
-        log("Could not authenticate with Spotify API", "error")
-        return None
-
-    # Get the metadata for each track
-    audio_features = pd.DataFrame(columns=["uri", "danceability", "energy", "key", "loudness", "mode", "speechiness",
-                                  "acousticness", "instrumentalness", "liveness", "valence", "tempo", "duration_ms"])
-    try:
-        desc = log(f"Getting {spotify} track metadata from server ", "status", ret_str=True)
-        progress = track(tracks_100, description=desc, transient=True)
-        for spotify_track in progress:
-            while True:
-                try:
-                    new_features = sp.audio_features(spotify_track)
-                    new_features = pd.DataFrame.from_dict(new_features)
-                    audio_features = pd.concat([audio_features, new_features], join="inner", sort=True)
-                    break
-                except:
-                    # The exact Spotify API rate limit is not publicly documented, but this seems to work
-                    time.sleep(20)
-    except:
-        log(f"Could not get {spotify} track metadata from server", "error")
-        return None
-
-    try:
-        # create common column "track_id"
-        audio_features["uri"] = audio_features["uri"].apply(lambda uri: uri.split(":")[-1])
-        audio_features.rename(columns={"uri": "track_id"}, inplace=True)
-        # Store metadata in the database
-        audio_features.to_sql("audio_features", engine, if_exists="replace", index=False)
-    except:
-        log(f"Could not store {spotify} track metadata in database", "error")
-        return None
-
-    log(f"Extracted {spotify} track metadata", "success")
+        log(f"Extracted {spotify} track metadata", "success")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+# projection, date range and station pushdown over data.sqlite (see db_schema.py for the tables)
+# - only the requested columns are read, the date range and the station set become WHERE clauses on the primary key
+#   or the date index (timestamps are stored as ISO-8601 text, so range comparisons can use the index)
+# - level "day" or "month" aggregates a weather table in SQL: the mean over the selected stations, ignoring the missing
+#   value sentinel; without a station filter the daily rollup (see rollups.py) is read instead of the base table
+# - the results have compact dtypes: float32 for REAL columns, the smallest integer type of the column (nullable if
+#   the column is), datetime64 for dates, and large results can be read in chunks
+#
+# usage:
+#   from query import iter_query, query
+#   df = query(db_uri, "temperature_data", ["mess_datum", "lufttemperatur"], start="2020-01-01", end="2020-02-01")
+#   df = query(db_uri, "wind_data", ["windstaerke"], stations=[433, 1975], level="month")
+#   for chunk in iter_query(db_uri, "spotify_data", ["date", "track_id"], chunksize=100_000): ...
+
+import pandas as pd
+import sqlalchemy as sa
+
+from typing import Iterator
+
+from db_schema import DATE_FORMATS, SCHEMA
+from dwd_config import data_sources
+from rollups import SENTINEL, rollup_table, value_columns
+
+
+LEVELS: tuple = (None, "day", "month")
+# length of the ISO-8601 prefix of a timestamp that identifies the period, and its format
+PERIODS: dict[str, tuple[int, str]] = {"day": (10, "%Y-%m-%d"), "month": (7, "%Y-%m")}
+
+# integer columns with a known small range
+SMALL_INTEGERS: dict[str, str] = {"position": "int16", "key": "Int16", "mode": "Int16"}
+
+
+def column_dtypes(table: str) -> dict[str, str]:
+    """Returns the compact dtype of every column of a table in SCHEMA."""
+    data_src: dict = next((data_src for data_src in data_sources if data_src["name"] == table), None)
+    # The DWD tables use the dtypes the station files are parsed with (see dwd_config.py)
+    weather: dict = {}
+    if data_src is not None:
+        renamed: dict = dict(zip(data_src["columns"], data_src["new_columns"]))
+        weather = {renamed[col]: dtype for col, dtype in data_src["dtypes"].items()}
+
+    dtypes: dict[str, str] = {}
+    for col, col_type in SCHEMA[table].columns.items():
+        base: str = col_type.split()[0]
+        nullable: bool = "NOT NULL" not in col_type
+        if base in DATE_FORMATS:
+            dtypes[col] = "datetime64[ns]"
+        elif col in weather:
+            dtypes[col] = "float32" if weather[col].startswith("float") else weather[col]
+        elif col in SMALL_INTEGERS:
+            dtypes[col] = SMALL_INTEGERS[col]
+        elif base == "INTEGER":
+            dtypes[col] = "Int32" if nullable else "int32"
+        elif base == "REAL":
+            dtypes[col] = "float32"
+        else:
+            dtypes[col] = "object"
+    return dtypes
+
+
+def date_column(table: str) -> str:
+    """Returns the date or timestamp column of the primary key of a table, or None."""
+    schema = SCHEMA[table]
+    return next((col for col in schema.primary_key if schema.columns[col].split()[0] in DATE_FORMATS), None)
+
+
+def _bound(value, date_format: str) -> str:
+    return None if value is None else pd.Timestamp(value).strftime(date_format)
+
+
+def iter_query(db_uri: str, table: str, columns: list = None, start=None, end=None, stations: list = None,
+               level: str = None, chunksize: int = None) -> Iterator[pd.DataFrame]:
+    """Returns an iterator over the selected rows of a table in chunks of up to `chunksize` rows (one chunk without).
+
+    `start` (inclusive) and `end` (exclusive) restrict the date column of the table, `stations` the station ids of a
+    DWD table. With `level` "day" or "month", the mean of the `columns` of a DWD table over the selected stations and
+    rows is returned per period, in a "date" column (the first day of the period); `start` and `end` are days then.
+    """
+    if table not in SCHEMA:
+        raise ValueError(f"unknown table {table}")
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {LEVELS}")
+    dtypes: dict = column_dtypes(table)
+    date_col: str = date_column(table)
+    if level is not None:
+        columns = value_columns(columns or list(SCHEMA[table].columns))
+    columns = columns or list(SCHEMA[table].columns)
+    unknown: list = [col for col in columns if col not in dtypes]
+    if unknown:
+        raise ValueError(f"unknown columns of {table}: {', '.join(unknown)}")
+    if stations is not None and "stations_id" not in dtypes:
+        raise ValueError(f"{table} has no stations")
+    if date_col is None and (start is not None or end is not None):
+        raise ValueError(f"{table} has no date column")
+
+    if level is not None:
+        if date_col != "mess_datum":
+            raise ValueError(f"only the DWD tables can be aggregated, not {table}")
+        sql, params = _aggregate_sql(db_uri, table, columns, _bound(start, "%Y-%m-%d"), _bound(end, "%Y-%m-%d"),
+                                     stations, level)
+        dtypes = {"date": "datetime64[ns]", **{col: "float32" for col in columns}}
+        date_formats: dict = {"date": PERIODS[level][1]}
+    else:
+        date_format: str = DATE_FORMATS[SCHEMA[table].columns[date_col].split()[0]] if date_col else None
+        params: dict = {}
+        where: str = _where(date_col, _bound(start, date_format), _bound(end, date_format), stations, params)
+        sql = f"SELECT {', '.join(columns)} FROM {table} {where}"
+        date_formats = {col: DATE_FORMATS[SCHEMA[table].columns[col].split()[0]] for col in columns
+                        if dtypes[col] == "datetime64[ns]"}
+    return _read(db_uri, sql, params, dtypes, date_formats, chunksize)
+
+
+def query(db_uri: str, table: str, columns: list = None, start=None, end=None, stations: list = None,
+          level: str = None) -> pd.DataFrame:
+    """Returns the selected rows of a table as one DataFrame, see iter_query()."""
+    return list(iter_query(db_uri, table, columns, start, end, stations, level))[0]
+
+
+def _read(db_uri: str, sql: str, params: dict, dtypes: dict, date_formats: dict, chunksize: int) -> Iterator[pd.DataFrame]:
+    engine = sa.create_engine(db_uri)
+    try:
+        with engine.connect() as connection:
+            result = pd.read_sql_query(sa.text(sql), connection, params=params, chunksize=chunksize)
+            for chunk in ([result] if chunksize is None else result):
+                yield _compact(chunk, dtypes, date_formats)
+    finally:
+        engine.dispose()
+
+
+def _where(column: str, start: str, end: str, stations: list, params: dict) -> str:
+    conditions: list[str] = []
+    if start is not None:
+        conditions.append(f"{column} >= :start")
+        params["start"] = start
+    if end is not None:
+        conditions.append(f"{column} < :end")
+        params["end"] = end
+    if stations is not None:
+        placeholders: list[str] = [f":station{i}" for i in range(len(stations))]
+        conditions.append(f"stations_id IN ({', '.join(placeholders) or 'NULL'})")
+        params.update({f"station{i}": int(stations_id) for i, stations_id in enumerate(stations)})
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def _aggregate_sql(db_uri: str, table: str, columns: list, start: str, end: str, stations: list,
+                   level: str) -> tuple[str, dict]:
+    length, _ = PERIODS[level]
+    params: dict = {}
+    engine = sa.create_engine(db_uri)
+    with engine.connect() as connection:
+        has_rollup: bool = sa.inspect(connection).has_table(rollup_table(table))
+    engine.dispose()
+
+    if stations is None and has_rollup:
+        # The rollup has the mean and count of every day, a month is the count weighted mean of its days
+        where: str = _where("date", start, end, None, params)
+        means: str = ", ".join(f"SUM({col}_mean * {col}_count) / NULLIF(SUM({col}_count), 0) AS {col}" for col in columns)
+        return (f"SELECT substr(date, 1, {length}) AS date, {means} FROM {rollup_table(table)} {where} "
+                "GROUP BY 1 ORDER BY 1"), params
+
+    # "YYYY-MM-DD HH:MM:SS" >= "YYYY-MM-DD" holds for every time of the day, so days work as bounds
+    where = _where("mess_datum", start, end, stations, params)
+    means = ", ".join(f"AVG(NULLIF({col}, {SENTINEL})) AS {col}" for col in columns)
+    return f"SELECT substr(mess_datum, 1, {length}) AS date, {means} FROM {table} {where} GROUP BY 1 ORDER BY 1", params
+
+
+def _compact(df: pd.DataFrame, dtypes: dict, date_formats: dict) -> pd.DataFrame:
+    for col in df.columns:
+        if col in date_formats:
+            df[col] = pd.to_datetime(df[col], format=date_formats[col])
+        elif dtypes[col] != "object":
+            df[col] = df[col].astype(dtypes[col])
+    return df
@@ -0,0 +1,150 @@
+# materialized daily rollups of the subdaily DWD (German Weather Service) tables, e.g. cloud_data -> cloud_data_daily
+# - one row per day with mean/min/max/count of every measured variable over all stations and observations
+# - the DWD missing value sentinel (-999) is treated as NULL, i.e. it is neither averaged nor counted
+# - new rows are merged into the rollup batch by batch (mean/count/min/max can be combined without the base table),
+#   days that lost rows (replaced station files) are recomputed from the base table
+# - a batch is merged before it is appended, duplicate keys count once (like INSERT OR REPLACE stores them) and days
+#   whose rows are replaced are recomputed from the rows that stay and the batch
+
+import pandas as pd
+import sqlalchemy as sa
+
+from db_schema import DATE_FORMATS, bump_version
+
+
+SENTINEL: int = -999
+AGGREGATES: tuple[str] = ("mean", "min", "max", "count")
+
+
+def rollup_table(source: str) -> str:
+    """Returns the name of the daily rollup table of a data source."""
+    return f"{source}_daily"
+
+
+def value_columns(new_cols: list) -> list[str]:
+    """Returns the measured variables of a data source (all columns except the station id and the timestamp)."""
+    return [col for col in new_cols if col not in ("stations_id", "mess_datum")]
+
+
+def ensure_rollup(connection, source: str, value_cols: list):
+    """Creates the rollup table and (re-)builds it if it is missing or the base table was dropped."""
+    table: str = rollup_table(source)
+    inspector = sa.inspect(connection)
+    existed: bool = inspector.has_table(table)
+    columns: str = ", ".join(f"{col}_{agg} {'INTEGER NOT NULL' if agg == 'count' else 'REAL'}"
+                             for col in value_cols for agg in AGGREGATES)
+    connection.execute(sa.text(f"CREATE TABLE IF NOT EXISTS {table} (date DATE PRIMARY KEY, {columns})"))
+
+    if not inspector.has_table(source):
+        connection.execute(sa.text(f"DELETE FROM {table}"))
+        bump_version(connection, table)
+    elif not existed:
+        refresh_days(connection, source, value_cols)
+
+
+def refresh_days(connection, source: str, value_cols: list, first=None, last=None):
+    """Recomputes the rollup from the base table for all days between `first` and `last` (inclusive, default: all)."""
+    table: str = rollup_table(source)
+    where: str = ""
+    params: dict = {}
+    if first is not None and last is not None:
+        where = "WHERE date BETWEEN :first AND :last"
+        params = {"first": str(first)[:10], "last": str(last)[:10]}
+
+    selects: list[str] = []
+    for col in value_cols:
+        value: str = f"NULLIF({col}, {SENTINEL})"
+        selects += [f"AVG({value})", f"MIN({value})", f"MAX({value})", f"COUNT({value})"]
+    columns: str = ", ".join(f"{col}_{agg}" for col in value_cols for agg in AGGREGATES)
+
+    bump_version(connection, table)
+    connection.execute(sa.text(f"DELETE FROM {table} {where}"), params)
+    connection.execute(sa.text(f"""
+        INSERT INTO {table} (date, {columns})
+        SELECT date, {", ".join(selects)}
+        FROM (SELECT substr(mess_datum, 1, 10) AS date, * FROM {source})
+        {where}
+        GROUP BY date"""), params)
+
+
+def merge_batch(connection, source: str, value_cols: list, batch: pd.DataFrame):
+    """Merges the daily aggregates of a batch into the rollup. Call it before the batch is appended to the base table."""
+    # The base table keeps the last row of a primary key (INSERT OR REPLACE), so duplicates count once
+    batch = batch.drop_duplicates(["stations_id", "mess_datum"], keep="last")
+    bump_version(connection, rollup_table(source))
+
+    replaced: list[str] = _replaced_days(connection, source, batch)
+    if replaced:
+        # Days whose rows are replaced are recomputed from their other rows in the base table and the batch
+        in_replaced = batch["mess_datum"].dt.strftime("%Y-%m-%d").isin(replaced)
+        kept = _day_rows(connection, source, value_cols, replaced)
+        kept = kept[~pd.MultiIndex.from_frame(kept[["stations_id", "mess_datum"]]).isin(
+            pd.MultiIndex.from_frame(batch[["stations_id", "mess_datum"]]))]
+        daily = _daily(pd.concat([kept, batch[in_replaced]], ignore_index=True), value_cols)
+        columns: list[str] = list(daily.columns)
+        connection.execute(sa.text(f"""
+            INSERT OR REPLACE INTO {rollup_table(source)} ({", ".join(columns)})
+            VALUES ({", ".join(":" + col for col in columns)})"""), daily.to_dict("records"))
+        batch = batch[~in_replaced]
+    if batch.empty:
+        return
+
+    daily = _daily(batch, value_cols)
+    updates: list[str] = []
+    for col in value_cols:
+        mean, low, high, count = (f"{col}_{agg}" for agg in AGGREGATES)
+        # All expressions of an UPDATE see the old row, so the count in the mean is still the previous one
+        updates += [
+            f"{mean} = CASE WHEN {count} + excluded.{count} = 0 THEN NULL ELSE "
+            f"(COALESCE({mean}, 0) * {count} + COALESCE(excluded.{mean}, 0) * excluded.{count}) "
+            f"/ ({count} + excluded.{count}) END",
+            f"{low} = COALESCE(MIN({low}, excluded.{low}), {low}, excluded.{low})",
+            f"{high} = COALESCE(MAX({high}, excluded.{high}), {high}, excluded.{high})",
+            f"{count} = {count} + excluded.{count}",
+        ]
+    columns: list[str] = list(daily.columns)
+    statement = sa.text(f"""
+        INSERT INTO {rollup_table(source)} ({", ".join(columns)})
+        VALUES ({", ".join(":" + col for col in columns)})
+        ON CONFLICT(date) DO UPDATE SET {", ".join(updates)}""")
+    connection.execute(statement, daily.to_dict("records"))
+
+
+def _daily(rows: pd.DataFrame, value_cols: list) -> pd.DataFrame:
+    # mean/min/max/count per day, as records for the rollup table
+    values = rows[value_cols].astype("float64").mask(rows[value_cols] == SENTINEL)
+    grouped = values.groupby(rows["mess_datum"].dt.normalize())
+    daily = pd.concat([grouped.mean(), grouped.min(), grouped.max(), grouped.count()], axis=1, keys=AGGREGATES)
+    daily.columns = [f"{col}_{agg}" for agg, col in daily.columns]
+    daily = daily[[f"{col}_{agg}" for col in value_cols for agg in AGGREGATES]]
+    daily = daily.astype(object).where(daily.notna(), None)
+    daily.insert(0, "date", daily.index.strftime("%Y-%m-%d"))
+    return daily
+
+
+def _replaced_days(connection, source: str, batch: pd.DataFrame) -> list[str]:
+    # Days of the batch rows whose primary key is already in the base table, one range lookup per station
+    if batch.empty or not sa.inspect(connection).has_table(source):
+        return []
+    days: set[str] = set()
+    for stations_id, rows in batch.groupby("stations_id"):
+        stamps = rows["mess_datum"].dt.strftime(DATE_FORMATS["TIMESTAMP"])
+        params: dict = {"stations_id": int(stations_id), "first": stamps.min(), "last": stamps.max()}
+        stored = connection.execute(sa.text(f"""
+            SELECT mess_datum FROM {source}
+            WHERE stations_id = :stations_id AND mess_datum BETWEEN :first AND :last"""), params).scalars()
+        days.update(stamp[:10] for stamp in set(stored) & set(stamps))
+    return sorted(days)
+
+
+def _day_rows(connection, source: str, value_cols: list, days: list) -> pd.DataFrame:
+    # All rows of the given days in the base table (range lookups on the mess_datum index)
+    frames: list[pd.DataFrame] = []
+    for day in days:
+        next_day: str = (pd.Timestamp(day) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        statement = sa.text(f"""
+            SELECT stations_id, mess_datum, {", ".join(value_cols)} FROM {source}
+            WHERE mess_datum >= :day AND mess_datum < :next_day""")
+        frames.append(pd.read_sql(statement, connection, params={"day": day, "next_day": next_day},
+                                  parse_dates=["mess_datum"]))
+    return pd.concat(frames, ignore_index=True)
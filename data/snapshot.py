@@ -0,0 +1,138 @@
+# columnar snapshot of data.sqlite for fast analysis, written by pull-data.py into data/snapshot/
+# - one directory per table with one .npy file per column and a meta.json describing the columns
+# - numbers are stored as int64/float64, timestamps as datetime64, text is dictionary-encoded (int32 codes + categories)
+# - the loader memory-maps the column files (copy-on-write), so opening a table does not read or copy the data
+# - meta.json records the version of the table (see db_schema.bump_version) the snapshot was written at, so readers
+#   can tell whether the snapshot is still current (see data_access.load_coded_data)
+#
+# usage (e.g. from project/report_source.ipynb):
+#   import sys; sys.path.append("../data")
+#   from snapshot import load_table
+#   cloud_df = load_table("cloud_data_daily")
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sqlalchemy as sa
+
+from db_schema import table_versions
+
+SNAPSHOT_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot")
+CHUNK_ROWS: int = 500_000
+
+# numpy dtype for each declared SQLite column type (anything else is treated as text)
+COLUMN_DTYPES: dict[str, str] = {
+    "INTEGER": "int64", "BIGINT": "int64", "REAL": "float64", "FLOAT": "float64",
+    "TIMESTAMP": "datetime64[s]", "DATETIME": "datetime64[s]", "DATE": "datetime64[D]",
+}
+
+
+def _column_kinds(connection, table: str) -> dict:
+    # PRAGMA table_info rows: (cid, name, type, notnull, default, pk)
+    info = connection.execute(sa.text(f"PRAGMA table_info({table})")).fetchall()
+    kinds: dict = {}
+    for _, name, col_type, *_ in info:
+        dtype: str = COLUMN_DTYPES.get(col_type.split("(")[0].upper(), "text")
+        if dtype == "int64":
+            # NULLs can't be represented in an integer array
+            nulls: int = connection.execute(sa.text(f"SELECT COUNT(*) - COUNT({name}) FROM {table}")).scalar()
+            dtype = "float64" if nulls else dtype
+        kinds[name] = dtype
+    return kinds
+
+
+def write_table(engine, table: str, snapshot_dir: str = SNAPSHOT_DIR, chunksize: int = CHUNK_ROWS):
+    """Writes the snapshot of one table, streaming it out of the database in chunks."""
+    with engine.connect() as connection:
+        # The version is read first: if the table changes while it is written, the snapshot is outdated right away
+        version: str = table_versions(connection, [table])[table]
+        kinds: dict = _column_kinds(connection, table)
+        n_rows: int = connection.execute(sa.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+        # Write into a temporary directory first, so readers never see a half-written table
+        target: str = os.path.join(snapshot_dir, table)
+        tmp: str = target + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        arrays: dict = {}
+        categories: dict = {}
+        for name, dtype in kinds.items():
+            array_dtype: str = "int32" if dtype == "text" else dtype
+            arrays[name] = np.lib.format.open_memmap(os.path.join(tmp, f"{name}.npy"), mode="w+", dtype=array_dtype,
+                                                     shape=(n_rows,))
+            categories[name] = {}
+
+        offset: int = 0
+        for chunk in pd.read_sql_query(sa.text(f"SELECT {', '.join(kinds)} FROM {table}"), connection, chunksize=chunksize):
+            end: int = offset + len(chunk)
+            for name, dtype in kinds.items():
+                values = chunk[name]
+                if dtype == "text":
+                    # dictionary-encode incrementally, the codes of earlier chunks stay valid
+                    mapping: dict = categories[name]
+                    for value in values.dropna().unique():
+                        mapping.setdefault(value, len(mapping))
+                    arrays[name][offset:end] = values.map(mapping).fillna(-1).to_numpy(dtype="int32")
+                elif dtype.startswith("datetime64"):
+                    arrays[name][offset:end] = pd.to_datetime(values).to_numpy(dtype=dtype)
+                else:
+                    arrays[name][offset:end] = values.to_numpy(dtype=dtype)
+            offset = end
+
+    for name, array in arrays.items():
+        array.flush()
+        if kinds[name] == "text":
+            np.save(os.path.join(tmp, f"{name}.categories.npy"), np.array(list(categories[name]), dtype=str))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"table": table, "rows": n_rows, "version": version, "columns": kinds}, f, indent=2)
+
+    # Swap the new snapshot in
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.rename(tmp, target)
+
+
+def write_snapshot(engine, tables: list, snapshot_dir: str = SNAPSHOT_DIR):
+    """Writes the snapshot of all given tables that exist in the database."""
+    inspector = sa.inspect(engine)
+    for table in tables:
+        if inspector.has_table(table):
+            write_table(engine, table, snapshot_dir)
+
+
+def snapshot_versions(tables: list, snapshot_dir: str = SNAPSHOT_DIR) -> dict:
+    """Returns the table version each snapshot was written at, None for missing snapshots and snapshots without one."""
+    versions: dict = {}
+    for table in tables:
+        try:
+            with open(os.path.join(snapshot_dir, table, "meta.json")) as f:
+                versions[table] = json.load(f).get("version")
+        except FileNotFoundError:
+            versions[table] = None
+    return versions
+
+
+def load_arrays(table: str, columns: list = None, snapshot_dir: str = SNAPSHOT_DIR) -> dict:
+    """Returns the memory-mapped column arrays of a table (text columns as pd.Categorical, pandas copies their codes
+    into the smallest integer type)."""
+    directory: str = os.path.join(snapshot_dir, table)
+    with open(os.path.join(directory, "meta.json")) as f:
+        kinds: dict = json.load(f)["columns"]
+
+    arrays: dict = {}
+    for name in columns or kinds:
+        # mmap_mode="c" is copy-on-write: nothing is read until accessed and in-place edits never touch the file
+        array = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="c")
+        if kinds[name] == "text":
+            names = np.load(os.path.join(directory, f"{name}.categories.npy"))
+            array = pd.Categorical.from_codes(array, categories=names)
+        arrays[name] = array
+    return arrays
+
+
+def load_table(table: str, columns: list = None, snapshot_dir: str = SNAPSHOT_DIR) -> pd.DataFrame:
+    """Returns a table of the snapshot as a DataFrame backed by the memory-mapped column files."""
+    return pd.DataFrame(load_arrays(table, columns, snapshot_dir), copy=False)
@@ -0,0 +1,121 @@
+# concurrent fetcher for the Spotify Web API audio features endpoint
+# - several batches of (up to) 100 tracks are requested concurrently, all workers share one token bucket
+# - 429 responses pause the whole bucket for the duration given in the Retry-After header
+# - server errors and connection problems are retried with exponential backoff and full jitter
+# - errors that won't succeed on retry (e.g. 401 invalid token, 403, 404) are raised immediately
+
+import random
+import requests
+import spotipy
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
+
+
+WORKERS: int = 4  # concurrent requests
+RATE: float = 5.0  # requests per second (Spotify does not document its exact limit)
+MAX_ATTEMPTS: int = 6  # per batch
+BACKOFF_BASE: float = 1.0  # seconds
+BACKOFF_CAP: float = 60.0  # seconds
+
+
+class TokenBucket:
+    """Thread-safe token bucket that allows `rate` requests per second with bursts of up to `capacity` requests."""
+
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+        self._paused_until: float = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds`, e.g. after the server asked us to back off."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._updated = self._paused_until
+            self._tokens = 0
+
+
+def make_client(auth_manager=None, workers: int = WORKERS, auth: str = None) -> spotipy.Spotify:
+    """Creates a Spotify client without spotipy's built-in retries (they ignore our rate limiter) and with a connection
+    pool that is large enough for `workers` concurrent requests."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return spotipy.Spotify(auth=auth, auth_manager=auth_manager, requests_session=session)
+
+
+def _retry_after(error: spotipy.SpotifyException) -> float:
+    try:
+        return float(error.headers["Retry-After"])
+    except:
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    # exponential backoff with full jitter, see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def fetch_batch(sp: spotipy.Spotify, batch: list, bucket: TokenBucket, max_attempts: int = MAX_ATTEMPTS,
+                on_retry=None) -> list:
+    """Requests the audio features of one batch of track ids, retrying rate-limited and transient failures.
+
+    `on_retry` is called (without arguments) before each retry, e.g. to count them.
+    """
+    for attempt in range(max_attempts):
+        if attempt and on_retry is not None:
+            on_retry()
+        bucket.acquire()
+        try:
+            return sp.audio_features(batch)
+        except spotipy.SpotifyException as error:
+            retryable: bool = error.http_status == 429 or error.http_status >= 500
+            if not retryable or attempt == max_attempts - 1:
+                raise
+            if error.http_status == 429:
+                # Everyone waits, not just this worker, since the limit applies to the whole client
+                bucket.pause(_retry_after(error) or _backoff(attempt))
+                continue
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == max_attempts - 1:
+                raise
+        time.sleep(_backoff(attempt))
+
+
+def fetch_audio_features(sp: spotipy.Spotify, batches: list, workers: int = WORKERS, rate: float = RATE,
+                         max_attempts: int = MAX_ATTEMPTS, on_retry=None) -> Iterator[tuple[list, list]]:
+    """Fetches the audio features of all batches concurrently and yields (batch, features) pairs as they complete.
+
+    If a batch fails for good, the remaining batches are cancelled and the error is raised.
+    """
+    bucket = TokenBucket(rate)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_batch, sp, batch, bucket, max_attempts, on_retry): batch for batch in batches}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,130 @@
+# dependency graph of pipeline stages and a thread-based executor for it
+# - a stage starts as soon as all of its dependencies succeeded, independent branches run concurrently
+# - every stage has a kind ("io", "db", ...), the number of concurrently running stages of each kind is limited,
+#   e.g. to one SQLite writer at a time while downloads and API calls overlap
+# - successful stages are recorded in a marker file, a re-run after a failure only runs the failed or missing stages;
+#   the markers are cleared once every stage of the graph succeeded
+
+import json
+import os
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+from logger import log, stage_status
+
+
+@dataclass
+class Node:
+    name: str  # also the name of the stage in the run report (see logger.stage)
+    fn: Callable[[], None]
+    deps: list[str] = field(default_factory=list)
+    kind: str = "io"
+
+
+class StageMarkers:
+    """Set of the stages that succeeded in an earlier, incomplete run, stored as a JSON file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.done: set[str] = set(json.load(f))
+        except (FileNotFoundError, ValueError):
+            self.done = set()
+
+    def mark(self, name: str):
+        with self._lock:
+            self.done.add(name)
+            # Write a new file and swap it in, so an interrupted run never leaves a corrupt marker file
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(sorted(self.done), f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def clear(self):
+        with self._lock:
+            self.done = set()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def check_graph(nodes: list[Node]):
+    """Raises a ValueError if a dependency is unknown or the graph has a cycle."""
+    names: dict = {node.name: node for node in nodes}
+    for node in nodes:
+        for dep in node.deps:
+            if dep not in names:
+                raise ValueError(f"stage {node.name} depends on unknown stage {dep}")
+
+    visiting, visited = set(), set()
+
+    def visit(name: str):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"cycle in stage graph at {name}")
+        visiting.add(name)
+        for dep in names[name].deps:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for node in nodes:
+        visit(node.name)
+
+
+def run_graph(nodes: list[Node], limits: dict[str, int], markers: StageMarkers = None) -> dict[str, str]:
+    """Runs all stages of the graph and returns the result of each stage.
+
+    The result is "ok", "failed" (raised or logged an error), "blocked" (a dependency failed) or "done" (succeeded
+    in an earlier run, see StageMarkers). `limits` maps a stage kind to the number of stages of that kind that may
+    run at the same time, kinds without a limit are not limited.
+    """
+    check_graph(nodes)
+    slots: dict = {kind: threading.Semaphore(limit) for kind, limit in limits.items()}
+    results: dict[str, str] = {}
+    if markers is not None:
+        results.update({node.name: "done" for node in nodes if node.name in markers.done})
+
+    def run(node: Node) -> str:
+        slot = slots.get(node.kind)
+        if slot is not None:
+            slot.acquire()
+        try:
+            node.fn()
+        except:
+            log(f"Stage {node.name} raised an unexpected error", "error")
+            return "failed"
+        finally:
+            if slot is not None:
+                slot.release()
+        # The stage functions handle their own errors, a logged error marks the stage as failed
+        return "failed" if stage_status(node.name) == "failed" else "ok"
+
+    pending: dict = {node.name: node for node in nodes if node.name not in results}
+    running: dict = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+        while pending or running:
+            for name, node in list(pending.items()):
+                dep_results = [results.get(dep) for dep in node.deps]
+                if any(result in ("failed", "blocked") for result in dep_results):
+                    results[name] = "blocked"
+                    del pending[name]
+                elif all(result in ("ok", "done") for result in dep_results):
+                    running[executor.submit(run, node)] = name
+                    del pending[name]
+            if not running:
+                continue  # only blocked stages were left
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = future.result()
+                if results[name] == "ok" and markers is not None:
+                    markers.mark(name)
+
+    if markers is not None and all(result in ("ok", "done") for result in results.values()):
+        markers.clear()
+    return results
@@ -0,0 +1,89 @@
+# atomic rebuilds of data.sqlite (see "--rebuild" in pull-data.py)
+# - the pipeline writes into a staging file next to the database, readers keep using the old database meanwhile
+# - the staging database is bulk loaded: in-memory rollback journal, no fsync, a large page cache and in-memory temp
+#   storage; a crash can only corrupt the staging file, which the next rebuild starts over
+# - tables that can't be rebuilt from the raw files (the audio features fetched from the Spotify API) are copied from
+#   the current database
+# - before the swap the staging file is checked (all expected tables exist, SQLite's quick_check passes) and synced
+#   to disk, then renamed over the database: the rename is atomic, a reader opens either the old or the new database
+
+import os
+import sqlalchemy as sa
+
+from db_schema import bump_version
+
+
+STAGING_SUFFIX: str = ".staging"
+BULK_LOAD_PRAGMAS: list[str] = [
+    # the ingest relies on ROLLBACK of failed transactions, which journal_mode = OFF does not support
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def staging_path(db_path: str) -> str:
+    """Returns the path of the staging file of a database."""
+    return db_path + STAGING_SUFFIX
+
+
+def create_staging_engine(db_path: str, resume: bool = False, **kwargs):
+    """Returns an engine for the staging file of a database, with the bulk load settings on every connection.
+
+    An existing staging file is only kept if `resume` is set, e.g. to continue an interrupted rebuild.
+    """
+    path: str = staging_path(db_path)
+    if not resume and os.path.exists(path):
+        os.remove(path)
+    engine = sa.create_engine(f"sqlite:///{path}", **kwargs)
+
+    @sa.event.listens_for(engine, "connect")
+    def bulk_load_settings(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+def copy_tables(engine, db_path: str, tables: list):
+    """Copies the rows of `tables` from the database into the staging database, where the tables must exist already."""
+    if not os.path.exists(db_path):
+        return
+    with engine.connect() as connection:
+        # ATTACH and DETACH can't run inside a transaction
+        connection.execute(sa.text("ATTACH DATABASE :path AS live"), {"path": db_path})
+        for table in tables:
+            live: list = [row[1] for row in connection.execute(sa.text(f"PRAGMA live.table_info({table})"))]
+            if not live:
+                continue
+            columns: str = ", ".join(row[1] for row in connection.execute(sa.text(f"PRAGMA main.table_info({table})"))
+                                     if row[1] in live)
+            connection.execute(sa.text(f"INSERT OR REPLACE INTO main.{table} ({columns}) "
+                                       f"SELECT {columns} FROM live.{table}"))
+            bump_version(connection, table)
+        connection.commit()
+        connection.execute(sa.text("DETACH DATABASE live"))
+
+
+def validate_staging(engine, expected_tables: list) -> list[str]:
+    """Returns the problems of the staging database, an empty list if it can replace the database."""
+    with engine.connect() as connection:
+        tables: list[str] = sa.inspect(connection).get_table_names()
+        problems: list[str] = [f"table {table} is missing" for table in expected_tables if table not in tables]
+        check: list[str] = [row[0] for row in connection.execute(sa.text("PRAGMA quick_check"))]
+    if check != ["ok"]:
+        problems += check
+    return problems
+
+
+def swap_in(engine, db_path: str):
+    """Replaces the database with the staging database. The engine must not be used afterwards."""
+    engine.dispose()
+    path: str = staging_path(db_path)
+    # The bulk load did not sync, so the file is synced before it becomes the database
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(path, db_path)
@@ -0,0 +1,164 @@
+# DWD station metadata and a spatial filter for the stations that are ingested
+# - the location of each station is read from the "Metadaten_Geographie_*" member of its zip and stored in the
+#   "stations" table (id, name, latitude, longitude, elevation, active period)
+# - a ball tree over the station coordinates (haversine distance) answers radius queries, e.g. all stations within
+#   50 km of the largest cities, bounding boxes are plain coordinate ranges
+# - zips of stations outside of the selected region are never ingested (their metadata is read once), rows ingested by
+#   an earlier, wider run are removed
+#
+# usage:
+#   python pull-data.py --radius 52.52,13.40,50        stations within 50 km of Berlin (the flag can be repeated)
+#   python pull-data.py --bbox 47.2,5.8,50.6,10.6      stations in a bounding box (south,west,north,east)
+#   python pull-data.py --cities 30                    stations within 30 km of one of the largest German cities
+
+import numpy as np
+import os
+import pandas as pd
+import sqlalchemy as sa
+import zipfile
+
+from dataclasses import dataclass, field
+from sklearn.neighbors import BallTree
+
+from db_schema import append_rows
+from ingest_manifest import MANIFEST_TABLE, station_id_from_file_name
+
+
+STATIONS_TABLE: str = "stations"
+EARTH_RADIUS_KM: float = 6371.0
+
+# largest German cities (latitude, longitude)
+CITIES: dict[str, tuple[float, float]] = {
+    "Berlin": (52.5200, 13.4050),
+    "Hamburg": (53.5511, 9.9937),
+    "München": (48.1351, 11.5820),
+    "Köln": (50.9375, 6.9603),
+    "Frankfurt am Main": (50.1109, 8.6821),
+    "Stuttgart": (48.7758, 9.1829),
+    "Düsseldorf": (51.2277, 6.7735),
+}
+
+
+@dataclass
+class Region:
+    circles: list = field(default_factory=list)  # (latitude, longitude, radius in km)
+    boxes: list = field(default_factory=list)  # (south, west, north, east)
+
+
+def parse_region(argv: list) -> Region:
+    """Returns the region given by the "--radius", "--bbox" and "--cities" flags, or None if there is none."""
+    region = Region()
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--radius":
+            region.circles.append(tuple(float(value) for value in argv[i + 1].split(",")))
+        elif arg == "--bbox":
+            region.boxes.append(tuple(float(value) for value in argv[i + 1].split(",")))
+        elif arg == "--cities":
+            region.circles += [(lat, lon, float(argv[i + 1])) for lat, lon in CITIES.values()]
+    if any(len(circle) != 3 for circle in region.circles) or any(len(box) != 4 for box in region.boxes):
+        raise ValueError("expected --radius LAT,LON,KM and --bbox SOUTH,WEST,NORTH,EAST")
+    return region if region.circles or region.boxes else None
+
+
+def read_station_metadata(zip_path: str) -> dict:
+    """Returns the current location and the active period of the station of a zip, or None without metadata."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = [member for member in zip_ref.namelist() if member.startswith("Metadaten_Geographie")]
+        if not members:
+            return None
+        with zip_ref.open(members[0], mode="r") as tmpfile:
+            df = pd.read_csv(tmpfile, sep=";", encoding="latin-1", skipinitialspace=True,
+                             dtype={"von_datum": str, "bis_datum": str})
+    df.columns = df.columns.str.strip()
+    if df.empty:
+        return None
+    # One row per location of the station, the last row is the current one (bis_datum is empty while active)
+    current = df.sort_values("von_datum").iloc[-1]
+    until = df["bis_datum"].dropna().str.strip()
+    return {
+        "stations_id": int(current["Stations_id"]),
+        "name": str(current["Stationsname"]).strip(),
+        "latitude": float(current["Geogr.Breite"]),
+        "longitude": float(current["Geogr.Laenge"]),
+        "elevation": float(current["Stationshoehe"]),
+        "active_from": pd.to_datetime(df["von_datum"].str.strip(), format="%Y%m%d").min(),
+        "active_to": pd.NaT if pd.isna(current["bis_datum"]) else pd.to_datetime(until, format="%Y%m%d").max(),
+    }
+
+
+class StationIndex:
+    """Spatial index over station coordinates."""
+
+    def __init__(self, stations: pd.DataFrame):
+        self.ids: np.ndarray = stations["stations_id"].to_numpy()
+        self.coords: np.ndarray = stations[["latitude", "longitude"]].to_numpy(dtype="float64")
+        self._tree = BallTree(np.radians(self.coords), metric="haversine") if len(stations) else None
+
+    def within_radius(self, latitude: float, longitude: float, km: float) -> np.ndarray:
+        """Returns the ids of the stations within `km` kilometers (great-circle distance) of a point."""
+        if self._tree is None:
+            return self.ids[:0]
+        indices = self._tree.query_radius(np.radians([[latitude, longitude]]), r=km / EARTH_RADIUS_KM)[0]
+        return self.ids[np.sort(indices)]
+
+    def within_bbox(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Returns the ids of the stations inside a bounding box."""
+        lat, lon = self.coords[:, 0], self.coords[:, 1]
+        return self.ids[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)]
+
+    def select(self, region: Region) -> set[int]:
+        """Returns the ids of the stations inside any of the circles or boxes of a region."""
+        selected: set[int] = set()
+        for latitude, longitude, km in region.circles:
+            selected.update(self.within_radius(latitude, longitude, km).tolist())
+        for box in region.boxes:
+            selected.update(self.within_bbox(*box).tolist())
+        return selected
+
+
+def update_stations(connection, source: str, zip_paths: list) -> pd.DataFrame:
+    """Stores the metadata of all stations of the zips, inside or outside of the region, and returns all known stations.
+
+    The zip of a known station is only parsed again if it replaced the zip that the station was ingested from.
+    """
+    known: set = set()
+    ingested: dict = {}  # stations_id -> names of the ingested files
+    if sa.inspect(connection).has_table(STATIONS_TABLE):
+        known = {row[0] for row in connection.execute(sa.text(f"SELECT stations_id FROM {STATIONS_TABLE}"))}
+    if sa.inspect(connection).has_table(MANIFEST_TABLE):
+        for stations_id, file_name in connection.execute(
+                sa.text(f"SELECT stations_id, file_name FROM {MANIFEST_TABLE} WHERE source = :source"), {"source": source}):
+            ingested.setdefault(stations_id, set()).add(file_name)
+
+    records: list = []
+    for zip_path in zip_paths:
+        file_name: str = os.path.basename(zip_path)
+        stations_id: int = station_id_from_file_name(file_name)
+        # Stations outside of the region are never ingested, their location is known from an earlier run
+        if stations_id in known and file_name in ingested.get(stations_id, {file_name}):
+            continue
+        record = read_station_metadata(zip_path)
+        if record is not None:
+            records.append(record)
+    if records:
+        append_rows(connection, STATIONS_TABLE, pd.DataFrame.from_records(records))
+    if not records and not known:
+        return pd.DataFrame(columns=["stations_id", "latitude", "longitude"])
+    return pd.read_sql_query(sa.text(f"SELECT stations_id, latitude, longitude FROM {STATIONS_TABLE}"), connection)
+
+
+def select_station_zips(engine, source: str, zip_paths: list, region: Region = None) -> tuple[list, list]:
+    """Updates the stations table and splits the zips into those inside and those outside of the region.
+
+    Without a region all zips are selected. Zips of stations without a known location are outside of any region.
+    """
+    with engine.begin() as connection:
+        stations: pd.DataFrame = update_stations(connection, source, zip_paths)
+    if region is None:
+        return zip_paths, []
+
+    selected: set[int] = StationIndex(stations).select(region)
+    inside, outside = [], []
+    for zip_path in zip_paths:
+        (inside if station_id_from_file_name(os.path.basename(zip_path)) in selected else outside).append(zip_path)
+    return inside, outside
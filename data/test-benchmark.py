@@ -0,0 +1,21 @@
+import os
+import sys
+
+from benchmark import compare, run_benchmark
+from dwd_config import data_sources
+
+
+def test_reports_every_stage(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    report = run_benchmark(str(tmp_path), scale=0.01, workers=1)
+
+    names = [f"download {data_src['name']}" for data_src in data_sources]
+    names += [f"extract {data_src['name']}" for data_src in data_sources]
+    names += ["extract spotify_data", "spotify metadata", "analyze", "snapshot"]
+    assert [stage["stage"] for stage in report["stages"]] == names
+    # the stages log their errors instead of raising, a failed stage would leave its tables empty
+    stages: dict = {stage["stage"]: stage for stage in report["stages"]}
+    assert all(stages[name]["rows"] > 0 for name in names if "rows" in stages[name])
+    assert all(stages[f"download {data_src['name']}"]["bytes"] > 0 for data_src in data_sources)
+    assert os.path.exists(tmp_path / "snapshot" / "spotify_data" / "meta.json")
+    assert compare(report, report, tolerance=0.25) == []
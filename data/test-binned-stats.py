@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from binned_stats import binned_stats
+from training_set import TrainingSet
+
+
+def make_training_set(seed: int = 0) -> TrainingSet:
+    rng = np.random.default_rng(seed)
+    n_days, n_tracks, n = 60, 40, 500
+    days = rng.normal(5, 3, (n_days, 2)).astype("float32")
+    days[3, 1] = np.nan  # a day without data for one variable
+    tracks = np.column_stack([rng.random(n_tracks), rng.normal(200_000, 30_000, n_tracks)]).astype("float32")
+    return TrainingSet(["temp", "rain", "valence", "duration_ms"], days, tracks,
+                       rng.integers(0, n_days, n).astype("int32"), rng.integers(0, n_tracks, n).astype("int32"),
+                       rng.integers(1, 201, n).astype("float32"), rng.integers(1, 4, n).astype("float32"))
+
+
+def expanded(data: TrainingSet) -> pd.DataFrame:
+    """Returns the training set as one DataFrame row per (unweighted) chart entry, like the notebook's merged_df."""
+    df = data.x.astype("float64")
+    return df.loc[df.index.repeat(data.weights.astype(int))].reset_index(drop=True)
+
+
+def test_matches_pd_cut_and_groupby():
+    data = make_training_set()
+    stats = binned_stats(data, n_bins=7)
+    df = expanded(data)
+    for weather in ["temp", "rain"]:
+        values = data.days[:, ["temp", "rain"].index(weather)].astype("float64")
+        bins = pd.cut(df[weather], pd.cut(values[~np.isnan(values)], 7, retbins=True)[1])
+        # the same bins as binning the chart entries directly, as the notebook did
+        assert bins.cat.categories.equals(pd.cut(df[weather], 7).cat.categories)
+        grouped = df.groupby(bins, observed=False)
+        for feature in ["valence", "duration_ms"]:
+            rows = stats[(stats["weather"] == weather) & (stats["feature"] == feature)]
+            assert np.allclose(rows["count"], grouped.size())
+            assert np.allclose(rows["mean"], grouped[feature].mean(), equal_nan=True)
+            assert np.allclose(rows["var"], grouped[feature].var(ddof=0), equal_nan=True, rtol=1e-6)
+
+
+def test_value_ranges_are_left_open():
+    data = make_training_set()
+    stats = binned_stats(data, n_bins=5, ranges={"temp": (0, 8)})
+    df = expanded(data)
+    selected = df[(df["temp"] > 0) & (df["temp"] <= 8)]
+    rows = stats[(stats["weather"] == "temp") & (stats["feature"] == "valence")]
+    assert rows["count"].sum() == len(selected)
+    assert rows["left"].min() < selected["temp"].min() and rows["right"].max() == selected["temp"].max()
+    # other variables are not restricted
+    assert stats[(stats["weather"] == "rain") & (stats["feature"] == "valence")]["count"].sum() == df["rain"].notna().sum()
+
+
+def test_days_without_entries_dont_change_the_bins():
+    # the lowest and the highest temperature are on days that no chart entry refers to, e.g. after a split
+    data = make_training_set()
+    data = data.subset(np.flatnonzero(data.day_codes >= 2))
+    data.days[0, 0], data.days[1, 0] = -40, 40
+    stats = binned_stats(data, n_bins=7)
+    df = expanded(data)
+    bins, edges = pd.cut(df["temp"], 7, retbins=True)
+    grouped = df.groupby(bins, observed=False)
+    rows = stats[(stats["weather"] == "temp") & (stats["feature"] == "valence")]
+    assert np.allclose(rows["left"], edges[:-1]) and np.allclose(rows["right"], edges[1:])
+    assert np.allclose(rows["count"], grouped.size())
+    assert np.allclose(rows["mean"], grouped["valence"].mean(), equal_nan=True)
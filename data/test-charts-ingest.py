@@ -0,0 +1,24 @@
+import pandas as pd
+
+from bench_fixtures import COUNTRIES, make_charts_zip
+from charts_ingest import iter_country_charts, load_country_charts
+
+
+def test_streams_all_countries_in_one_pass(tmp_path):
+    path = str(tmp_path / "charts.zip")
+    rows = make_charts_zip(path, days=3, tracks=50)
+
+    chunks = list(iter_country_charts(path, chunksize=700))
+    df = pd.concat(chunks, ignore_index=True)
+    assert len(chunks) > 1 and len(df) == rows
+    assert df.groupby("country", observed=True).size().to_dict() == {country: 600 for country in COUNTRIES}
+
+    # the German partition equals the single-country load
+    german = df[df["country"] == "Germany"].drop(columns="country").reset_index(drop=True)
+    expected = load_country_charts(path, "Germany")
+    pd.testing.assert_frame_equal(german.astype(str), expected.astype(str))
+
+    seen = set()
+    selected = pd.concat(iter_country_charts(path, ["Austria", "France"], seen=seen))
+    assert set(selected["country"]) == {"Austria", "France"} and selected["track_id"].nunique() <= 50
+    assert seen == set(COUNTRIES)
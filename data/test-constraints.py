@@ -0,0 +1,49 @@
+import json
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from charts_ingest import CHART_CONSTRAINTS
+from constraints import REJECTS_TABLE, AllowlistConstraint, RangeConstraint, check_constraints, reject_counts, write_rejects
+from dwd_config import data_sources
+from weather_ingest import filter_chunk
+
+
+def test_splits_valid_and_rejected_rows():
+    df = pd.DataFrame({
+        "position": pd.array([1, 200, 0, 5, 201], dtype="int16"),
+        "track_id": ["0" * 22, "a" * 22, "b" * 22, "N\\A", "#"],
+        "form": pd.array([1, None, 3, 4, 9], dtype="Int16"),
+    })
+    constraints = CHART_CONSTRAINTS + [AllowlistConstraint("form", [1, 3, 4]), RangeConstraint("missing", 0, 1)]
+    valid, rejected = check_constraints(df, constraints)
+    assert valid.index.tolist() == [0, 1]
+    # the first failing constraint is the reason, missing values pass nullable constraints
+    assert rejected["reason"].tolist() == ["position_range", "track_id_regex", "position_range"]
+    assert reject_counts(rejected) == {"rejected_position_range": 2, "rejected_track_id_regex": 1}
+
+    unchanged, none = check_constraints(valid, constraints)
+    assert unchanged is valid and none.empty
+
+
+def test_rejects_low_quality_and_implausible_weather_rows(tmp_path):
+    data_src = next(data_src for data_src in data_sources if data_src["name"] == "temperature_data")
+    chunk = pd.DataFrame({
+        "STATIONS_ID": np.int32(1), "MESS_DATUM": np.array([2019010106, 2019010112, 2019010118, 2019010206, 2025010106]),
+        "QN_4": pd.array([1, None, 1, 1, 1], dtype="Int16"), "TT_TER": [1.5, 2.0, 99.0, -999.0, 3.0],
+        "RF_TER": [80.0, 81.0, 82.0, 83.0, 84.0],
+    })
+    valid, rejected = filter_chunk(chunk, data_src, pd.Timestamp("2019-01-01"), pd.Timestamp("2020-12-31"))
+    assert list(valid.columns) == data_src["new_columns"]
+    # the sentinel is a missing value, not an invalid one
+    assert valid["lufttemperatur"].isna().tolist() == [False, True]
+    assert rejected["reason"].tolist() == ["quality", "lufttemperatur_range"]
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    for _ in range(2):
+        with engine.begin() as connection:
+            write_rejects(connection, "temperature_data", rejected, "station.zip")
+    stored = pd.read_sql_table(REJECTS_TABLE, engine)
+    assert len(stored) == 2 and set(stored["file_name"]) == {"station.zip"}
+    record = json.loads(stored.loc[stored["reason"] == "lufttemperatur_range", "record"].item())
+    assert record["lufttemperatur"] == 99.0 and record["mess_datum"].startswith("2019-01-01T18:00:00")
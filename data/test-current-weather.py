@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from bench_fixtures import FTPStandIn, write_station_zip
+from current_weather import CurrentWeather, recent_path
+from dwd_config import data_sources
+
+SOURCES: list = [data_src for data_src in data_sources if data_src["name"] in ("temperature_data", "wind_data")]
+
+
+def test_caches_files_and_falls_back_to_a_complete_day(tmp_path):
+    today = pd.Timestamp.now().normalize()
+    rng = np.random.default_rng(0)
+    # the wind data lags a day behind the temperature data
+    for data_src, last_day in zip(SOURCES, [today - pd.Timedelta(days=1), today - pd.Timedelta(days=2)]):
+        directory = tmp_path / "ftp" / recent_path(data_src)
+        os.makedirs(directory)
+        for stations_id in (1, 2):
+            write_station_zip(str(directory), data_src, stations_id, rng, today - pd.Timedelta(days=20), last_day)
+
+    with FTPStandIn(str(tmp_path / "ftp")) as server:
+        weather = CurrentWeather(SOURCES, cache_dir=str(tmp_path / "recent"), port=server.port, host="127.0.0.1")
+        date, df = weather.latest(["lufttemperatur", "windstaerke"])
+        assert date == (today - pd.Timedelta(days=2)).date() and list(df.columns) == ["lufttemperatur", "windstaerke"]
+        assert weather.latest(["lufttemperatur"])[0] == (today - pd.Timedelta(days=1)).date()
+        assert all(len(result.downloaded) == 2 for result in weather.last_sync.values())
+
+        # within the TTL the aggregates are served from memory, without a listing
+        first_sync = dict(weather.last_sync)
+        daily = weather.daily()
+        assert weather.daily() is daily and weather.last_sync == first_sync
+
+        # after the TTL the cached files are only listed, not downloaded again
+        weather._expires = 0.0
+        pd.testing.assert_frame_equal(weather.daily(), daily)
+        assert all(not result.downloaded and len(result.skipped) == 2 for result in weather.last_sync.values())
@@ -0,0 +1,62 @@
+import pandas as pd
+import sqlalchemy as sa
+
+import data_access
+from bench_fixtures import write_analysis_tables
+from data_access import AUDIO_FEATURES, WEATHER_FEATURES, load_coded_data
+from db_schema import append_rows, bump_version
+from dwd_config import data_sources
+from rollups import rollup_table
+
+
+def test_wide_view_equals_a_merge(tmp_path, monkeypatch):
+    db_uri: str = f"sqlite:///{tmp_path / 'data.sqlite'}"
+    engine = sa.create_engine(db_uri)
+    write_analysis_tables(engine, data_sources)
+    monkeypatch.setattr(data_access, "_cache", {})
+
+    # what the notebook did before: merge the charts with the daily weather and the audio features
+    merged = pd.read_sql("SELECT date, position, track_id FROM spotify_data WHERE track_id IS NOT NULL", engine,
+                         parse_dates=["date"])
+    for source, columns in WEATHER_FEATURES.items():
+        daily = pd.read_sql(f"SELECT date, {', '.join(f'{col}_mean AS {col}' for col in columns)} "
+                            f"FROM {rollup_table(source)}", engine, parse_dates=["date"])
+        merged = merged.merge(daily, on="date", how="left")
+    audio = pd.read_sql(f"SELECT track_id, {', '.join(AUDIO_FEATURES)} FROM audio_features", engine)
+    merged = merged.merge(audio, on="track_id", how="left")
+
+    wide = load_coded_data(db_uri, str(tmp_path / "snapshot")).wide()
+    wide = wide.assign(track_id=wide["track_id"].astype(object), date=wide["date"].astype("datetime64[ns]"))
+    key: list[str] = ["date", "position"]
+    pd.testing.assert_frame_equal(wide.sort_values(key, ignore_index=True), merged.sort_values(key, ignore_index=True),
+                                  check_dtype=False)
+    # days without weather and tracks without audio features are NaN
+    assert wide["windstaerke"].isna().any() and wide["tempo"].isna().any()
+
+
+def test_rebuilds_the_cache_when_a_table_changes(tmp_path, monkeypatch):
+    db_uri: str = f"sqlite:///{tmp_path / 'data.sqlite'}"
+    engine = sa.create_engine(db_uri)
+    write_analysis_tables(engine, data_sources)
+    monkeypatch.setattr(data_access, "_cache", {})
+    reads: list = []
+    read_coded_data = data_access._read_coded_data
+    monkeypatch.setattr(data_access, "_read_coded_data", lambda *args: reads.append(args) or read_coded_data(*args))
+
+    first = load_coded_data(db_uri, str(tmp_path / "snapshot"))
+    assert load_coded_data(db_uri, str(tmp_path / "snapshot")) is first and len(reads) == 1
+
+    # append_rows bumps the version of the table in the same transaction
+    with engine.begin() as connection:
+        append_rows(connection, "audio_features", pd.DataFrame({"track_id": ["new"], "tempo": [120.0]}))
+    second = load_coded_data(db_uri, str(tmp_path / "snapshot"))
+    assert second is not first and len(reads) == 2
+    assert second.versions["audio_features"] != first.versions["audio_features"]
+    assert "new" in second.track_ids and "new" not in first.track_ids
+
+    # as does any other write that records a new version
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE spotify_data SET position = position + 100 WHERE date = '2020-01-01'")
+        bump_version(connection, "spotify_data")
+    third = load_coded_data(db_uri, str(tmp_path / "snapshot"))
+    assert len(reads) == 3 and third.positions.max() == 110
@@ -0,0 +1,81 @@
+import pandas as pd
+import sqlalchemy as sa
+
+from db_schema import VERSIONS_TABLE, append_rows, table_versions
+
+
+def test_appends_empty_frames(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    with engine.begin() as connection:
+        append_rows(connection, "chart_tracks", pd.DataFrame({"track_id": []}))
+        append_rows(connection, "spotify_data", pd.DataFrame(columns=["date", "position", "track_id"]))
+        versions = table_versions(connection, ["chart_tracks", "spotify_data"])
+    assert all(versions.values())
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM spotify_data", engine)["n"][0] == 0
+
+
+def test_replaces_rows_with_the_same_primary_key(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    rows = pd.DataFrame({"stations_id": [1, 1, 2], "mess_datum": pd.to_datetime(["2020-01-01", "2020-01-02", "2020-01-01"]),
+                         "windrichtung": 90, "windstaerke": [1, 2, 3]})
+    with engine.begin() as connection:
+        append_rows(connection, "wind_data", rows)
+        append_rows(connection, "wind_data", rows.iloc[[1]].assign(windstaerke=7))
+    stored = pd.read_sql("SELECT * FROM wind_data ORDER BY stations_id, mess_datum", engine)
+    assert list(stored["windstaerke"]) == [1, 7, 3]
+    assert list(stored["mess_datum"]) == ["2020-01-01 00:00:00", "2020-01-02 00:00:00", "2020-01-01 00:00:00"]
+
+
+def test_migrates_tables_created_by_to_sql(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    # what older versions of pull-data.py stored: no primary key, timestamps with microseconds, a duplicate row
+    old = pd.DataFrame({"stations_id": [1, 1, 2], "mess_datum": pd.to_datetime(["2020-01-01 06:00"] * 3),
+                        "windrichtung": 90, "windstaerke": [1, 2, 3]})
+    old.to_sql("wind_data", engine, index=False)
+    assert pd.read_sql("SELECT mess_datum FROM wind_data", engine)["mess_datum"][0] == "2020-01-01 06:00:00.000000"
+
+    with engine.begin() as connection:
+        append_rows(connection, "wind_data", old.iloc[[2]].assign(stations_id=3))
+        table_info = connection.exec_driver_sql("PRAGMA table_info(wind_data)").fetchall()
+        indexes = {row[1] for row in connection.exec_driver_sql("PRAGMA index_list(wind_data)")}
+    assert [row[1] for row in table_info if row[5]] == ["stations_id", "mess_datum"]
+    assert "ix_wind_data_mess_datum" in indexes
+    stored = pd.read_sql("SELECT * FROM wind_data ORDER BY stations_id", engine)
+    assert list(stored["stations_id"]) == [1, 2, 3] and list(stored["windstaerke"]) == [2, 3, 3]
+    assert set(stored["mess_datum"]) == {"2020-01-01 06:00:00"}
+
+
+def test_creates_the_indexes(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    with engine.begin() as connection:
+        append_rows(connection, "spotify_data", pd.DataFrame({"date": ["2020-01-01"], "position": [1], "track_id": ["a"]}))
+        columns = [row[2] for row in connection.exec_driver_sql("PRAGMA index_info(ix_spotify_data_track_id)")]
+    assert columns == ["track_id", "date", "position"]
+
+
+def test_checks_the_schema_and_bumps_the_version_once(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    statements: list = []
+    sa.event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    rows = pd.DataFrame({"track_id": ["a", "b"]})
+
+    with engine.begin() as connection:
+        append_rows(connection, "chart_tracks", rows)
+        append_rows(connection, "chart_tracks", rows)
+        first = table_versions(connection, ["chart_tracks"])
+    assert sum(statement.startswith("PRAGMA table_info") for statement in statements) == 1
+    assert sum(f"INTO {VERSIONS_TABLE}" in statement for statement in statements) == 1
+
+    # later transactions record a new version, but don't check the schema again
+    statements.clear()
+    with engine.begin() as connection:
+        append_rows(connection, "chart_tracks", rows)
+        assert table_versions(connection, ["chart_tracks"]) != first
+    assert not any(statement.startswith(("PRAGMA table_info", "CREATE")) for statement in statements)
+
+    # until the table is dropped
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE chart_tracks")
+    with engine.begin() as connection:
+        append_rows(connection, "chart_tracks", rows)
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM chart_tracks", engine)["n"][0] == 2
@@ -0,0 +1,79 @@
+import ftplib
+import os
+
+import pytest
+
+import ftp_pool
+from bench_fixtures import FTPStandIn
+from ftp_pool import PART_SUFFIX, FTPSessionPool, download_files, list_remote_files
+
+CONTENT: bytes = bytes(range(256)) * 400  # 100 KiB, several blocks of retrbinary
+
+
+class DroppingFTP(ftplib.FTP):
+    """Session whose first transfer breaks off after the first block, like a dropped connection."""
+
+    dropped: bool = False
+    rests: list = []
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        DroppingFTP.rests.append(rest)
+        if DroppingFTP.dropped:
+            return super().retrbinary(cmd, callback, blocksize, rest)
+        DroppingFTP.dropped = True
+
+        def drop(chunk):
+            callback(chunk)
+            raise EOFError("connection dropped")
+        return super().retrbinary(cmd, drop, blocksize, rest)
+
+
+@pytest.fixture
+def ftp_root(tmp_path):
+    root = tmp_path / "server" / "climate"
+    os.makedirs(root / "sub")
+    (root / "a.zip").write_bytes(CONTENT)
+    (root / "b.zip").write_bytes(b"b" * 10)
+    os.utime(root / "a.zip", (1_600_000_000, 1_600_000_000))
+    return str(tmp_path / "server")
+
+
+@pytest.mark.parametrize("mlsd", [True, False])
+def test_lists_files_with_and_without_mlsd(ftp_root, mlsd):
+    with FTPStandIn(ftp_root, mlsd=mlsd) as server:
+        pool = FTPSessionPool("127.0.0.1", size=2, port=server.port)
+        files = list_remote_files(pool, "/climate")
+        pool.close()
+    assert sorted(files) == ["a.zip", "b.zip"]  # without the sub directory
+    assert files["a.zip"].size == len(CONTENT) and files["a.zip"].mtime == 1_600_000_000
+
+
+def test_resumes_interrupted_downloads(ftp_root, tmp_path, monkeypatch):
+    sleeps: list = []
+    monkeypatch.setattr(ftp_pool.time, "sleep", sleeps.append)
+    monkeypatch.setattr(DroppingFTP, "rests", [])
+    target = str(tmp_path / "raw")
+    with FTPStandIn(ftp_root) as server:
+        pool = FTPSessionPool("127.0.0.1", size=1, port=server.port)
+        files = list_remote_files(pool, "/climate")
+        monkeypatch.setattr(ftp_pool.ftplib, "FTP", DroppingFTP)
+        pool.close()
+
+        result = download_files(pool, "/climate", [files["a.zip"]], target)
+        # the transfer broke off after the first block, the retry continued at the end of the .part file
+        assert result.downloaded == ["a.zip"] and result.retries == 1 and len(sleeps) == 1
+        assert DroppingFTP.rests == [None, 8192] and result.bytes_downloaded == len(CONTENT) - 8192
+        assert open(os.path.join(target, "a.zip"), "rb").read() == CONTENT
+        assert not os.path.exists(os.path.join(target, "a.zip" + PART_SUFFIX))
+
+        # a .part file left by an earlier run is resumed as well, a complete copy is skipped
+        os.remove(os.path.join(target, "a.zip"))
+        with open(os.path.join(target, "a.zip" + PART_SUFFIX), "wb") as f:
+            f.write(CONTENT[:1000])
+        os.utime(os.path.join(target, "a.zip" + PART_SUFFIX), (files["a.zip"].mtime, files["a.zip"].mtime))
+        result = download_files(pool, "/climate", [files["a.zip"], files["b.zip"]], target)
+        assert sorted(result.downloaded) == ["a.zip", "b.zip"] and result.retries == 0
+        assert result.bytes_downloaded == len(CONTENT) - 1000 + 10
+        assert open(os.path.join(target, "a.zip"), "rb").read() == CONTENT
+        assert download_files(pool, "/climate", [files["a.zip"], files["b.zip"]], target).skipped == ["a.zip", "b.zip"]
+        pool.close()
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import sqlalchemy as sa
+
+from db_schema import append_rows
+from ingest_manifest import MANIFEST_TABLE, plan_ingest, record_ingest
+
+
+def station_rows(stations_id: int, days: int = 4) -> pd.DataFrame:
+    return pd.DataFrame({"stations_id": stations_id, "mess_datum": pd.date_range("2020-01-01", periods=days, freq="D"),
+                         "windrichtung": 90, "windstaerke": stations_id})
+
+
+def ingest(engine, entries: list):
+    # what the pipeline does with the planned files: their rows and their manifest entries in one transaction
+    with engine.begin() as connection:
+        for entry in entries:
+            rows = station_rows(entry.stations_id)
+            append_rows(connection, "wind_data", rows)
+            entry.row_count = len(rows)
+            record_ingest(connection, entry)
+
+
+def test_skips_unchanged_files_and_replaces_changed_stations(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    paths = [str(tmp_path / f"wind_data_{stations_id:05d}_20170101_20201231_hist.zip") for stations_id in (1, 2)]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"version 1 of " + path.encode())
+
+    entries = plan_ingest(engine, "wind_data", paths)
+    assert [(entry.file_name, entry.stations_id) for entry in entries] == [
+        (os.path.basename(paths[0]), 1), (os.path.basename(paths[1]), 2)]
+    ingest(engine, entries)
+
+    # same files again, also if only their modification time changed
+    assert plan_ingest(engine, "wind_data", paths) == []
+    os.utime(paths[1], (1_700_000_000, 1_700_000_000))
+    assert plan_ingest(engine, "wind_data", paths) == []
+
+    # a changed file: the old rows of its station are deleted and the affected days handed to on_delete
+    with open(paths[0], "wb") as f:
+        f.write(b"version 2")
+    deleted: list = []
+    entries = plan_ingest(engine, "wind_data", paths, on_delete=lambda connection, first, last: deleted.append((first, last)))
+    assert [entry.stations_id for entry in entries] == [1] and deleted == [("2020-01-01 00:00:00", "2020-01-04 00:00:00")]
+    counts = pd.read_sql("SELECT stations_id, COUNT(*) AS n FROM wind_data GROUP BY stations_id", engine)
+    assert counts.to_dict("records") == [{"stations_id": 2, "n": 4}]
+    manifest = pd.read_sql(f"SELECT stations_id FROM {MANIFEST_TABLE}", engine)
+    assert list(manifest["stations_id"]) == [2]
+
+    ingest(engine, entries)
+    assert plan_ingest(engine, "wind_data", paths) == []
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM wind_data", engine)["n"][0] == 8
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+import logger
+from logger import finish_run, log, stage, start_run
+
+
+def read_report(path) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_reports_stages_and_runs(tmp_path):
+    report = tmp_path / "run_report.jsonl"
+    run_id = start_run(str(report))
+    with stage("extract.a") as metrics:
+        metrics.add(rows_in=10, rows_out=8, files=2)
+    with stage("extract.b"):
+        log("b failed", "error")
+    with pytest.raises(ValueError):
+        with stage("extract.c"):
+            raise ValueError("broken")
+    finish_run()
+
+    a, b, c, run = read_report(report)
+    assert all(record["run_id"] == run_id for record in (a, b, c, run))
+    assert (a["type"], a["stage"], a["status"], a["rows_in"], a["rows_out"], a["counts"]) == \
+        ("stage", "extract.a", "ok", 10, 8, {"files": 2})
+    assert a["seconds"] >= 0 and a["peak_rss_mb"] > 0
+    assert (b["status"], b["errors"]) == ("failed", ["b failed"])
+    assert c["status"] == "failed" and "broken" in c["errors"][0]
+    assert (run["type"], run["status"], run["stages"], run["failed_stages"]) == ("run", "failed", 3, ["extract.b", "extract.c"])
+
+
+def test_profiles_one_stage_and_keeps_errors_of_the_memory_sampling(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    start_run("run_report.jsonl", profile="extract.a")
+    with stage("extract.a"):
+        sum(range(1000))
+    with stage("extract.b"):
+        pass
+    assert sorted(os.listdir(tmp_path)) == ["profile_extract.a.prof", "run_report.jsonl"]
+
+    # an error while starting the memory sampling is reported as itself
+    def broken_enter(self):
+        raise OSError("no /proc")
+    monkeypatch.setattr(logger.PeakMemory, "__enter__", broken_enter)
+    with pytest.raises(OSError):
+        with stage("extract.c"):
+            pass
+    assert read_report("run_report.jsonl")[-1]["status"] == "failed"
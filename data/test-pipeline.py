@@ -1,6 +1,9 @@
 import os
-from sqlalchemy import create_engine, inspect
-import pytest  # noqa: F401
+from sqlalchemy import create_engine, inspect, text
+import pytest
+
+from charts_ingest import CHART_COUNTRIES_TABLE, COUNTRY_CHARTS_TABLE
+from db_schema import COUNTRY_CHART_TABLES, EXPECTED_TABLES
 
 
 def test_db():
@@ -10,18 +13,25 @@ def test_db():
     engine = create_engine("sqlite:///../data.sqlite")
     inspector = inspect(engine)
 
-    expected_tables = [
-        "cloud_data",
-        "rain_data",
-        "temperature_data",
-        "wind_data",
-        "audio_features",
-        "spotify_data"
-    ]
-
     table_names = inspector.get_table_names()
 
     # Check if all expected tables exist in the database
-    for table_name in expected_tables:
+    for table_name in EXPECTED_TABLES:
         assert table_name in table_names
     print("Success!")
+
+
+def test_db_countries():
+    engine = create_engine("sqlite:///../data.sqlite")
+    table_names = inspect(engine).get_table_names()
+    # Only a run with "--countries" stores the charts of other countries
+    if CHART_COUNTRIES_TABLE not in table_names:
+        pytest.skip("the database was built without --countries")
+
+    for table_name in COUNTRY_CHART_TABLES:
+        assert table_name in table_names
+    with engine.connect() as connection:
+        stored = {row[0] for row in connection.execute(text(f"SELECT country FROM {CHART_COUNTRIES_TABLE} WHERE stored = 1"))}
+        charted = {row[0] for row in connection.execute(text(f"SELECT DISTINCT country FROM {COUNTRY_CHARTS_TABLE}"))}
+    # every country recorded as stored has charts
+    assert stored and stored <= charted
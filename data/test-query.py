@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from db_schema import append_rows
+from query import iter_query, query
+from rollups import ensure_rollup
+
+
+@pytest.fixture
+def db_uri(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'data.sqlite'}"
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2020-01-01", "2020-03-31 18:00", freq="6H")
+    wind = pd.DataFrame({
+        "stations_id": np.repeat([1, 2, 3], len(timestamps)),
+        "mess_datum": np.tile(timestamps, 3),
+        "windrichtung": rng.integers(0, 360, 3 * len(timestamps)),
+        "windstaerke": rng.integers(0, 9, 3 * len(timestamps)),
+    })
+    wind.loc[::7, "windstaerke"] = -999
+    charts = pd.DataFrame({"date": np.repeat(pd.date_range("2020-01-01", periods=10), 5), "position": np.tile(range(1, 6), 10),
+                           "track_id": [f"t{i % 7}" for i in range(50)], "title": "x", "artist": "y"})
+    engine = sa.create_engine(uri)
+    with engine.begin() as connection:
+        append_rows(connection, "wind_data", wind)
+        append_rows(connection, "spotify_data", charts)
+        ensure_rollup(connection, "wind_data", ["windrichtung", "windstaerke"])
+    engine.dispose()
+    return uri
+
+
+def test_pushes_down_columns_dates_and_stations(db_uri):
+    df = query(db_uri, "wind_data", ["mess_datum", "windstaerke"], start="2020-02-01", end="2020-03-01", stations=[2])
+    assert list(df.columns) == ["mess_datum", "windstaerke"]
+    assert len(df) == 29 * 4
+    assert df["mess_datum"].min() == pd.Timestamp("2020-02-01") and df["mess_datum"].max() < pd.Timestamp("2020-03-01")
+    assert str(df["mess_datum"].dtype) == "datetime64[ns]" and str(df["windstaerke"].dtype) == "Int16"
+
+    charts = query(db_uri, "spotify_data", ["date", "position"], end="2020-01-03")
+    assert len(charts) == 10 and str(charts["position"].dtype) == "int16"
+
+
+def test_aggregates_from_rollup_and_base_table_alike(db_uri):
+    # without stations the rollup is read, with all stations the base table
+    from_rollup = query(db_uri, "wind_data", ["windstaerke"], start="2020-01-15", level="month")
+    from_base = query(db_uri, "wind_data", ["windstaerke"], start="2020-01-15", stations=[1, 2, 3], level="month")
+    assert list(from_rollup["date"]) == list(pd.to_datetime(["2020-01-01", "2020-02-01", "2020-03-01"]))
+    assert np.allclose(from_rollup["windstaerke"], from_base["windstaerke"])
+
+    raw = query(db_uri, "wind_data", ["mess_datum", "windstaerke"], start="2020-01-15", end="2020-02-01")
+    values = raw["windstaerke"].astype("float64").replace(-999, np.nan)
+    assert np.isclose(from_rollup["windstaerke"][0], values.mean())
+
+
+def test_reads_in_chunks(db_uri):
+    chunks = list(iter_query(db_uri, "wind_data", ["stations_id", "windrichtung"], chunksize=100))
+    assert max(len(chunk) for chunk in chunks) == 100
+    assert sum(len(chunk) for chunk in chunks) == len(query(db_uri, "wind_data", ["stations_id"]))
+
+
+def test_rejects_unknown_columns_and_filters(db_uri):
+    with pytest.raises(ValueError):
+        query(db_uri, "wind_data", ["windstaerke; DROP TABLE wind_data"])
+    with pytest.raises(ValueError):
+        query(db_uri, "spotify_data", stations=[1])
+    with pytest.raises(ValueError):
+        query(db_uri, "spotify_data", ["position"], level="day")
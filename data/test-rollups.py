@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from rollups import ensure_rollup, merge_batch, refresh_days
+from weather_ingest import BatchWriter
+
+VALUE_COLS: list[str] = ["windrichtung", "windstaerke"]
+
+
+def read_rollup(engine) -> pd.DataFrame:
+    return pd.read_sql("SELECT * FROM wind_data_daily ORDER BY date", engine)
+
+
+def test_duplicate_keys_count_once(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    with engine.begin() as connection:
+        ensure_rollup(connection, "wind_data", VALUE_COLS)
+
+    timestamps = pd.date_range("2020-01-01", periods=12, freq="6H")
+    rows = pd.DataFrame({"stations_id": np.repeat([1, 2], len(timestamps)), "mess_datum": np.tile(timestamps, 2),
+                         "windrichtung": np.arange(24) * 10, "windstaerke": np.arange(24) % 5})
+    # the same key three times in one chunk, and keys of earlier batches again (a replaced day and a later one)
+    same_key = pd.DataFrame({"stations_id": 1, "mess_datum": pd.Timestamp("2020-01-04"), "windrichtung": [0, 90, 180],
+                             "windstaerke": [0, -999, 3]})
+    again = rows.iloc[[0, 1, 13]].assign(windstaerke=8)
+    with BatchWriter(engine, "wind_data", batch_rows=10,
+                     on_batch=lambda connection, batch: merge_batch(connection, "wind_data", VALUE_COLS, batch)) as writer:
+        for chunk in [rows.iloc[:10], same_key, rows.iloc[10:], again]:
+            writer.write(chunk)
+
+    merged = read_rollup(engine)
+    with engine.begin() as connection:
+        refresh_days(connection, "wind_data", VALUE_COLS)
+    expected = read_rollup(engine)
+    pd.testing.assert_frame_equal(merged, expected)
+
+    day = merged.set_index("date").loc["2020-01-04"]
+    assert day["windstaerke_count"] == 1 and day["windstaerke_mean"] == 3.0
+    assert merged["windstaerke_count"].sum() == len(rows) + 1
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+import data_access
+from bench_fixtures import write_analysis_tables
+from data_access import SOURCE_TABLES, load_coded_data
+from db_schema import append_rows
+from dwd_config import data_sources
+from snapshot import load_arrays, write_snapshot
+
+
+def test_loads_memory_mapped_columns(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    charts = pd.DataFrame({"date": pd.date_range("2020-01-01", periods=4), "position": [1, 2, 1, 2],
+                           "track_id": ["b", "a", None, "b"], "title": ["x", "y", "z", "x"]})
+    with engine.begin() as connection:
+        append_rows(connection, "spotify_data", charts)
+    write_snapshot(engine, ["spotify_data"], str(tmp_path / "snapshot"))
+
+    arrays = load_arrays("spotify_data", snapshot_dir=str(tmp_path / "snapshot"))
+    stored = pd.read_sql("SELECT * FROM spotify_data", engine, parse_dates=["date"])
+    assert isinstance(arrays["position"], np.memmap) and isinstance(arrays["date"], np.memmap)
+    np.testing.assert_array_equal(arrays["position"], stored["position"])
+    np.testing.assert_array_equal(arrays["date"], stored["date"].to_numpy(dtype="datetime64[D]"))
+    assert list(arrays["track_id"].astype(object)) == list(stored["track_id"].replace({None: np.nan}))
+
+
+def test_coded_data_is_read_from_a_current_snapshot(tmp_path, monkeypatch):
+    db_uri: str = f"sqlite:///{tmp_path / 'data.sqlite'}"
+    engine = sa.create_engine(db_uri)
+    snapshot_dir: str = str(tmp_path / "snapshot")
+    write_analysis_tables(engine, data_sources)
+    monkeypatch.setattr(data_access, "_cache", {})
+    from_sqlite = load_coded_data(db_uri, snapshot_dir)
+
+    write_snapshot(engine, SOURCE_TABLES, snapshot_dir)
+    monkeypatch.setattr(data_access, "_cache", {})
+    read_coded_data = data_access._read_coded_data
+    monkeypatch.setattr(data_access, "_read_coded_data", None)
+    from_snapshot = load_coded_data(db_uri, snapshot_dir)
+    for name in ["dates", "track_ids", "weather", "audio"]:
+        np.testing.assert_array_equal(getattr(from_snapshot, name), getattr(from_sqlite, name))
+    # the chart entries may come in a different order (SQLite reads them through the covering index)
+    snapshot_order = np.lexsort((from_snapshot.positions, from_snapshot.chart_dates))
+    sqlite_order = np.lexsort((from_sqlite.positions, from_sqlite.chart_dates))
+    for name in ["chart_dates", "chart_tracks", "positions"]:
+        np.testing.assert_array_equal(getattr(from_snapshot, name)[snapshot_order], getattr(from_sqlite, name)[sqlite_order])
+
+    # an outdated snapshot is not used
+    with engine.begin() as connection:
+        append_rows(connection, "audio_features", pd.DataFrame({"track_id": ["new"], "tempo": [120.0]}))
+    monkeypatch.setattr(data_access, "_read_coded_data", read_coded_data)
+    assert "new" in load_coded_data(db_uri, snapshot_dir).track_ids
@@ -0,0 +1,58 @@
+import pytest
+import spotipy
+import time
+
+import spotify_fetcher
+from fake_spotify import FakeSpotifyServer, fake_features
+from spotify_fetcher import TokenBucket, fetch_audio_features, make_client
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(spotify_fetcher, "BACKOFF_BASE", 0.01)
+
+
+def client(server: FakeSpotifyServer, workers: int = 4) -> spotipy.Spotify:
+    sp = make_client(auth="fake-token", workers=workers)
+    sp.prefix = server.prefix
+    return sp
+
+
+def test_fetches_all_batches_despite_rate_limit():
+    track_ids = [f"track{i:04d}" for i in range(120)]
+    batches = [track_ids[i:i + 10] for i in range(0, len(track_ids), 10)]
+
+    with FakeSpotifyServer(limit=5, window=0.5, retry_after=1) as server:
+        results = dict((tuple(batch), features) for batch, features in
+                       fetch_audio_features(client(server), batches, workers=8, rate=100, max_attempts=20))
+
+    assert server.rate_limited > 0
+    assert len(results) == len(batches)
+    for batch in batches:
+        assert results[tuple(batch)] == [fake_features(track_id) for track_id in batch]
+
+
+def test_honours_retry_after():
+    with FakeSpotifyServer(limit=1, window=60, retry_after=1) as server:
+        start = time.monotonic()
+        with pytest.raises(spotipy.SpotifyException):
+            list(fetch_audio_features(client(server), [["a"], ["b"]], workers=2, rate=100, max_attempts=2))
+        # the second batch had to wait for the Retry-After pause before its last attempt
+        assert time.monotonic() - start >= 1
+        assert server.requests == 3
+
+
+@pytest.mark.parametrize("status, expected_requests", [(401, 1), (404, 1), (500, 3)])
+def test_bounded_attempts(status, expected_requests):
+    with FakeSpotifyServer(fail_status=status) as server:
+        with pytest.raises(spotipy.SpotifyException):
+            list(fetch_audio_features(client(server), [["a"]], workers=1, rate=100, max_attempts=3))
+        assert server.requests == expected_requests
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.45
@@ -0,0 +1,84 @@
+import pytest
+import threading
+import time
+
+from logger import log, stage, start_run
+from stage_graph import Node, StageMarkers, check_graph, run_graph
+
+
+@pytest.fixture(autouse=True)
+def new_run():
+    start_run()
+
+
+def recorder(calls: list, name: str, seconds: float = 0.0, fail: bool = False):
+    def fn():
+        with stage(name):
+            calls.append(name)
+            time.sleep(seconds)
+            if fail:
+                log(f"{name} failed", "error")
+    return fn
+
+
+def test_runs_dependencies_first():
+    calls = []
+    nodes = [Node("b", recorder(calls, "b"), deps=["a"]), Node("a", recorder(calls, "a")),
+             Node("c", recorder(calls, "c"), deps=["a", "b"])]
+    assert run_graph(nodes, {}) == {"a": "ok", "b": "ok", "c": "ok"}
+    assert calls == ["a", "b", "c"]
+
+
+def test_independent_branches_overlap():
+    calls = []
+    nodes = [Node(name, recorder(calls, name, seconds=0.3)) for name in ["a", "b", "c"]]
+    start = time.monotonic()
+    run_graph(nodes, {})
+    assert time.monotonic() - start < 0.6
+
+
+def test_limits_concurrent_stages_of_a_kind():
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def fn():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    run_graph([Node(f"db{i}", fn, kind="db") for i in range(4)] + [Node("io", fn)], {"db": 1})
+    assert peak == 2  # one "db" stage and the unlimited "io" stage
+
+
+def test_failed_stage_blocks_dependents_and_resumes(tmp_path):
+    markers = StageMarkers(str(tmp_path / "markers.json"))
+    calls = []
+    nodes = [Node("a", recorder(calls, "a")), Node("b", recorder(calls, "b", fail=True)),
+             Node("c", recorder(calls, "c"), deps=["a", "b"]), Node("d", recorder(calls, "d"), deps=["c"])]
+    assert run_graph(nodes, {}, markers) == {"a": "ok", "b": "failed", "c": "blocked", "d": "blocked"}
+    assert StageMarkers(markers.path).done == {"a"}
+
+    start_run()
+    calls.clear()
+    nodes[1] = Node("b", recorder(calls, "b"))
+    assert run_graph(nodes, {}, StageMarkers(markers.path)) == {"a": "done", "b": "ok", "c": "ok", "d": "ok"}
+    assert calls == ["b", "c", "d"]
+    # the graph completed, the next run starts from scratch
+    assert StageMarkers(markers.path).done == set()
+
+
+def test_raising_stage_fails():
+    def fn():
+        raise RuntimeError("boom")
+    assert run_graph([Node("a", fn), Node("b", lambda: None, deps=["a"])], {}) == {"a": "failed", "b": "blocked"}
+
+
+def test_rejects_cycles_and_unknown_dependencies():
+    with pytest.raises(ValueError):
+        check_graph([Node("a", None, deps=["b"]), Node("b", None, deps=["a"])])
+    with pytest.raises(ValueError):
+        check_graph([Node("a", None, deps=["x"])])
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import sys
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from benchmark import load_pipeline
+from db_schema import append_rows
+from fake_spotify import fake_features
+from stage_graph import StageMarkers
+from staging import staging_path
+from track_cache import create_track_cache, store_batch
+
+DB_PATH: str = "../data.sqlite"
+
+
+def digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """The pipeline with --rebuild in an empty data directory, next to a database with fetched audio features."""
+    os.makedirs(tmp_path / "data")
+    monkeypatch.chdir(tmp_path / "data")
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    engine = sa.create_engine(f"sqlite:///{DB_PATH}")
+    with engine.begin() as connection:
+        create_track_cache(connection)
+        store_batch(connection, ["a", "b"], [fake_features("a"), None])
+        append_rows(connection, "wind_data", pd.DataFrame({"stations_id": [1], "mess_datum": ["2020-01-01 06:00:00"]}))
+    engine.dispose()
+    return load_pipeline(["--rebuild"])
+
+
+def write_expected_tables(pipeline):
+    with pipeline.engine.begin() as connection:
+        for table in pipeline.expected_tables():
+            connection.execute(sa.text(f"CREATE TABLE IF NOT EXISTS {table} (x INTEGER)"))
+
+
+def test_swaps_in_a_complete_rebuild(pipeline):
+    pipeline.start_rebuild()
+    write_expected_tables(pipeline)
+    pipeline.swap_rebuilt_database({"extract.wind_data": "ok"})
+
+    assert not os.path.exists(staging_path(DB_PATH))
+    # the new database: the tables of the rebuild and the audio features copied from the old one
+    engine = sa.create_engine(f"sqlite:///{DB_PATH}")
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM wind_data", engine)["n"][0] == 0
+    assert list(pd.read_sql("SELECT track_id FROM audio_features", engine)["track_id"]) == ["a"]
+    assert sorted(pd.read_sql("SELECT track_id FROM track_cache", engine)["track_id"]) == ["a", "b"]
+
+
+def test_keeps_the_database_if_the_rebuild_is_incomplete(pipeline):
+    before: str = digest(DB_PATH)
+    pipeline.start_rebuild()
+    write_expected_tables(pipeline)
+    with pipeline.engine.begin() as connection:
+        connection.execute(sa.text("DROP TABLE stations"))
+    pipeline.swap_rebuilt_database({"extract.wind_data": "ok"})
+    assert digest(DB_PATH) == before and os.path.exists(staging_path(DB_PATH))
+
+
+def test_resumes_an_interrupted_rebuild(pipeline):
+    before: str = digest(DB_PATH)
+    pipeline.start_rebuild()
+    with pipeline.engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE wind_data_daily (x INTEGER)"))
+    StageMarkers(pipeline.markers_path).mark("extract.wind_data")
+    # a failed stage: the staging database is kept for the next run
+    pipeline.swap_rebuilt_database({"extract.wind_data": "ok", "extract.rain_data": "failed"})
+    assert digest(DB_PATH) == before
+
+    # the next run continues in the same staging file (the process was killed: nothing was disposed)
+    pipeline.start_rebuild()
+    assert sa.inspect(pipeline.engine).has_table("wind_data_daily")
+    write_expected_tables(pipeline)
+    pipeline.swap_rebuilt_database({"extract.rain_data": "ok"})
+    assert digest(DB_PATH) != before and not os.path.exists(staging_path(DB_PATH))
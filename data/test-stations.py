@@ -0,0 +1,27 @@
+import numpy as np
+import sqlalchemy as sa
+
+import stations
+from bench_fixtures import write_station_zip
+from dwd_config import data_sources
+from stations import Region, select_station_zips
+
+
+def test_parses_the_metadata_of_excluded_stations_once(tmp_path, monkeypatch):
+    data_src = data_sources[-1]
+    rng = np.random.default_rng(0)
+    paths = [write_station_zip(str(tmp_path), data_src, stations_id, rng) for stations_id in range(1, 6)]
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    region = Region(boxes=[(47, 6, 51, 15)])
+
+    inside, outside = select_station_zips(engine, data_src["name"], paths, region)
+    assert inside and outside and sorted(inside + outside) == paths
+    with engine.connect() as connection:
+        assert connection.execute(sa.text("SELECT COUNT(*) FROM stations")).scalar() == 5
+
+    # a later run with the same region reads no metadata again
+    parsed: list = []
+    read_station_metadata = stations.read_station_metadata
+    monkeypatch.setattr(stations, "read_station_metadata", lambda path: parsed.append(path) or read_station_metadata(path))
+    assert select_station_zips(engine, data_src["name"], paths, region) == (inside, outside)
+    assert parsed == []
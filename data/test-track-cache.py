@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pandas as pd
+import spotipy
+
+from benchmark import load_pipeline
+from db_schema import append_rows
+from fake_spotify import FakeSpotifyServer
+from spotify_fetcher import make_client
+
+TRACK_IDS: list[str] = [f"{i:022d}" for i in range(250)]
+UNKNOWN_IDS: set = {TRACK_IDS[3], TRACK_IDS[200]}  # tracks without audio features
+
+
+def test_resumes_an_interrupted_fetch(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "data")
+    monkeypatch.chdir(tmp_path / "data")
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    (tmp_path / "data" / "spotify_credentials.txt").write_text("fake\nfake\n")
+    pipeline = load_pipeline([])
+    # every track twice in the charts
+    charts = pd.DataFrame({"date": pd.date_range("2020-01-01", periods=2).repeat(len(TRACK_IDS)),
+                           "position": list(range(1, len(TRACK_IDS) + 1)) * 2, "track_id": TRACK_IDS * 2})
+    with pipeline.engine.begin() as connection:
+        append_rows(connection, "spotify_data", charts)
+
+    requested: list = []
+    fetch_audio_features = pipeline.fetch_audio_features
+
+    def interrupted(sp, batches, **kwargs):
+        # the connection breaks off after the first batch
+        for i, (batch, features) in enumerate(fetch_audio_features(sp, batches, workers=1, **kwargs)):
+            if i == 1:
+                raise spotipy.SpotifyException(500, -1, "connection dropped")
+            requested.extend(batch)
+            yield batch, features
+
+    with FakeSpotifyServer(unknown_ids=UNKNOWN_IDS) as server:
+        def fake_client(auth_manager):
+            sp = make_client(auth="fake-token")
+            sp.prefix = server.prefix
+            return sp
+        monkeypatch.setattr(pipeline, "make_client", fake_client)
+
+        monkeypatch.setattr(pipeline, "fetch_audio_features", interrupted)
+        pipeline.get_spotify_metadata("spotify_data")
+        assert len(requested) == 100
+
+        def recording(sp, batches, **kwargs):
+            for batch, features in fetch_audio_features(sp, batches, **kwargs):
+                requested.extend(batch)
+                yield batch, features
+        monkeypatch.setattr(pipeline, "fetch_audio_features", recording)
+        pipeline.get_spotify_metadata("spotify_data")
+        # each track was requested once over both runs, also the tracks without features
+        assert sorted(requested) == TRACK_IDS
+
+        requests: int = server.requests
+        pipeline.get_spotify_metadata("spotify_data")
+        assert server.requests == requests and len(requested) == len(TRACK_IDS)
+
+    audio = pd.read_sql("SELECT track_id FROM audio_features", pipeline.engine)
+    assert not audio["track_id"].duplicated().any() and set(audio["track_id"]) == set(TRACK_IDS) - UNKNOWN_IDS
+    cache = pd.read_sql("SELECT track_id, has_features FROM track_cache", pipeline.engine)
+    assert len(cache) == len(TRACK_IDS) and set(cache.loc[cache["has_features"] == 0, "track_id"]) == UNKNOWN_IDS
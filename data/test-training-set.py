@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from sklearn.metrics import mean_squared_error
+from sklearn.tree import DecisionTreeRegressor
+
+import data_access
+import training_set
+from bench_fixtures import write_analysis_tables
+from data_access import CodedData
+from db_schema import append_rows
+from dwd_config import data_sources
+from training_set import fit_cached, load_training_set
+
+
+def coded_data() -> CodedData:
+    weather = np.arange(3 * 7, dtype="float32").reshape(3, 7)
+    weather[2, 0] = np.nan  # a day with a missing variable
+    audio = np.array([[1] * 12, [1] * 12, [2] * 12, [np.nan] * 12], dtype="float32")  # tracks a and b are the same
+    return CodedData(
+        dates=np.arange("2020-01-01", "2020-01-04", dtype="datetime64[D]"),
+        track_ids=np.array(["a", "b", "c", "d"], dtype=object),
+        weather=weather,
+        audio=audio,
+        chart_dates=np.array([0, 0, 0, 1, 1, 2, 1], dtype="int32"),
+        chart_tracks=np.array([0, 1, 2, 2, 2, 0, 3], dtype="int32"),
+        positions=np.array([1, 1, 2, 5, 5, 1, 1], dtype="int16"),
+    )
+
+
+def test_collapses_identical_samples(monkeypatch):
+    monkeypatch.setattr(training_set, "load_coded_data", lambda db_uri: coded_data())
+    data = load_training_set("sqlite://")
+    # the entries of the incomplete day and of the track without features are left out
+    assert len(data.days) == 2 and len(data.tracks) == 2
+    samples = sorted(zip(data.day_codes, data.track_codes, data.y, data.weights))
+    assert samples == [(0, 0, 1.0, 2.0), (0, 1, 2.0, 1.0), (1, 1, 5.0, 2.0)]
+
+    # a weighted fit and its weighted error equal a fit and the error on the expanded entries
+    repeats = data.weights.astype(int)
+    x_expanded, y_expanded = np.repeat(data.x.to_numpy(), repeats, axis=0), np.repeat(data.y, repeats)
+    weighted = DecisionTreeRegressor(max_depth=1, random_state=0).fit(data.x, data.y, sample_weight=data.weights)
+    expanded = DecisionTreeRegressor(max_depth=1, random_state=0).fit(x_expanded, y_expanded)
+    np.testing.assert_array_equal(weighted.predict(data.x), expanded.predict(data.x.to_numpy()))
+    assert np.isclose(mean_squared_error(data.y, weighted.predict(data.x), sample_weight=data.weights),
+                      mean_squared_error(y_expanded, expanded.predict(x_expanded)))
+
+
+def test_fits_again_only_if_the_data_or_a_parameter_changes(tmp_path, monkeypatch):
+    db_uri: str = f"sqlite:///{tmp_path / 'data.sqlite'}"
+    engine = sa.create_engine(db_uri)
+    write_analysis_tables(engine, data_sources)
+    monkeypatch.setattr(data_access, "_cache", {})
+    model_dir: str = str(tmp_path / "models")
+
+    # fit_cached returns the given estimator if it fitted it, the stored model otherwise
+    estimator = DecisionTreeRegressor(max_depth=3, random_state=0)
+    assert fit_cached(estimator, load_training_set(db_uri), model_dir) is estimator
+    data = load_training_set(db_uri)
+    loaded = fit_cached(DecisionTreeRegressor(max_depth=3, random_state=0), data, model_dir)
+    np.testing.assert_array_equal(loaded.predict(data.x), estimator.predict(data.x))
+
+    estimator = DecisionTreeRegressor(max_depth=4, random_state=0)
+    assert fit_cached(estimator, data, model_dir) is estimator
+
+    # a new version of a source table with new rows
+    with engine.begin() as connection:
+        append_rows(connection, "spotify_data", pd.DataFrame({"date": ["2020-01-02"], "position": [11],
+                                                              "track_id": ["0000000000000000000000"]}))
+    estimator = DecisionTreeRegressor(max_depth=3, random_state=0)
+    assert fit_cached(estimator, load_training_set(db_uri), model_dir) is estimator
+    assert fit_cached(DecisionTreeRegressor(max_depth=3, random_state=0), load_training_set(db_uri),
+                      model_dir) is not estimator
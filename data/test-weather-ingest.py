@@ -0,0 +1,102 @@
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from benchmark import load_pipeline
+from bench_fixtures import write_station_zip
+from db_schema import table_versions
+from dwd_config import data_sources
+from rollups import rollup_table
+from weather_ingest import BatchWriter
+
+SOURCES: list = [data_src for data_src in data_sources if data_src["name"] in ("temperature_data", "wind_data")]
+
+
+def ingest(raw_dir, directory, monkeypatch, workers: int) -> dict:
+    """Extracts copies of the station zips with the given number of workers and returns the written tables."""
+    shutil.copytree(raw_dir, directory / "data" / "raw")
+    monkeypatch.chdir(directory / "data")
+    pipeline = load_pipeline(["--workers", str(workers)])
+    pipeline.extract_weather_sources(SOURCES)
+
+    tables: dict = {}
+    for data_src in SOURCES:
+        tables[data_src["name"]] = pd.read_sql(f"SELECT * FROM {data_src['name']} ORDER BY stations_id, mess_datum",
+                                               pipeline.engine)
+        tables[rollup_table(data_src["name"])] = pd.read_sql(f"SELECT * FROM {rollup_table(data_src['name'])} "
+                                                             "ORDER BY date", pipeline.engine)
+    tables["rejects"] = pd.read_sql("SELECT * FROM rejects ORDER BY table_name, record", pipeline.engine)
+    tables["ingest_manifest"] = pd.read_sql("SELECT source, file_name, stations_id, row_count, checksum "
+                                            "FROM ingest_manifest ORDER BY source, file_name", pipeline.engine)
+    pipeline.engine.dispose()
+    return tables
+
+
+def test_workers_write_the_same_tables(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    # the zips are written once, the checksums in the manifest would differ otherwise (zips store the write time)
+    rng = np.random.default_rng(0)
+    for data_src in SOURCES:
+        os.makedirs(tmp_path / "raw" / data_src["name"])
+        for stations_id in (1, 2, 3):
+            write_station_zip(str(tmp_path / "raw" / data_src["name"]), data_src, stations_id, rng,
+                              pd.Timestamp("2020-01-01"), pd.Timestamp("2020-03-31"))
+    single = ingest(tmp_path / "raw", tmp_path / "single", monkeypatch, workers=1)
+    pool = ingest(tmp_path / "raw", tmp_path / "pool", monkeypatch, workers=2)
+    assert all(len(single[data_src["name"]]) for data_src in SOURCES) and len(single["rejects"])
+    for table, df in single.items():
+        pd.testing.assert_frame_equal(pool[table], df, obj=table)
+
+
+def wind_rows(first: int, n: int) -> pd.DataFrame:
+    mess_datum = pd.date_range(pd.Timestamp("2020-01-01") + pd.Timedelta(hours=first), periods=n, freq="h")
+    return pd.DataFrame({"stations_id": 1, "mess_datum": mess_datum, "windrichtung": 90,
+                         "windstaerke": np.arange(first, first + n) % 12})
+
+
+def test_writes_partial_batches(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    batches: list = []
+    # 25 rows in chunks of 3: two batches of 12 rows (the first chunks that reach batch_rows) and the rest on exit
+    with BatchWriter(engine, "wind_data", batch_rows=10, on_batch=lambda connection, batch: batches.append(len(batch))) \
+            as writer:
+        for first in range(0, 25, 3):
+            writer.write(wind_rows(first, min(3, 25 - first)))
+    assert batches == [12, 12, 1] and writer.rows_written == 25
+    stored = pd.read_sql("SELECT windstaerke FROM wind_data ORDER BY mess_datum", engine)
+    assert list(stored["windstaerke"]) == list(np.arange(25) % 12)
+
+
+def test_rolls_back_a_failed_batch(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'data.sqlite'}")
+    deferred: list = []
+
+    def on_batch(connection, batch):
+        connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS batches (n INTEGER)")
+        connection.exec_driver_sql(f"INSERT INTO batches VALUES ({len(batch)})")
+
+    broken = wind_rows(15, 5)
+    broken.loc[4, "mess_datum"] = pd.NaT  # violates NOT NULL, after the append started
+    with pytest.raises(sa.exc.IntegrityError):
+        with BatchWriter(engine, "wind_data", batch_rows=10, on_batch=on_batch) as writer:
+            writer.write(wind_rows(0, 10))
+            with engine.connect() as connection:
+                versions = table_versions(connection, ["wind_data"])
+            writer.write(wind_rows(10, 5))
+            writer.defer(lambda connection: deferred.append(connection))
+            writer.write(broken)
+
+    # the rows, the work of on_batch, the deferred bookkeeping and the new version of the second batch are rolled back
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM wind_data", engine)["n"][0] == 10 and writer.rows_written == 10
+    assert list(pd.read_sql("SELECT n FROM batches", engine)["n"]) == [10] and deferred == []
+    with engine.connect() as connection:
+        assert table_versions(connection, ["wind_data"]) == versions
+
+    with BatchWriter(engine, "wind_data", batch_rows=10) as writer:
+        writer.write(broken.dropna())
+    assert pd.read_sql("SELECT COUNT(*) AS n FROM wind_data", engine)["n"][0] == 14
@@ -0,0 +1,76 @@
+# persistent cache of the track ids whose audio features were already requested from the Spotify API
+# - every fetched batch is stored in the audio_features table together with its cache entries, in one transaction,
+#   so the cache doubles as the checkpoint of an interrupted run
+# - tracks without audio features are cached as well (has_features = 0), so they are not requested again
+
+import datetime
+import pandas as pd
+import sqlalchemy as sa
+
+from db_schema import append_rows
+
+
+TRACK_CACHE_TABLE: str = "track_cache"
+AUDIO_FEATURES_TABLE: str = "audio_features"
+
+# columns of the audio_features table (in this order), "track_id" is derived from the uri
+FEATURE_COLUMNS: list[str] = ["acousticness", "danceability", "duration_ms", "energy", "instrumentalness", "key",
+                              "liveness", "loudness", "mode", "speechiness", "tempo", "track_id", "valence"]
+
+# placeholders in the charts data set that are not valid track ids, rejected by the ingest (see charts_ingest.py) but
+# still filtered here for databases that were ingested without the constraints
+INVALID_TRACK_IDS: tuple[str] = ("N\\A", "#")
+
+
+def create_track_cache(connection):
+    """Creates the track cache and seeds it with the tracks already stored in audio_features."""
+    connection.execute(sa.text(f"""
+        CREATE TABLE IF NOT EXISTS {TRACK_CACHE_TABLE} (
+            track_id TEXT PRIMARY KEY,
+            has_features INTEGER NOT NULL,
+            fetched_at TEXT NOT NULL
+        )"""))
+    if sa.inspect(connection).has_table(AUDIO_FEATURES_TABLE):
+        connection.execute(sa.text(f"""
+            INSERT OR IGNORE INTO {TRACK_CACHE_TABLE} (track_id, has_features, fetched_at)
+            SELECT DISTINCT track_id, 1, :now FROM {AUDIO_FEATURES_TABLE}"""), {"now": _now()})
+
+
+def uncached_track_ids(connection, spotify: str, limit: int = None) -> list[str]:
+    """Returns the distinct (valid) track ids of the charts table that are not in the track cache yet."""
+    invalid: str = ", ".join(f"'{track_id}'" for track_id in INVALID_TRACK_IDS)
+    rows = connection.execute(sa.text(f"""
+        SELECT track_id FROM (
+            SELECT DISTINCT TRIM(track_id) AS track_id FROM {spotify}
+            WHERE TRIM(track_id) NOT IN ({invalid})
+            {f"LIMIT {int(limit)}" if limit else ""}
+        )
+        WHERE track_id NOT IN (SELECT track_id FROM {TRACK_CACHE_TABLE})""")).fetchall()
+    return [row[0] for row in rows]
+
+
+def features_to_frame(features: list) -> pd.DataFrame:
+    """Converts an audio features API response into rows of the audio_features table."""
+    df = pd.DataFrame.from_dict([entry for entry in features if entry])
+    if df.empty:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+    # create common column "track_id"
+    df["track_id"] = df["uri"].str.rsplit(":", n=1).str[-1]
+    return df[FEATURE_COLUMNS]
+
+
+def store_batch(connection, batch: list, features: list):
+    """Appends the audio features of a batch and marks all of its track ids as fetched."""
+    df = features_to_frame(features)
+    if not df.empty:
+        append_rows(connection, AUDIO_FEATURES_TABLE, df)
+    found = set(df["track_id"])
+    fetched_at: str = _now()
+    connection.execute(
+        sa.text(f"INSERT OR REPLACE INTO {TRACK_CACHE_TABLE} (track_id, has_features, fetched_at) "
+                "VALUES (:track_id, :has_features, :fetched_at)"),
+        [{"track_id": track_id, "has_features": int(track_id in found), "fetched_at": fetched_at} for track_id in batch])
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,137 @@
+# training data and model cache of the chart-position model (see project/report_source.ipynb, section 5)
+# - built from the integer-coded data of data_access.py (daily weather from the rollups, audio features, charts)
+# - the join is kept in factorized form: one float32 row per complete day and per distinct audio feature vector plus
+#   int32 codes per chart entry, identical (day, features, position) entries are collapsed into one row with a sample weight
+# - the float32 design matrix is materialized once, trees work on float32 internally anyway, so it is never copied
+# - fitted models are stored in data/models/, keyed by a hash of the training data and the hyperparameters, so
+#   re-running the analysis loads the model instead of training it again
+#
+# usage:
+#   from training_set import fit_cached, load_training_set
+#   data = load_training_set("sqlite:///../data.sqlite")
+#   train, test = data.split(test_size=0.25, random_state=1)
+#   rfr = fit_cached(RandomForestRegressor(n_estimators=100), train)
+
+import hashlib
+import joblib
+import numpy as np
+import os
+import pandas as pd
+import sklearn
+
+from dataclasses import dataclass, field
+from sklearn.model_selection import train_test_split
+
+from data_access import AUDIO_FEATURES, CodedData, load_coded_data
+from logger import log
+
+
+MODEL_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+# hyperparameters that don't change the fitted model
+IGNORED_PARAMS: tuple[str] = ("n_jobs", "verbose")
+
+
+@dataclass
+class TrainingSet:
+    feature_names: list[str]
+    days: np.ndarray  # float32, one row of weather features per day
+    tracks: np.ndarray  # float32, one row per distinct audio feature vector
+    day_codes: np.ndarray  # int32, row of `days` per sample
+    track_codes: np.ndarray  # int32, row of `tracks` per sample
+    y: np.ndarray  # float32, chart position per sample
+    weights: np.ndarray  # float32, number of chart entries collapsed into the sample
+    _matrix: np.ndarray = field(default=None, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    @property
+    def x(self) -> pd.DataFrame:
+        """Returns the design matrix (float32) with the feature names as columns, without copying it."""
+        if self._matrix is None:
+            self._matrix = np.hstack([self.days[self.day_codes], self.tracks[self.track_codes]])
+        return pd.DataFrame(self._matrix, columns=self.feature_names, copy=False)
+
+    def subset(self, rows: np.ndarray) -> "TrainingSet":
+        """Returns the samples `rows` (the day and track rows are shared)."""
+        return TrainingSet(self.feature_names, self.days, self.tracks, self.day_codes[rows], self.track_codes[rows],
+                           self.y[rows], self.weights[rows])
+
+    def split(self, test_size: float = 0.25, random_state: int = None) -> tuple["TrainingSet", "TrainingSet"]:
+        """Splits the samples into a training and a test set, like sklearn's train_test_split."""
+        train_rows, test_rows = train_test_split(np.arange(len(self)), test_size=test_size, random_state=random_state)
+        return self.subset(train_rows), self.subset(test_rows)
+
+    def fingerprint(self) -> str:
+        """Returns a hash of the samples, their weights and the feature names."""
+        digest = hashlib.sha256(",".join(self.feature_names).encode())
+        for array in (self.days, self.tracks, self.day_codes, self.track_codes, self.y, self.weights):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+
+def load_training_set(db_uri: str) -> TrainingSet:
+    """Joins the daily weather, the charts and the audio features of the database into a weighted training set.
+
+    Days with missing weather data and tracks without audio features are left out.
+    """
+    coded: CodedData = load_coded_data(db_uri)
+    complete_days = ~np.isnan(coded.weather).any(axis=1)
+    with_features = ~np.isnan(coded.audio).any(axis=1)
+
+    # Tracks with the same audio features (e.g. re-releases) share one row
+    tracks, vector_codes = np.unique(coded.audio[with_features], axis=0, return_inverse=True)
+    day_of_date = np.full(len(coded.dates), -1, dtype="int32")
+    day_of_date[complete_days] = np.arange(complete_days.sum())
+    vector_of_track = np.full(len(coded.track_ids), -1, dtype="int32")
+    vector_of_track[with_features] = vector_codes.ravel()
+    day_codes = day_of_date[coded.chart_dates]
+    track_codes = vector_of_track[coded.chart_tracks]
+    known = (day_codes >= 0) & (track_codes >= 0)
+
+    # Collapse identical samples into one weighted sample
+    samples = np.column_stack([day_codes[known], track_codes[known], coded.positions[known]]).astype("int32")
+    samples, counts = np.unique(samples, axis=0, return_counts=True)
+    data = TrainingSet(
+        feature_names=coded.weather_names + AUDIO_FEATURES,
+        days=coded.weather[complete_days],
+        tracks=tracks,
+        day_codes=samples[:, 0],
+        track_codes=samples[:, 1],
+        y=samples[:, 2].astype("float32"),
+        weights=counts.astype("float32"),
+    )
+    log(f"Loaded {int(known.sum())} chart entries as {len(data)} weighted samples ({len(data.days)} days, "
+        f"{len(data.tracks)} distinct audio feature vectors)")
+    return data
+
+
+def model_key(estimator, data: TrainingSet) -> str:
+    """Returns the cache key of a model: a hash of the estimator type, its hyperparameters and the training data."""
+    params: dict = {name: value for name, value in estimator.get_params().items() if name not in IGNORED_PARAMS}
+    digest = hashlib.sha256(f"{type(estimator).__name__} {sorted(params.items())!r} {sklearn.__version__}".encode())
+    digest.update(data.fingerprint().encode())
+    return digest.hexdigest()[:16]
+
+
+def fit_cached(estimator, data: TrainingSet, model_dir: str = MODEL_DIR):
+    """Fits the estimator on the weighted training set, or returns the model fitted by an earlier run."""
+    path: str = os.path.join(model_dir, f"{type(estimator).__name__}_{model_key(estimator, data)}.joblib")
+    if os.path.exists(path):
+        try:
+            model = joblib.load(path)
+            log(f"Loaded {type(estimator).__name__} from {path}")
+            return model
+        except:
+            log(f"Could not load {path}, fitting the model again", "warning")
+
+    estimator.fit(data.x, data.y, sample_weight=data.weights)
+    try:
+        os.makedirs(model_dir, exist_ok=True)
+        # Write a new file and swap it in, so an interrupted run never leaves a corrupt model file
+        joblib.dump(estimator, path + ".tmp")
+        os.replace(path + ".tmp", path)
+    except OSError:
+        log(f"Could not store the model in {path}", "warning")
+    return estimator
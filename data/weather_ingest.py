@@ -0,0 +1,173 @@
+# streaming reader and batched writer for DWD (German Weather Service) station archives
+# - only the configured columns are parsed, in chunks of bounded size, with the dtypes declared in dwd_config.py
+# - rows outside of the observation period are dropped on the raw integers, before any datetime conversion, missing
+#   value sentinels are stored as NULL
+# - rows below the minimum quality level or with implausible values are rejected by the constraints of the data source
+#   (see constraints.py), in one vectorized pass per chunk, and can be collected for the rejects table
+# - rows are appended to SQLite in large transactions instead of one transaction per station file
+# - zips can be decoded in a process pool while a single writer (the calling process) appends to SQLite
+
+import collections
+import pandas as pd
+import zipfile
+
+from concurrent.futures import Executor, Future
+from typing import Iterable, Iterator
+
+from constraints import RangeConstraint, check_constraints
+from db_schema import append_rows
+from dwd_config import MIN_QUALITY, SENTINELS
+
+
+CHUNK_ROWS: int = 100_000  # rows parsed at once per member file
+BATCH_ROWS: int = 500_000  # rows per SQLite transaction
+
+
+def date_bounds(start_date: pd.Timestamp, end_date: pd.Timestamp, date_format: str) -> tuple[int, int]:
+    """Returns the observation period as integers in the MESS_DATUM format (YYYYMMDD or YYYYMMDDHH)."""
+    return int(start_date.strftime(date_format)), int(end_date.strftime(date_format))
+
+
+def parse_mess_datum(values: pd.Series, date_format: str) -> pd.Series:
+    """Converts integer MESS_DATUM values to datetimes with integer arithmetic (no conversion to strings)."""
+    hours = values % 100 if date_format == "%Y%m%d%H" else 0
+    days = values // 100 if date_format == "%Y%m%d%H" else values
+    return pd.to_datetime({"year": days // 10000, "month": days // 100 % 100, "day": days % 100, "hour": hours})
+
+
+def read_dtypes(data_src: dict) -> dict:
+    """Returns the dtypes that the columns of a data source are parsed with."""
+    return {"STATIONS_ID": "int32", "MESS_DATUM": "int64", data_src["quality_column"]: "Int16", **data_src["dtypes"]}
+
+
+def weather_constraints(data_src: dict, min_quality: int = MIN_QUALITY) -> list:
+    """Returns the constraints of the rows of a data source: the minimum quality level and the ranges of its values."""
+    quality = RangeConstraint(data_src["quality_column"], lower=data_src.get("min_quality", min_quality), nullable=False,
+                              name="quality")
+    return [quality] + [RangeConstraint(col, lower, upper) for col, (lower, upper) in data_src.get("ranges", {}).items()]
+
+
+def read_station_zip(zip_path: str, data_src: dict, start_date: pd.Timestamp, end_date: pd.Timestamp,
+                     chunksize: int = CHUNK_ROWS, rejects: list = None) -> Iterator[pd.DataFrame]:
+    """Yields the cleaned and renamed rows of all data members of a station zip in chunks.
+
+    The rejected rows of each chunk are appended to `rejects`, if given (see filter_chunk).
+    """
+    dtypes: dict = read_dtypes(data_src)
+    constraints: list = weather_constraints(data_src)
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        # Get a list of member files contained in the zip file (excluding metadata files)
+        member_files = [member for member in zip_ref.namelist() if not member.startswith("Metadaten_")]
+        for member in member_files:
+            with zip_ref.open(name=member, mode="r") as tmpfile:
+                # The dtypes are given up front, so pandas neither infers them nor converts columns afterwards
+                reader = pd.read_csv(tmpfile, sep=";", usecols=lambda col: col in dtypes, dtype=dtypes,
+                                     chunksize=chunksize)
+                for chunk in reader:
+                    chunk, rejected = filter_chunk(chunk, data_src, start_date, end_date, constraints)
+                    if rejects is not None and not rejected.empty:
+                        rejects.append(rejected)
+                    if not chunk.empty:
+                        yield chunk
+
+
+def decode_station_zip(zip_path: str, data_src: dict, start_date: pd.Timestamp, end_date: pd.Timestamp,
+                       chunksize: int = CHUNK_ROWS) -> tuple[list[pd.DataFrame], list[pd.DataFrame]]:
+    """Decodes a whole station zip into the same chunks as read_station_zip and its rejected rows, for use in a worker
+    process."""
+    rejects: list[pd.DataFrame] = []
+    return list(read_station_zip(zip_path, data_src, start_date, end_date, chunksize, rejects)), rejects
+
+
+def stream_station_zip(zip_path: str, data_src: dict, start_date: pd.Timestamp, end_date: pd.Timestamp,
+                       chunksize: int = CHUNK_ROWS) -> tuple[Iterator[pd.DataFrame], list[pd.DataFrame]]:
+    """Like decode_station_zip, but the chunks are read lazily. The rejected rows are complete once they are consumed."""
+    rejects: list[pd.DataFrame] = []
+    return read_station_zip(zip_path, data_src, start_date, end_date, chunksize, rejects), rejects
+
+
+def submit_ordered(executor: Executor, fn, args: Iterable[tuple], window: int) -> Iterator[Future]:
+    """Submits fn(*args) for each entry and yields the futures in submission order.
+
+    At most `window` tasks are submitted ahead of the consumer, which bounds the memory held by finished results.
+    """
+    pending: collections.deque = collections.deque()
+    for task_args in args:
+        pending.append(executor.submit(fn, *task_args))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def filter_chunk(chunk: pd.DataFrame, data_src: dict, start_date: pd.Timestamp, end_date: pd.Timestamp,
+                 constraints: list = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Applies the parsing rules of a data source (see dwd_config.py) to a parsed chunk.
+
+    Rows outside of the observation period are dropped before anything is converted, sentinels become NULL, the
+    columns are renamed and the rows are checked against the constraints (default: weather_constraints). Returns the
+    valid rows and the rejected rows, which keep the quality column.
+    """
+    cols: list[str] = data_src["columns"]
+    mess_datum = chunk["MESS_DATUM"]
+    lower, upper = date_bounds(start_date, end_date, data_src["date_format"])
+    keep = (mess_datum >= lower) & (mess_datum <= upper)
+
+    # Keep the configured column order, the quality column is only needed for the constraints
+    chunk = chunk.loc[keep, [col for col in cols + [data_src["quality_column"]] if col in chunk.columns]]
+    values = [col for col in cols[2:] if col in chunk.columns]
+    chunk[values] = chunk[values].mask(chunk[values].isin(SENTINELS))
+
+    # Rename columns to a more readable format and convert mess_datum to datetime format
+    chunk = chunk.rename(columns=dict(zip(cols, data_src["new_columns"])))
+    chunk["mess_datum"] = parse_mess_datum(chunk["mess_datum"], data_src["date_format"])
+
+    valid, rejected = check_constraints(chunk, weather_constraints(data_src) if constraints is None else constraints)
+    return valid.drop(columns=data_src["quality_column"], errors="ignore"), rejected
+
+
+class BatchWriter:
+    """Buffers DataFrames and appends them to a table in transactions of at least `batch_rows` rows."""
+
+    def __init__(self, engine, table: str, batch_rows: int = BATCH_ROWS, on_batch=None):
+        self.engine = engine
+        self.table = table
+        self.batch_rows = batch_rows
+        self.on_batch = on_batch  # called as on_batch(connection, batch) in each batch's transaction, before the append
+        self.rows_written: int = 0
+        self._buffer: list[pd.DataFrame] = []
+        self._buffered_rows: int = 0
+        self._deferred: list = []
+
+    def write(self, df: pd.DataFrame):
+        self._buffer.append(df)
+        self._buffered_rows += len(df)
+        if self._buffered_rows >= self.batch_rows:
+            self.flush()
+
+    def defer(self, fn):
+        """Runs fn(connection) in the same transaction as the rows buffered so far, e.g. to update bookkeeping tables."""
+        self._deferred.append(fn)
+
+    def flush(self):
+        if not self._buffer and not self._deferred:
+            return
+        with self.engine.begin() as connection:
+            if self._buffer:
+                batch = pd.concat(self._buffer, ignore_index=True)
+                if self.on_batch is not None:
+                    self.on_batch(connection, batch)
+                append_rows(connection, self.table, batch)
+                self.rows_written += len(batch)
+            for fn in self._deferred:
+                fn(connection)
+        self._buffer = []
+        self._buffered_rows = 0
+        self._deferred = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
@@ -1,6 +1,7 @@
 # use Python 3.11
 import pandas as pd
-import sqlalchemy as sa
+
+from http_loader import download, load_table, read_csv_chunks
 
 # Automated data pipeline for the following source:
 # https://mobilithek.info/offers/-655945265921899037
@@ -15,14 +16,18 @@ def main():
     excel_cols = ["A", "B", "C", "M", "W", "AG", "AQ", "BA", "BK", "BU"]
     col_indices = [excel_col_to_idx(col) for col in excel_cols]
     col_names = ["date", "CIN", "name", "petrol", "diesel", "gas", "electro", "hybrid", "plugInHybrid", "others"]
-    col_sqlite_types = [sa.types.TEXT, sa.types.TEXT, sa.types.TEXT, sa.types.INTEGER, sa.types.INTEGER, sa.types.INTEGER,
-                        sa.types.INTEGER, sa.types.INTEGER, sa.types.INTEGER, sa.types.INTEGER]
+    col_sqlite_types = ["TEXT", "TEXT", "TEXT", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER"]
+
+    # Download CSV file (only if it changed since the last run), the 7 header and 4 footer lines are trimmed before parsing
+    chunks = read_csv_chunks(download(SOURCE_URI, "cars.csv"), skip_rows=7, skip_footer=4, sep=";", encoding="ISO-8859-1",
+                             usecols=col_indices, names=col_names, dtype={"CIN": str}, na_values="-")
+
+    # Write the data into the SQLite database and assign fitting types
+    load_table("cars.sqlite", "cars", (validate(df) for df in chunks), dict(zip(col_names, col_sqlite_types)))
 
-    # Download CSV file and reshape df
-    df = pd.read_csv(SOURCE_URI, sep=";", encoding="ISO-8859-1", skiprows=7, skipfooter=4, engine="python", usecols=col_indices,
-                     names=col_names, dtype={"CIN": str}, na_values="-")
 
-    # Validate data and drop invalid rows
+def validate(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops the invalid rows of a chunk."""
     # CINs are strings with 5 characters all of which are digits (and can have a leading 0)
     df = df[df["CIN"].str.match(r"\d{5}$")]
 
@@ -30,11 +35,7 @@ def main():
     df = df.dropna()
 
     mask = df.iloc[:, 3:].gt(0).any(axis=1)
-    df = df[mask]
-
-    # Write the data into the SQLite database and assign fitting types
-    engine = sa.create_engine("sqlite:///cars.sqlite")
-    df.to_sql("cars", engine, if_exists="replace", index=False, dtype=dict(zip(col_names, col_sqlite_types)))
+    return df[mask]
 
 
 def excel_col_to_idx(column):
@@ -1,10 +1,8 @@
 # use Python 3.11
-import os
 import pandas as pd
-import sqlalchemy as sa
-import time
-import urllib.request
-import zipfile
+
+from gtfs_loader import load_feed
+from http_loader import download
 
 # Automated data pipeline for the following source:
 # https://mobilithek.info/offers/110000000002933000
@@ -14,58 +12,18 @@ ZIP_FILE_NAME: str = "GTFS.zip"
 
 
 def main():
-    # download the ZIP file from SOURCE_URI
-    for attempts in range(10):
-        try:
-            urllib.request.urlretrieve(SOURCE_URI, ZIP_FILE_NAME)
-        except:
-            time.sleep(0.25 * attempts)  # backoff icreasingly
-            continue
-        else:
-            break
-
-    assert os.path.isfile(ZIP_FILE_NAME), f"{ZIP_FILE_NAME} not found - download failed"
-
-    df: pd.DataFrame = None
-
-    # pick out stops.txt from the ZIP file
-    with zipfile.ZipFile(ZIP_FILE_NAME, "r") as zip_ref:
-        with zip_ref.open(name="stops.txt", mode="r") as tmpfile:
-            df = pd.read_csv(tmpfile)
-
-    assert df is not None, f"stops.txt not found in {ZIP_FILE_NAME}"
-
-    # Only keep the columns stop_id, stop_name, stop_lat, stop_lon, zone_id
-    df = df[["stop_id", "stop_name", "stop_lat", "stop_lon", "zone_id"]]
-
-    # Adapt data types
-    df["stop_id"] = df["stop_id"].astype(int)
-    df["stop_name"] = df["stop_name"].astype(str)
-    df["stop_lat"] = df["stop_lat"].astype(float)
-    df["stop_lon"] = df["stop_lon"].astype(float)
-    df["zone_id"] = df["zone_id"].astype(int)
-
-    # Only keep stops from zone 2001
-    df = df[df["zone_id"] == 2001]
-    print(df)
-
-    # stop_lat/stop_lon must be a geographic coordinates between -90 and 90, including upper/lower bounds
-    df = df[(df["stop_lat"] >= -90) & (df["stop_lat"] <= 90)]
-    df = df[(df["stop_lon"] >= -90) & (df["stop_lon"] <= 90)]
+    # download the ZIP file from SOURCE_URI (only if it changed since the last run)
+    zip_path: str = download(SOURCE_URI, ZIP_FILE_NAME)
 
-    # assign fitting SQLite types
-    dtypes = {"stop_id": sa.types.BIGINT,
-              "stop_name": sa.types.TEXT,
-              "stop_lat": sa.types.FLOAT,
-              "stop_lon": sa.types.FLOAT,
-              "zone_id": sa.types.BIGINT}
+    # Stream stops, routes, trips, calendar and stop_times from the ZIP file into the SQLite database
+    # (typed columns, stop coordinates between -90 and 90, see gtfs_loader.py)
+    rows = load_feed(zip_path, "gtfs.sqlite", filters={"stops": only_zone_2001})
+    assert "stops" in rows, f"stops.txt not found in {ZIP_FILE_NAME}"
 
-    # Write the data into the SQLite database using pandas
-    engine = sa.create_engine("sqlite:///gtfs.sqlite")
-    df.to_sql("stops", engine, if_exists="replace", index=False, dtype=dtypes)
 
-    # delete the ZIP file
-    os.remove(ZIP_FILE_NAME)
+def only_zone_2001(df: pd.DataFrame) -> pd.DataFrame:
+    """Only keeps stops from zone 2001."""
+    return df[df["zone_id"].eq(2001).fillna(False)]
 
 
 if __name__ == "__main__":
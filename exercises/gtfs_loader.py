@@ -0,0 +1,127 @@
+# use Python 3.11
+import zipfile
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from http_loader import load_table, read_csv_chunks
+
+# Streaming loader of GTFS feeds (https://gtfs.org/schedule/reference/) into SQLite
+# - every member is read straight from the zip in chunks, with the dtypes of its SQLite column types, and loaded into
+#   its table in one transaction (see http_loader.py), stop_times.txt is by far the largest member
+# - the times of stop_times are also stored as seconds after midnight of the service day (GTFS times can be >= 24:00:00
+#   and have one-digit hours, so the text doesn't sort), the index on (stop_id, departure_seconds) answers "next
+#   departures at a stop" with a range scan
+# - stops are validated like in exercise5 (coordinates between -90 and 90), rows without their id are dropped
+
+# dtypes the SQLite column types are parsed with
+READ_DTYPES: dict[str, str] = {"BIGINT": "Int64", "INTEGER": "Int64", "FLOAT": "float64", "TEXT": "object"}
+
+
+@dataclass
+class GTFSTable:
+    member: str  # file in the zip
+    columns: dict[str, str]  # column -> SQLite type, in this order, optional columns that the feed lacks are NULL
+    required: tuple = ()  # columns without which a row is dropped
+    indexes: dict[str, tuple] = field(default_factory=dict)  # index name suffix -> indexed columns
+    clean: Callable[[pd.DataFrame], pd.DataFrame] = None  # validates or derives columns of a chunk
+
+
+def gtfs_seconds(times: pd.Series) -> pd.Series:
+    """Converts GTFS times ("H:MM:SS" or "HH:MM:SS", may be after 24:00:00) to seconds after midnight, NULL if invalid."""
+    # A timetable repeats the same few thousand times, so only the distinct values are parsed
+    codes, distinct = pd.factorize(times)
+    if not len(distinct):
+        # e.g. a chunk of stops that are not timepoints, whose times may be empty
+        return pd.Series(pd.NA, index=times.index, dtype="Int64")
+    parts = pd.Series(distinct, dtype=object).str.extract(r"^\s*(\d+):([0-5]\d):([0-5]\d)\s*$").apply(pd.to_numeric)
+    seconds = (parts[0] * 3600 + parts[1] * 60 + parts[2]).to_numpy(dtype="float64")
+    return pd.Series(np.where(codes >= 0, seconds[codes], np.nan), index=times.index).astype("Int64")
+
+
+def valid_stops(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops the stops whose coordinates are not between -90 and 90 (including the bounds)."""
+    df = df[(df["stop_lat"] >= -90) & (df["stop_lat"] <= 90)]
+    return df[(df["stop_lon"] >= -90) & (df["stop_lon"] <= 90)]
+
+
+def stop_times_seconds(df: pd.DataFrame) -> pd.DataFrame:
+    """Adds the arrival and departure times in seconds."""
+    return df.assign(arrival_seconds=gtfs_seconds(df["arrival_time"]),
+                     departure_seconds=gtfs_seconds(df["departure_time"]))
+
+
+GTFS_TABLES: dict[str, GTFSTable] = {
+    "stops": GTFSTable(
+        member="stops.txt",
+        columns={"stop_id": "BIGINT", "stop_name": "TEXT", "stop_lat": "FLOAT", "stop_lon": "FLOAT", "zone_id": "BIGINT"},
+        required=("stop_id", "stop_lat", "stop_lon"),
+        indexes={"stop_id": ("stop_id",)},
+        clean=valid_stops,
+    ),
+    "routes": GTFSTable(
+        member="routes.txt",
+        columns={"route_id": "TEXT", "agency_id": "TEXT", "route_short_name": "TEXT", "route_long_name": "TEXT",
+                 "route_type": "INTEGER"},
+        required=("route_id",),
+        indexes={"route_id": ("route_id",)},
+    ),
+    "trips": GTFSTable(
+        member="trips.txt",
+        columns={"route_id": "TEXT", "service_id": "TEXT", "trip_id": "TEXT", "trip_headsign": "TEXT",
+                 "direction_id": "INTEGER"},
+        required=("route_id", "service_id", "trip_id"),
+        indexes={"trip_id": ("trip_id",), "route_id": ("route_id",)},
+    ),
+    "calendar": GTFSTable(
+        member="calendar.txt",
+        columns={"service_id": "TEXT", "monday": "INTEGER", "tuesday": "INTEGER", "wednesday": "INTEGER",
+                 "thursday": "INTEGER", "friday": "INTEGER", "saturday": "INTEGER", "sunday": "INTEGER",
+                 "start_date": "TEXT", "end_date": "TEXT"},  # dates as YYYYMMDD
+        required=("service_id",),
+        indexes={"service_id": ("service_id",)},
+    ),
+    "stop_times": GTFSTable(
+        member="stop_times.txt",
+        columns={"trip_id": "TEXT", "arrival_time": "TEXT", "departure_time": "TEXT", "stop_id": "BIGINT",
+                 "stop_sequence": "INTEGER", "arrival_seconds": "INTEGER", "departure_seconds": "INTEGER"},
+        required=("trip_id", "stop_id", "stop_sequence"),
+        indexes={"stop_id": ("stop_id", "departure_seconds"), "trip_id": ("trip_id", "stop_sequence")},
+        clean=stop_times_seconds,
+    ),
+}
+
+
+def read_member(zip_ref: zipfile.ZipFile, spec: GTFSTable):
+    """Yields the typed and validated rows of a member of the feed in chunks."""
+    dtypes: dict = {col: READ_DTYPES[col_type] for col, col_type in spec.columns.items()}
+    # GTFS files are UTF-8, often with a byte order mark
+    for chunk in read_csv_chunks(zip_ref.open(spec.member, "r"), usecols=lambda col: col in dtypes, dtype=dtypes,
+                                 encoding="utf-8-sig", skipinitialspace=True):
+        chunk = chunk.reindex(columns=list(spec.columns))
+        chunk = chunk.dropna(subset=list(spec.required))
+        yield spec.clean(chunk) if spec.clean is not None else chunk
+
+
+def load_feed(zip_path: str, db_path: str, tables: dict[str, GTFSTable] = None,
+              filters: dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = None) -> dict[str, int]:
+    """Loads the tables of a GTFS zip (default: GTFS_TABLES) into a SQLite database and returns their row counts.
+
+    `filters` optionally restricts the rows of a table, e.g. {"stops": only_one_zone}. Members that the feed doesn't
+    have are skipped.
+    """
+    tables = GTFS_TABLES if tables is None else tables
+    filters = filters or {}
+    rows: dict[str, int] = {}
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members: set = set(zip_ref.namelist())
+        for table, spec in tables.items():
+            if spec.member not in members:
+                continue
+            chunks = read_member(zip_ref, spec)
+            if table in filters:
+                chunks = (filters[table](chunk) for chunk in chunks)
+            rows[table] = load_table(db_path, table, chunks, spec.columns, indexes=spec.indexes)
+    return rows
@@ -0,0 +1,162 @@
+# use Python 3.11
+import io
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from typing import IO, Iterable, Iterator
+
+import pandas as pd
+import sqlalchemy as sa
+
+# Shared loader of the exercise pipelines: HTTP source -> CSV chunks -> SQLite table
+# - downloads are streamed into a cache file and revalidated with a conditional GET (ETag / Last-Modified of the cached
+#   copy), an unchanged source is answered with 304 and never downloaded again
+# - header and footer lines are trimmed on the byte stream, so pandas' C parser reads the rest in chunks (read_csv's
+#   skipfooter would need the slow python engine)
+# - rows are inserted in batches with executemany into a table with declared SQLite column types, in one transaction,
+#   indexes are created after the rows are loaded (cheaper than updating them row by row)
+
+CACHE_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".http_cache")
+DOWNLOAD_CHUNK: int = 1 << 20  # bytes per read of the response
+CHUNK_ROWS: int = 50_000  # rows per CSV chunk
+BATCH_ROWS: int = 50_000  # rows per executemany
+
+
+def download(url: str, file_name: str, cache_dir: str = CACHE_DIR, attempts: int = 10, timeout: float = 60) -> str:
+    """Returns the path of the cached copy of url, downloading it only if the source changed since the last run."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path: str = os.path.join(cache_dir, file_name)
+    meta_path: str = path + ".json"
+    meta: dict = {}
+    if os.path.isfile(path) and os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    request = urllib.request.Request(url)
+    if meta.get("etag"):
+        request.add_header("If-None-Match", meta["etag"])
+    if meta.get("last_modified"):
+        request.add_header("If-Modified-Since", meta["last_modified"])
+
+    for attempt in range(attempts):
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                # Stream into a temporary file, so an interrupted download never replaces the cached copy
+                with open(path + ".part", "wb") as f:
+                    while block := response.read(DOWNLOAD_CHUNK):
+                        f.write(block)
+                os.replace(path + ".part", path)
+                meta = {"url": url, "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified")}
+                with open(meta_path, "w") as f:
+                    json.dump(meta, f)
+                return path
+        except urllib.error.HTTPError as error:
+            if error.code == 304:  # not modified
+                return path
+            if error.code < 500 or attempt == attempts - 1:
+                raise
+        except (urllib.error.URLError, OSError):
+            if attempt == attempts - 1:
+                if meta:
+                    print(f"Could not reach {url}, using the cached copy from {meta.get('last_modified') or 'an earlier run'}")
+                    return path
+                raise
+        time.sleep(0.25 * attempt)  # backoff increasingly
+    return path
+
+
+class TrimmedStream(io.RawIOBase):
+    """Binary stream of the lines of `source` without the first `skip_rows` and the last `skip_footer` lines."""
+
+    def __init__(self, source: IO[bytes], skip_rows: int = 0, skip_footer: int = 0):
+        self._lines = iter(source)
+        self._held: deque = deque()  # the last skip_footer lines read, which may turn out to be the footer
+        self._skip_footer = skip_footer
+        self._buffer = b""
+        for _ in range(skip_rows):
+            next(self._lines, None)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        # Collect whole lines until the buffer can be filled, joined once
+        lines: list[bytes] = [self._buffer]
+        collected: int = len(self._buffer)
+        while collected < len(buffer):
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._held.append(line)
+            if len(self._held) > self._skip_footer:
+                lines.append(self._held.popleft())
+                collected += len(lines[-1])
+        self._buffer = b"".join(lines)
+        size: int = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def read_csv_chunks(source, skip_rows: int = 0, skip_footer: int = 0, chunksize: int = CHUNK_ROWS,
+                    **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+    """Yields the rows of a CSV file (a path or a binary file object) in chunks, parsed by pandas' C engine.
+
+    `skip_rows` header and `skip_footer` footer lines are removed before parsing (lines, not rows: quoted values must
+    not span several lines in these parts).
+    """
+    with (open(source, "rb") if isinstance(source, (str, os.PathLike)) else source) as f:
+        stream = io.BufferedReader(TrimmedStream(f, skip_rows, skip_footer), DOWNLOAD_CHUNK)
+        with pd.read_csv(stream, chunksize=chunksize, **read_csv_kwargs) as reader:
+            yield from reader
+
+
+def load_table(db_path: str, table: str, chunks: Iterable[pd.DataFrame], column_types: dict[str, str],
+               batch_rows: int = BATCH_ROWS, indexes: dict[str, tuple] = None) -> int:
+    """Replaces a table of a SQLite database with the rows of `chunks` and returns the number of rows.
+
+    `column_types` maps the columns (in this order) to their SQLite types, e.g. {"stop_id": "BIGINT"}, `indexes` the
+    index name suffixes to the indexed columns, e.g. {"stop_id": ("stop_id",)}.
+    """
+    columns: list[str] = list(column_types)
+    definitions: str = ", ".join(f'"{col}" {col_type}' for col, col_type in column_types.items())
+    names: str = ", ".join(f'"{col}"' for col in columns)
+    insert: str = f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))})'
+    rows: int = 0
+    batch: list[pd.DataFrame] = []
+    batched: int = 0
+
+    engine = sa.create_engine(f"sqlite:///{db_path}")
+    try:
+        # One transaction: readers see either the old or the complete new table
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table}"')
+            connection.exec_driver_sql(f'CREATE TABLE "{table}" ({definitions})')
+            for chunk in chunks:
+                batch.append(chunk[columns])
+                batched += len(chunk)
+                if batched >= batch_rows:
+                    rows += _insert(connection, insert, batch)
+                    batch, batched = [], 0
+            rows += _insert(connection, insert, batch)
+            for suffix, indexed in (indexes or {}).items():
+                connection.exec_driver_sql(f'CREATE INDEX "ix_{table}_{suffix}" ON "{table}" ({", ".join(indexed)})')
+    finally:
+        engine.dispose()
+    return rows
+
+
+def _insert(connection, insert: str, batch: list) -> int:
+    if not batch:
+        return 0
+    df = pd.concat(batch, ignore_index=True)
+    if df.empty:
+        return 0
+    # sqlite3 binds Python scalars, missing values become NULL
+    df = df.astype(object).where(df.notna(), None)
+    connection.exec_driver_sql(insert, list(df.itertuples(index=False, name=None)))
+    return len(df)
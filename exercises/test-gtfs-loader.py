@@ -0,0 +1,69 @@
+import zipfile
+
+import pandas as pd
+import sqlalchemy as sa
+
+from gtfs_loader import GTFS_TABLES, gtfs_seconds, load_feed
+
+DEPARTURES: str = """
+    SELECT st.departure_time, r.route_short_name, t.trip_headsign
+    FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id JOIN routes r ON r.route_id = t.route_id
+    WHERE st.stop_id = :stop_id AND st.departure_seconds BETWEEN :start AND :end
+    ORDER BY st.departure_seconds"""
+
+
+def write_feed(path, trips: int = 40, stops: int = 25):
+    stop_rows = [f"{i},Stop {i},50.{i:02d},9.{i:02d},{2001 if i % 2 else 2002}" for i in range(stops)]
+    stop_rows.append("999,Nowhere,91.0,9.0,2001")  # invalid coordinate
+    stop_times = [f"t{trip},{(5 + trip // 10 + seq // 60)}:{seq % 60:02d}:00,{(5 + trip // 10 + seq // 60)}:{seq % 60:02d}:30,"
+                  f"{(trip + seq) % stops},{seq}" for trip in range(trips) for seq in range(stops)]
+    stop_times.append("t0,24:59:00,25:01:00,0,99")
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        zip_ref.writestr("stops.txt", "\ufeffstop_id,stop_code,stop_name,stop_lat,stop_lon,zone_id\n" + "\n".join(
+            row.replace(",", ",c,", 1) for row in stop_rows))
+        zip_ref.writestr("routes.txt", "route_id,agency_id,route_short_name,route_long_name,route_type\n"
+                         "r1,a,1,One,3\nr2,a,2,Two,3")
+        zip_ref.writestr("trips.txt", "route_id,service_id,trip_id,trip_headsign\n" + "\n".join(
+            f"r{trip % 2 + 1},s,t{trip},To {trip}" for trip in range(trips)))
+        zip_ref.writestr("calendar.txt", "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,"
+                         "end_date\ns,1,1,1,1,1,0,0,20230101,20231231")
+        zip_ref.writestr("stop_times.txt", "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n" + "\n".join(stop_times))
+
+
+def test_loads_the_feed_with_indexes(tmp_path):
+    write_feed(tmp_path / "GTFS.zip")
+    db_path = str(tmp_path / "gtfs.sqlite")
+    rows = load_feed(str(tmp_path / "GTFS.zip"), db_path)
+    assert rows == {"stops": 25, "routes": 2, "trips": 40, "calendar": 1, "stop_times": 40 * 25 + 1}
+
+    engine = sa.create_engine(f"sqlite:///{db_path}")
+    with engine.connect() as connection:
+        late = connection.execute(sa.text("SELECT departure_seconds FROM stop_times WHERE stop_sequence = 99")).scalar()
+        assert late == 25 * 3600 + 60
+        departures = connection.execute(sa.text(DEPARTURES), {"stop_id": 3, "start": 6 * 3600, "end": 7 * 3600}).fetchall()
+        assert len(departures) == 10 and departures[0][0] == "6:09:30"
+        plan_rows = connection.execute(sa.text("EXPLAIN QUERY PLAN " + DEPARTURES), {"stop_id": 3, "start": 0, "end": 1})
+        plan = " ".join(row[3] for row in plan_rows)
+    assert "ix_stop_times_stop_id" in plan and "ix_trips_trip_id" in plan and "ix_routes_route_id" in plan
+
+
+def test_filters_and_times(tmp_path):
+    write_feed(tmp_path / "GTFS.zip")
+    db_path = str(tmp_path / "gtfs.sqlite")
+    load_feed(str(tmp_path / "GTFS.zip"), db_path, filters={"stops": lambda df: df[df["zone_id"] == 2001]})
+    stops = pd.read_sql("SELECT * FROM stops", sa.create_engine(f"sqlite:///{db_path}"))
+    assert len(stops) == 12 and set(stops["zone_id"]) == {2001}
+
+    times = pd.Series(["5:10:00", " 25:01:02", "bad", None, "12:60:00", "5:10:00"])
+    assert gtfs_seconds(times).tolist() == [18600, 90062, pd.NA, pd.NA, pd.NA, 18600]
+    assert gtfs_seconds(pd.Series([None, None], dtype=object)).tolist() == [pd.NA, pd.NA]
+
+
+def test_loads_stop_times_without_times(tmp_path):
+    # stops that are not timepoints may have empty times, here every time of the chunk
+    with zipfile.ZipFile(tmp_path / "untimed.zip", "w") as zip_ref:
+        zip_ref.writestr("stop_times.txt", "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                         "t0,,,1,1\nt0,,,2,2")
+    tables = {"stop_times": GTFS_TABLES["stop_times"]}
+    rows = load_feed(str(tmp_path / "untimed.zip"), str(tmp_path / "gtfs.sqlite"), tables=tables)
+    assert rows == {"stop_times": 2}
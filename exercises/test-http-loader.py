@@ -0,0 +1,79 @@
+import hashlib
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from http_loader import download, load_table, read_csv_chunks
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves the files of the server with ETags and answers conditional GETs with 304."""
+
+    def do_GET(self):
+        body: bytes = self.server.files[self.path]
+        etag: str = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.sent += 1
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.files, server.sent = {}, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_downloads_only_changed_sources(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.csv"
+    server.files["/data.csv"] = b"a;b\n1;2\n"
+    path = download(url, "data.csv", cache_dir=str(tmp_path))
+    assert download(url, "data.csv", cache_dir=str(tmp_path)) == path and server.sent == 1
+
+    server.files["/data.csv"] = b"a;b\n3;4\n"
+    download(url, "data.csv", cache_dir=str(tmp_path))
+    assert server.sent == 2 and open(path, "rb").read() == b"a;b\n3;4\n"
+
+    # the cached copy is used while the source can't be reached
+    server.shutdown()
+    server.server_close()
+    assert download(url, "data.csv", cache_dir=str(tmp_path), attempts=1) == path
+
+
+def test_trims_header_and_footer_with_the_c_parser():
+    lines = ["title", "source: somewhere", "a;b;c"] + [f"{i};{i * 0.5};x{i}" for i in range(1000)] + ["", "footer 1", "note"]
+    data = "\n".join(lines).encode("latin-1")
+    expected = pd.read_csv(io.BytesIO(data), sep=";", skiprows=2, skipfooter=3, engine="python")
+    chunks = list(read_csv_chunks(io.BytesIO(data), skip_rows=2, skip_footer=3, chunksize=300, sep=";"))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+
+def test_loads_typed_batches(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    chunks = [pd.DataFrame({"id": [i, i + 1], "value": [0.5, None], "name": ["x", None], "extra": 1}) for i in range(0, 10, 2)]
+    assert load_table(db_path, "things", chunks, {"id": "BIGINT", "value": "FLOAT", "name": "TEXT"}, batch_rows=3) == 10
+
+    engine = sa.create_engine(f"sqlite:///{db_path}")
+    with engine.connect() as connection:
+        columns = connection.exec_driver_sql("PRAGMA table_info(things)").fetchall()
+        assert [(row[1], row[2]) for row in columns] == [("id", "BIGINT"), ("value", "FLOAT"), ("name", "TEXT")]
+        rows = connection.exec_driver_sql("SELECT typeof(id), typeof(value), typeof(name) FROM things").fetchall()
+    assert set(rows) == {("integer", "real", "text"), ("integer", "null", "null")}
@@ -3,3 +3,25 @@
 cd data
 python pull-data.py --test
 pytest -k test_db test-pipeline.py
+pytest test-ftp-pool.py
+pytest test-current-weather.py
+pytest test-spotify-fetcher.py
+pytest test-track-cache.py
+pytest test-benchmark.py
+pytest test-logger.py
+pytest test-stage-graph.py
+pytest test-binned-stats.py
+pytest test-db-schema.py
+pytest test-data-access.py
+pytest test-training-set.py
+pytest test-snapshot.py
+pytest test-staging.py
+pytest test-ingest-manifest.py
+pytest test-query.py
+pytest test-stations.py
+pytest test-weather-ingest.py
+pytest test-rollups.py
+pytest test-constraints.py
+pytest test-charts-ingest.py
+pytest ../exercises/test-http-loader.py
+pytest ../exercises/test-gtfs-loader.py